@@ -2,34 +2,89 @@
 
 import os
 import sys
-import subprocess
-import secrets
-import yaml
-import pathlib
-import shutil
-import tempfile
+import json
+import hashlib
+import re
+import threading
+import time
+
+
+class LazyModule:
+    """ Stands in for a module until it is first used, then imports it and
+    takes its place among the globals. Keeps the startup of short commands
+    (and of the agent client, see Agent) from paying for imports they don't use.
+    """
+    def __init__( self, name ):
+        self.name = name
+
+    def __getattr__( self, attr ):
+        import importlib
+        importlib.import_module( self.name )
+        top = self.name.split( "." )[ 0 ]
+        globals()[ top ] = sys.modules[ top ]
+        return getattr( sys.modules[ top ], attr )
+
+asyncio = LazyModule( "asyncio" )
+concurrent = LazyModule( "concurrent.futures" )
+inspect = LazyModule( "inspect" )
+pathlib = LazyModule( "pathlib" )
+random = LazyModule( "random" )
+secrets = LazyModule( "secrets" )
+shutil = LazyModule( "shutil" )
+subprocess = LazyModule( "subprocess" )
+tempfile = LazyModule( "tempfile" )
+urllib = LazyModule( "urllib.parse" )
 
 program_title = "CornCob protocol Git remote helper work-a-like"
 
 class Corncob:
 
+    # Max number of bundles downloaded at the same time
+    fetch_workers = 4
+
+    # Max number of bundles added to the repo at the same time. The cores
+    # are shared out between them (index-pack --threads).
+    apply_workers = os.cpu_count() or 1
+
+    # How many times push rebases onto concurrent pushes before giving up
+    publish_attempts = 20
+
+    # Times push runs `git bundle create` for an upload that keeps failing
+    upload_attempts = 3
+
+    # Seconds between polls in `watch`, doubling up to the max while nothing changes
+    watch_interval = 2
+    watch_max_interval = 60
+
     def __init__( self, remote_name ):
         self.remote_name = remote_name
         self.url = None
+        self.remote = None
+        self.git = GitPlumbing( self )
+        # Commits that bundles already planned for download will bring; see commits_present
+        self.promised = set()
+        self.index = None
+        # The Agent this runs under, if any
+        self.agent = None
 
     def main( self, cmd, dotdotdot ):
+        with trace.span( f"corncob {cmd}", "command", remote=self.remote_name, args=dotdotdot ) as span:
+            result = self.run_command( cmd, dotdotdot )
+            span.set( exit_code=result )
+        return result
+
+
+    def run_command( self, cmd, dotdotdot ):
         if cmd == "clone":
             if len( dotdotdot ) < 1:
                 print( f"ERROR: clone requires a URL ({program_title})" )
                 return -1
-            return self.clone_from_remote( dotdotdot[ 0 ] )
+            return self.clone_from_remote( dotdotdot[ 0 ], dotdotdot[ 1: ] )
 
         result = self.change_to_root_git_dir()
         if result != 0:
             return result
 
-        print( f"Hello World! {cmd} {self.remote_name} {dotdotdot}" )
-
         if cmd == "add":
             if len( dotdotdot ) < 1:
                 print( f"ERROR: remote-add requires a URL ({program_title})" )
@@ -38,13 +93,19 @@ class Corncob:
             return 0
         elif cmd == "remove":
             return self.remove_remote( dotdotdot )
+        elif cmd == "fetch" and "--all" in dotdotdot:
+            return self.fetch_all()
+        elif cmd == "watch":
+            return self.watch( ( [] if None == self.remote_name else [ self.remote_name ] ) + dotdotdot )
+        elif cmd == "agent":
+            return Agent.main( self, ( [] if None == self.remote_name else [ self.remote_name ] ) + dotdotdot )
 
         
         self.initialize_existing_remote()
         if self.url == None:
             return -1
 
-        self.remote = CornCobRemote.init( self.url )
+        self.remote = self.open_remote( self.url )
 
         if cmd == "push":
             return self.push_to_remote( dotdotdot )
@@ -52,89 +113,167 @@ class Corncob:
             return self.fetch_from_remote( dotdotdot )
         elif cmd == "merge":
             return self.merge_from_remote( dotdotdot )
+        elif cmd == "compact":
+            return self.compact_remote( dotdotdot )
+        elif cmd == "deepen":
+            return self.deepen()
+        elif cmd == "status":
+            return self.status()
         else:
             print( f"ERROR: Unknown command '{cmd}' ({program_title})" )
+            return -1
+
+
+    def open_remote( self, url ):
+        """ CornCobRemote for `url`, reading through the repo's cache
+        (.git/corncob/cache) unless git config corncob.cacheSize is 0,
+        and writing new bundles to its chunk store if corncob.chunkStore is set.
+        Under an agent, the same one every time.
+        """
+        if None != self.agent and url in self.agent.remotes:
+            return self.agent.remotes[ url ]
+
+        git_dir = self.git.git_dir()
+        result = self.gitCmd( [ "config", "--int", "--default", CorncobCache.default_size, "--get", "corncob.cacheSize" ] )
+        max_bytes = int( result.stdout.strip() )
+        cache = None
+        if 0 < max_bytes:
+            cache = CorncobCache( os.path.join( git_dir, "corncob", "cache" ), max_bytes )
+
+        remote = CornCobRemote.init( url, cache )
+        result = self.gitCmd( [ "config", "--bool", "--default", "false", "--get", "corncob.chunkStore" ] )
+        if "true" == result.stdout.strip():
+            remote = ChunkStoreRemote( remote )
+        if None != cache:
+            remote = CachedRemote( remote, cache )
+        if None != self.agent:
+            self.agent.remotes[ url ] = remote
+        return remote
 
 
     def add_remote( self, url, dotdotdot ):
         """Add a CornCob remote
 
         :param remote: The nickname for the remote
-        :param url: The URL for the remote. (This should not include 'corncob:')
+        :param url: The URL for the remote. (This should not include 'corncob::')
 
-        Currently the only supported URL schema is file://
+        Currently the supported URL schemas are file:// and http(s)://
         In the fullness of time the idea is to support googledrive: , etc
 
-        This function adds 2 remotes to the underlying repo:
-        - One with the actual remote URL
-          - This one is never directly `git fetch`d or `git push`d or whatever
-        - One with a temp bundle name
-          - When pulling from a remote, the bundle is copied here and `git fetch`d
+        This function adds a remote to the underlying repo, with the actual
+        remote URL, as corncob::<url>
+        - With git-remote-corncob on PATH, plain `git fetch`/`git push` work on it
+
+        Fetched branches go under refs/remotes/<name>-corncob-bundle-tmp/,
+        which needs no remote of its own. (Older versions registered one,
+        with a URL nothing writes to, which broke `git fetch --all`.)
         """
 
-        self.gitCmd( [ "remote", "add", self.remote_name, f"corncob:{url}" ] )
+        self.gitCmd( [ "remote", "add", self.remote_name, f"corncob::{url}" ] )
         print( f"Added remote '{self.remote_name}' ({url})" )
 
-        [ bundle_remote, path ] = self.bundle_tmp()
-        self.gitCmd( [ "remote", "add", bundle_remote, f"{path}/fetch.bundle" ] )
-        print( f"Added remote '{bundle_remote}' ({path})" )
-
 
     def remove_remote( self, dotdotdot ):
-        """Remove a CornCob remote
+        """Remove a CornCob remote, and the branches fetched from it
         """
 
-        result1 = self.gitCmd( [ "remote", "remove", self.remote_name ], False )
-        if 0 == result1.returncode:
+        result = self.gitCmd( [ "remote", "remove", self.remote_name ], False )
+        if 0 == result.returncode:
             print( f"Removed remote '{self.remote_name}'" )
 
         [ bundle_remote, _ ] = self.bundle_tmp()
-        result2 = self.gitCmd( [ "remote", "remove", bundle_remote ] )
-        if 0 == result2.returncode:
-            print( f"Removed remote '{bundle_remote}'" )
-
-        if 0 != result1.returncode:
-            return result1.returncode
-
-        if 0 != result2.returncode:
-            return result2.returncode
+        if bundle_remote in self.gitCmd( [ "remote" ] ).stdout.split():
+            # Added by an older version; removing it deletes its branches too
+            self.gitCmd( [ "remote", "remove", bundle_remote ] )
+        else:
+            refs = self.gitCmd( [ "for-each-ref", "--format=%(refname)", f"refs/remotes/{bundle_remote}/" ] ).stdout.split()
+            if 0 < len( refs ):
+                self.gitCmd( [ "update-ref", "--stdin" ], stdin_text="".join( f"delete {ref}\n" for ref in refs ) )
+        print( f"Removed branches 'refs/remotes/{bundle_remote}/'" )
 
-        return 0
+        return result.returncode
 
 
     def initialize_existing_remote( self ):
         """ git remote get-url `remote_name`
-        with some error checking. Plus strip the 'corncob:' prefix,
+        with some error checking. Plus strip the 'corncob::' prefix
+        (or 'corncob:', as written by older versions)
         """
         self.url = None
-        result = self.gitCmd( [ "remote", "get-url", self.remote_name ], False )
-        if 0 != result.returncode:
-            return
-
-        remote_url = result.stdout.strip()
+        if None != self.agent:
+            remote_url = self.agent.remote_urls().get( self.remote_name )
+            if None == remote_url:
+                print( f"ERROR: No such remote '{self.remote_name}' ({program_title})" )
+                return
+        else:
+            result = self.gitCmd( [ "remote", "get-url", self.remote_name ], False )
+            if 0 != result.returncode:
+                return
+            remote_url = result.stdout.strip()
 
-        if not remote_url.startswith( "corncob:" ):
+        self.url = Corncob.strip_url_prefix( remote_url )
+        if None == self.url:
             print( f"ERROR: Wrong remote protocol '{remote_url}' ({program_title})" )
-            return
 
-        # Strip 'corncob:'
-        self.url = remote_url[ 8: ]
+
+    def strip_url_prefix( remote_url ):
+        """ URL of a corncob remote without its prefix. None for other remotes
+        """
+        for prefix in [ "corncob::", "corncob:" ]:
+            if remote_url.startswith( prefix ):
+                return remote_url[ len( prefix ): ]
+        return None
 
 
     def push_to_remote( self, branches ):
-        print( f"PUSH {self.remote_name} {self.url} '{branches}'" )
+        """ push <remote> [--force] [branch ...]
 
-        bundle_uid = Corncob.token_hex( 8 )
-        [ _, path_tmp ] = self.bundle_tmp()
-        os.makedirs( path_tmp, exist_ok=True )
-        bundle_path_tmp = f"{path_tmp}/B-{bundle_uid}.bundle"
+        Push the given branches (default: all local branches).
+
+        The bundle holds only what the remote doesn't have yet: every head
+        the remote is known to have (and we have locally) is excluded.
+        The new link records all of the remote's heads, and for each pushed
+        branch the head it had before (None for new branches).
+        """
+        force = "--force" in branches
+        branches = [ name for name in branches if name != "--force" ]
+        local_heads = self.git.refs( "refs/heads/" )
+        names = branches if 0 < len( branches ) else sorted( local_heads.keys() )
+        for name in names:
+            if not name in local_heads:
+                print( f"ERROR: No local branch '{name}' ({program_title})" )
+                return -1
+
+        return self.push_heads( dict( ( name, [ f"refs/heads/{name}", local_heads[ name ] ] ) for name in names ),
+                                names if force else [] )
+
+
+    def push_heads( self, updates, forced=[] ):
+        """ Point remote branches at local commits.
+        updates: { remote branch: [ local ref, sha ] }
+
+        Refused unless each remote branch's head is an ancestor of the new
+        one (it would lose commits), except for the branches in `forced`.
+        """
+        latest_link = self.get_latest_link()
+        remote_heads = {} if None == latest_link else dict( ( name, sha ) for [ name, sha ] in latest_link[ 1 ] )
+        pushed = [ name for name in sorted( updates.keys() ) if remote_heads.get( name ) != updates[ name ][ 1 ] ]
+        if 0 == len( pushed ):
+            print( "Everything up-to-date" )
+            return 0
+
+        for name in pushed:
+            if None == remote_heads.get( name ) or name in forced:
+                continue
+            if not self.is_ancestor( remote_heads[ name ], updates[ name ][ 1 ] ):
+                print( f"ERROR: Remote branch '{name}' has commits the pushed one doesn't. Fetch and merge first, or push --force ({program_title})" )
+                return -1
 
-        latest_link = self.remote.get_latest_link()
         if None == latest_link:
             link_uid = "initial-snapshot"
             link_uid_prev = "initial-snapshot"
-            prerequisites = { "main": "initial-snapshot" }
-            bundle_spec = "main"
+            prerequisites = dict( ( name, "initial-snapshot" ) for name in pushed )
+            supplement = { "seq": 0 }
             #         - - uid for this link
             #           - uid for prev link -or- "initial-snapshot"
             #           - uid for link before that, etc
@@ -156,297 +295,3907 @@ class Corncob:
             #     return 0
 
         else:
-            [ link_ids, branches, bundles, supp_data ] = latest_link
             link_uid = Corncob.token_hex( 8 )
-            link_uid_prev = link_ids[ 0 ]
-            assert( 1 == len( branches ) )
-            assert( 0 < len( link_ids ) )
-            branch = branches[ 0 ]
-            assert( "main" == branch[ 0 ] )
-            prerequisites = { "main": branch[ 1 ] }
-            tag = f"corncob_temp_tag_{'main'}"
-            self.gitCmd( [ "tag", tag, branch[ 1 ] ] )
-            bundle_spec = f"{tag}..main"
-
-        self.gitCmd( [ "bundle", "create", bundle_path_tmp, bundle_spec ] )
-
-        if None != latest_link:
-            self.gitCmd( [ "tag", "-d", tag ] )
-
-        blob = self.build_link_blob( link_uid, link_uid_prev, bundle_uid, prerequisites )
-        print( f"Pushing to Corncob clone {link_uid} '{bundle_path_tmp}' {blob}" )
-        return self.remote.upload_latest_link( link_uid, blob, bundle_uid, bundle_path_tmp )
-
-    def build_link_blob( self, new_link_uid, prev_link_uid, bundle_uid, prerequisites ):
+            link_uid_prev = latest_link[ 0 ][ 0 ]
+            prerequisites = dict( ( name, remote_heads.get( name ) ) for name in pushed )
+            supplement = self.next_link_supplement( latest_link )
+
+        known = sorted( set( remote_heads.values() ) )
+        types = self.git.object_types( known )
+        exclude = [ f"^{sha}" for sha in known if "commit" == types[ sha ] ]
+        bundle_spec = sorted( set( updates[ name ][ 0 ] for name in pushed ) ) + exclude
+
+        bundle_uid = Corncob.token_hex( 8 )
+        with trace.span( "create bundle", "phase", branches=pushed ):
+            bundle_digest = self.create_bundle( bundle_uid, bundle_spec )
+        if None == bundle_digest:
+            # The remote already has every pushed commit (e.g. a new branch
+            # at an old commit). The link alone moves the heads.
+            bundle_uid = None
+
+        heads = dict( remote_heads )
+        heads.update( ( name, updates[ name ][ 1 ] ) for name in pushed )
+
+        blob = self.build_link_blob( link_uid, link_uid_prev, bundle_uid, bundle_digest, prerequisites, heads, supplement )
+        print( f"Pushing link {link_uid} to '{self.remote_name}'" )
+        with trace.span( "publish", "phase", link=link_uid ):
+            published = self.publish_link( blob, bundle_uid, latest_link )
+        if None == published:
+            return -1
+
+        [ blob, prev_link ] = published
+        with trace.span( "update index", "phase" ):
+            self.update_remote_index( blob, prev_link )
+        if None != bundle_uid:
+            # Built against every remote head we have, so those stand for its prerequisites
+            self.local_index().add_bundles( self.url, [ [ bundle_uid, [ spec[ 1: ] for spec in exclude ], [ updates[ name ][ 1 ] for name in pushed ] ] ] )
+        return 0
+
+
+    def create_bundle( self, bundle_uid, bundle_spec ):
+        """ Upload `git bundle create` of `bundle_spec` as B-<bundle_uid>.bundle,
+        straight from git's output: no temp file, and only a chunk in
+        memory at a time. Returns the bundle's digest, or None if it would be empty.
+
+        An upload that fails part way can't be replayed, so git runs again,
+        up to upload_attempts times in all.
+        """
+        for attempt in range( Corncob.upload_attempts ):
+            try:
+                manifest = self.remote.run( self.create_bundle_async( bundle_uid, bundle_spec ) )
+                return None if None == manifest else Corncob.link_digest( manifest )
+            except RemoteFailed as exn:
+                if attempt + 1 == Corncob.upload_attempts:
+                    raise
+                print( f"WARNING: {exn}. Trying again ({program_title})" )
+
+    async def create_bundle_async( self, bundle_uid, bundle_spec ):
+        """ The upload's chunk manifest, or None if the bundle would be empty
+        """
+        params = [ "bundle", "create", "-", "--stdin" ]
+        with trace.span( "git bundle", "git", args=params ) as span:
+            proc = await asyncio.create_subprocess_exec( "git", *params, stdin=subprocess.PIPE,
+                                                         stdout=subprocess.PIPE, stderr=subprocess.PIPE )
+            errors = asyncio.create_task( proc.stderr.read() )
+            try:
+                # git reads all of stdin before it writes anything
+                proc.stdin.write( "".join( f"{rev}\n" for rev in bundle_spec ).encode( "utf-8" ) )
+                await proc.stdin.drain()
+                proc.stdin.close()
+
+                # git writes the header before it finds out the bundle is
+                # empty, so hold back the first chunk until the outcome is known
+                first = bytearray()
+                while len( first ) < 1 << 20:
+                    chunk = await proc.stdout.read( ( 1 << 20 ) - len( first ) )
+                    if b"" == chunk:
+                        break
+                    first.extend( chunk )
+
+                async def chunks():
+                    yield bytes( first )
+                    while True:
+                        chunk = await proc.stdout.read( 1 << 20 )
+                        if b"" == chunk:
+                            break
+                        yield chunk
+                    if 0 != await proc.wait():
+                        raise GitCmdFailed( params, proc.returncode, "", ( await errors ).decode() )
+
+                if len( first ) < 1 << 20 and 0 != await proc.wait():
+                    stderr = ( await errors ).decode()
+                    if "empty bundle" in stderr:
+                        return None
+                    raise GitCmdFailed( params, proc.returncode, "", stderr )
+
+                manifest = await self.remote.upload_bundle_stream_async( bundle_uid, chunks() )
+                span.set( bytes=manifest[ "size" ] )
+                return manifest
+            finally:
+                if None == proc.returncode:
+                    proc.kill()
+                    await proc.wait()
+                await errors
+
+
+    def publish_link( self, blob, bundle_uid, prev_link ):
+        """ Add `blob` to the end of the remote's chain, without locks.
+
+        Each position in the chain can be claimed only once (claim_link is an
+        atomic create-if-absent). A writer that loses the race for a position
+        rebases its link onto the winner and tries the next one; its bundle
+        stays valid, as it only assumed older heads.
+
+        Returns [ published blob, the link it follows ], or None if the
+        winner moved one of the branches this link moves (fetch and merge first).
+        The bundle (if any) must already be uploaded; it is deleted if the
+        link can't be published.
+        """
+        based_on = prev_link
+        for attempt in range( Corncob.publish_attempts ):
+            [ link_ids, _, _, supp_data ] = blob
+            # Links are created exclusively, so only "initial-snapshot" can clash
+            if self.remote.upload_link( link_ids[ 0 ], blob ):
+                winner_uid = self.remote.claim_link( supp_data[ "seq" ], link_ids[ 0 ] )
+                if winner_uid == link_ids[ 0 ]:
+                    self.remote.set_latest_link( blob )
+                    return [ blob, prev_link ]
+                self.remote.delete_link( link_ids[ 0 ] )
+            else:
+                winner_uid = link_ids[ 0 ]
+
+            print( f"Link {supp_data[ 'seq' ]} was pushed concurrently ({winner_uid}). Rebasing" )
+            prev_link = self.follow_claims( self.remote.get_link( winner_uid ) )
+            if None == prev_link:
+                break
+            blob = self.rebase_link( blob, based_on, prev_link )
+            if None == blob:
+                print( f"ERROR: The remote's branches changed concurrently. Fetch and merge first ({program_title})" )
+                if None != bundle_uid:
+                    self.remote.delete_bundle( bundle_uid )
+                return None
+
+        print( f"ERROR: Gave up publishing after {Corncob.publish_attempts} attempts ({program_title})" )
+        if None != bundle_uid:
+            self.remote.delete_bundle( bundle_uid )
+        return None
+
+
+    def is_ancestor( self, ancestor, sha ):
+        """ False also when `ancestor` isn't in the local repo
+        """
+        with trace.span( "git merge-base", "git" ):
+            result = subprocess.run( [ "git", "merge-base", "--is-ancestor", ancestor, sha ], capture_output=True )
+        return 0 == result.returncode
+
+
+    def rebase_link( self, blob, based_on, winner ):
+        """ `blob` (built on top of `based_on`) moved to follow `winner`.
+        None if the winner moved any of the branches `blob` moves.
+        """
+        [ link_ids, branches, bundles, supp_data ] = blob
+        before = {} if None == based_on else dict( ( name, sha ) for [ name, sha ] in based_on[ 1 ] )
+        heads = dict( ( name, sha ) for [ name, sha ] in winner[ 1 ] )
+        for [ name, sha ] in branches:
+            if before.get( name ) == sha:
+                continue
+            if heads.get( name ) != before.get( name ) and heads.get( name ) != sha:
+                return None
+            heads[ name ] = sha
+
+        link_uid = Corncob.token_hex( 8 )
+        supplement = self.next_link_supplement( winner )
+        if "checkpoint" in supp_data:
+            supplement[ "checkpoint" ] = supp_data[ "checkpoint" ]
+            supplement[ "last_checkpoint" ] = [ supplement[ "seq" ], link_uid, supp_data[ "checkpoint" ] ]
+            if "shallow" in supp_data:
+                supplement[ "shallow" ] = supp_data[ "shallow" ]
+        return [ [ link_uid, winner[ 0 ][ 0 ] ],
+                 [ [ name, heads[ name ] ] for name in sorted( heads.keys() ) ],
+                 bundles,
+                 supplement ]
+
+
+    def get_latest_link( self ):
+        """ The remote's latest link.
+        latest-link is only updated after a link has claimed its place in the
+        chain, so it can lag behind; follow any newer claims.
+        """
+        return self.follow_claims( self.remote.get_latest_link() )
+
+
+    def follow_claims( self, link ):
+        while None != link and "seq" in link[ 3 ]:
+            uid = self.remote.get_claim( link[ 3 ][ "seq" ] + 1 )
+            if None == uid:
+                break
+            next_link = self.remote.get_link( uid )
+            if None == next_link:
+                break
+            link = next_link
+        return link
+
+    def build_link_blob( self, new_link_uid, prev_link_uid, bundle_uid, bundle_digest, prerequisites, heads, supplement ):
+        """ bundle_digest: { "size": bytes, "sha256": hex } of the bundle; see DigestSink
+        prerequisites: { branch: head before this link }, for the branches in the bundle
+        heads: { branch: sha }, all of the remote's heads after this link
+
+        The supplement holds:
+        - seq: position in the chain (initial-snapshot is 0)
+        - checkpoint: (checkpoint links only) seq of the link whose heads
+          this link's snapshot bundle reproduces; see compact_remote
+        - shallow: (checkpoint links only) [ uid, digest ] of a bundle with
+          just the target's head commits and their trees; see clone_shallow
+        - last_checkpoint: [ seq, uid, checkpoint ] of the newest checkpoint link
+        """
         link_ids = [ new_link_uid, prev_link_uid ]
-        branch_names = self.get_branches()
-        branches = []
-        for branch in branch_names:
-            branches.append( [ branch, self.get_branch_head_sha( branch ) ] )
-        print( f"BRANCHES {branches}" )
-        bundles = [ [ bundle_uid, [ "main", prerequisites[ "main" ] ] ] ]
-        supplement = {}
+        branches = [ [ name, heads[ name ] ] for name in sorted( heads.keys() ) ]
+        bundles = []
+        if None != bundle_uid:
+            bundles.append( [ bundle_uid, [ x for ( name, sha ) in sorted( prerequisites.items() ) for x in [ name, sha ] ], bundle_digest ] )
         return [ link_ids, branches, bundles, supplement ]
 
 
-    def clone_from_remote( self, url ):
-        print( f"CLONE {self.remote_name} {url}" )
+    def link_digest( manifest ):
+        """ What a link records about a bundle, from its upload's manifest
+        """
+        digest = { "size": manifest[ "size" ], "sha256": manifest[ "sha256" ] }
+        if CornCobRemote.stored_as_chunks( manifest ):
+            digest[ "store" ] = "chunks"
+        return digest
+
+
+    def bundle_digests( bundles ):
+        """ [ [ bundle uid, digest or None ] ] for a link's bundles.
+        Links from before digests were recorded have none.
+        """
+        return [ [ bundle[ 0 ], bundle[ 2 ] if 2 < len( bundle ) else None ] for bundle in bundles ]
+
+
+    def next_link_supplement( self, prev_link ):
+        """ seq and last_checkpoint for a new link that follows `prev_link`
+        """
+        supp_data = prev_link[ 3 ]
+        if "seq" in supp_data:
+            prev_seq = supp_data[ "seq" ]
+        else:
+            # Chain written before links had positions. Number it once.
+            prev_seq = len( self.walk_chain_uids( prev_link ) ) - 1
+
+        supplement = { "seq": prev_seq + 1 }
+        if "last_checkpoint" in supp_data:
+            supplement[ "last_checkpoint" ] = supp_data[ "last_checkpoint" ]
+        return supplement
+
+
+    def walk_chain_uids( self, link ):
+        """ Link uids from `link` back to the initial snapshot, newest first
+        """
+        uids = [ link[ 0 ][ 0 ] ]
+        while "initial-snapshot" != link[ 0 ][ 0 ]:
+            link = self.remote.get_link( link[ 0 ][ 1 ] )
+            if None == link:
+                break
+            uids.append( link[ 0 ][ 0 ] )
+        return uids
+
+
+    def update_remote_index( self, blob, prev_link ):
+        """ Record in the remote's index which heads the new link introduced
+        """
+        self.write_index_entries( [ Corncob.index_entry( blob, prev_link, blob[ 3 ][ "seq" ] ) ] )
+        self.local_index().add_link( self.url, blob, latest=True )
+
+
+    def index_entry( link, prev_link, seq ):
+        """ Index entries: [ seq, link uid, [ bundle uids ], [ [ branch, sha ] ... ] ]
+        followed by the checkpoint target for checkpoint links
+        """
+        [ link_ids, branches, bundles, supp_data ] = link
+        prev_heads = {}
+        if None != prev_link:
+            prev_heads = dict( ( name, sha ) for [ name, sha ] in prev_link[ 1 ] )
+        introduced = [ [ name, sha ] for [ name, sha ] in branches if prev_heads.get( name ) != sha ]
+
+        entry = [ seq, link_ids[ 0 ], Corncob.bundle_digests( bundles ), introduced ]
+        if "checkpoint" in supp_data:
+            entry.append( supp_data[ "checkpoint" ] )
+        return entry
+
+
+    def write_index_entries( self, entries ):
+        """ Add `entries` to the local index, then to the remote's index
+        files (replacing any at the same positions).
 
+        Index files are rewritten whole, so concurrent pushers can lose each
+        other's entries. Fetch rebuilds the entries it finds missing from
+        the links and writes them back (see rebuild_index_entries), so
+        every lost entry is missed by one fetch at most.
+        """
+        shard_size = CornCobRemote.index_shard_size
+        local = self.local_index()
+        local.add_entries( self.url, entries )
+        for shard in sorted( set( e[ 0 ] // shard_size for e in entries ) ):
+            added = [ e for e in entries if shard == e[ 0 ] // shard_size ]
+            seqs = set( e[ 0 ] for e in added )
+            merged = [ e for e in self.remote.get_index( shard ) if not e[ 0 ] in seqs ] + added
+            merged.sort( key=lambda e: e[ 0 ] )
+            self.remote.upload_index( shard, merged )
+            local.add_entries( self.url, merged )
+
+
+    def clone_from_remote( self, url, options=[] ):
+        """ clone <url> [--depth N | --since <link uid>]
+
+        --depth/--since make a shallow clone, with history back to at least
+        N links ago (or the given link); see clone_shallow. `deepen` fetches the rest.
+        """
         git_cmd = [ "git", "rev-parse", "--show-toplevel" ]
         result = subprocess.run( git_cmd, capture_output=True, text=True )
         if 0 == result.returncode:
             print( f"ERROR. Trying to clone, but already in a repo '{os.getcwd()}' '{result.stdout.strip()}' ({program_title})" )
             return -1
 
+        self.url = url
         self.remote = CornCobRemote.init( url )
-        latest_link = self.remote.get_latest_link()
+        version = self.remote.latest_version()
+        latest_link = self.get_latest_link()
         if latest_link == None:
-            print( f"CLONE SADNESS" )
-            return -1
-        
-        [ link_ids, branches, bundles, supp_data ] = latest_link
-        if link_ids[ 0 ] != "initial-snapshot":
-            print( f"CLONE MORE THAN INIT {link_ids[ 0 ]}" )
+            print( f"ERROR: Nothing to clone at '{url}' ({program_title})" )
             return -1
 
-        if len( bundles ) != 1:
-            print( f"CLONE BS {bundles}" )
+        since_seq = self.history_start( latest_link, options )
+        if -1 == since_seq:
             return -1
 
-        bundle = bundles[ 0 ]
-        bundle_uid = bundle[ 0 ]
+        self.gitCmd( [ "init" ] )
+        self.add_remote( url, [] )
+        self.remote = self.open_remote( url )
 
-        with tempfile.TemporaryDirectory() as bundle_temp_dir:
-            bundle_path = f"{bundle_temp_dir}/clone.bundle"
-            self.remote.download_bundle( bundle_uid, bundle_path )
-            self.gitCmd( [ "clone", bundle_path, "." ] )
+        if None != since_seq:
+            result = self.clone_shallow( latest_link, since_seq )
+        else:
+            # Newest snapshot plus the links after it (or the whole chain, if never compacted)
+            result = self.fetch_chain( latest_link, [], True )
+        if 0 != result:
+            return result
 
-        self.gitCmd( [ "checkout", "main" ] )
+        [ link_ids, branches, bundles, supp_data ] = latest_link
+        self.update_refs( "refs/heads/", branches )
+        # The remote's main if it has one, else its first branch. With no branches, stay on the one `git init` made
+        names = [ name for [ name, _ ] in branches ]
+        if "main" in names:
+            self.gitCmd( [ "checkout", "main" ] )
+        elif 0 < len( names ):
+            self.gitCmd( [ "checkout", names[ 0 ] ] )
+        self.save_state( { self.remote_name: [ version, link_ids[ 0 ] ] } )
+        self.local_index().add_link( self.url, latest_link, latest=True )
 
-        self.add_remote( url, [] )
-        print( f"CLONE WORKED!!!" )
         return 0
-        
 
-    def fetch_from_remote( self, branches ):
-        print( f"FETCH {self.remote_name} {self.url} {branches}" )
-        latest_link = self.remote.get_latest_link()
 
-        if latest_link == None:
-            print( f"ERROR: Failed to fetch latest link '{corncob_url}' ({program_title})" )
+    def history_start( self, latest_link, options ):
+        """ Position of the oldest link a shallow clone must have the history of,
+        from --depth N or --since <link uid>. None for a full clone, -1 on error.
+        """
+        if 0 == len( options ):
+            return None
+        if 2 != len( options ) or not options[ 0 ] in [ "--depth", "--since" ]:
+            print( f"ERROR: Unknown clone options {options} ({program_title})" )
+            return -1
+        if not "seq" in latest_link[ 3 ]:
+            print( f"ERROR: The remote's links have no positions. Push with this version first ({program_title})" )
             return -1
 
-        return self.fetch_chain( latest_link, branches, False )
-
-    def fetch_chain( self, link, branches, doing_clone ):
-        [ link_ids, branches, bundles, supp_data ] = link
+        if "--depth" == options[ 0 ]:
+            if not options[ 1 ].isdigit():
+                print( f"ERROR: --depth needs a number of links ({program_title})" )
+                return -1
+            return max( 0, latest_link[ 3 ][ "seq" ] - int( options[ 1 ] ) )
 
-        if len( bundles ) != 1:
-            print( f"FETCH BS {bundles}" )
+        link = self.remote.get_link( options[ 1 ] )
+        if None == link or not "seq" in link[ 3 ]:
+            print( f"ERROR: No link '{options[ 1 ]}' ({program_title})" )
             return -1
+        return link[ 3 ][ "seq" ]
 
-        bundle = bundles[ 0 ]
-        bundle_uid = bundle[ 0 ]
-        bundle_prereqs = bundle[ 1 ]
-        if 1 != len( bundle_prereqs ) or not "main" in bundle_prereqs.keys():
-            print( f"FETCH BSP {bundles}" )
-            return -1
 
-        prereq = bundle_prereqs[ "main" ]
-        if "initial-snapshot" == prereq:
-            print( "ok?" )
-        else:
-            if doing_clone:
-                follow_chain = True
-            else:
-                result = self.gitCmd( [ "cat-file", "-t", prereq ], False )
-                follow_chain = ( "commit" != result.stdout.strip() )
+    def clone_shallow( self, latest_link, since_seq ):
+        """ Clone from the newest checkpoint's shallow snapshot (just the
+        heads of its target link, no history) plus the links after it.
+        Costs stay in proportion to the repo's size and the links since the
+        last compact, however old the project is.
 
-            if follow_chain:
-                next_link = self.remote.get_link( link_ids[ 1 ] )
-                result = self.fetch_chain( next_link, branches, doing_clone )
-                if 0 != result:
-                    return result
+        Needs a checkpoint whose target is no newer than `since_seq`;
+        otherwise (or if it predates shallow snapshots) clones everything.
+        """
+        checkpoint = latest_link[ 3 ].get( "last_checkpoint" )
+        checkpoint_link = None
+        if None != checkpoint and checkpoint[ 2 ] <= since_seq:
+            checkpoint_link = self.remote.get_link( checkpoint[ 1 ] )
+        if None == checkpoint_link or not "shallow" in checkpoint_link[ 3 ]:
+            print( "No shallow snapshot old enough on the remote (see `compact`); cloning the full history" )
+            return self.fetch_chain( latest_link, [], True )
 
-        [ tmp_remote, path_tmp ] = self.bundle_tmp()
+        heads = self.apply_shallow_snapshot( checkpoint_link[ 3 ][ "shallow" ] )
+        # The tail is planned as for a fetch, with the snapshot's heads present
+        self.promised.update( heads )
+        return self.fetch_chain( latest_link, [], False )
+
+
+    def apply_shallow_snapshot( self, shallow ):
+        """ Add a shallow snapshot ([ uid, digest ]) to the repo, and mark its
+        commits as shallow (in .git/shallow). Returns the commits.
+        """
+        [ bundle_uid, digest ] = shallow
+        [ _, path_tmp ] = self.bundle_tmp()
         os.makedirs( path_tmp, exist_ok=True )
+        path = self.remote.bundle_path( bundle_uid )
+        if None == path:
+            path = f"{path_tmp}/B-{bundle_uid}.bundle"
+            self.remote.download_bundle( bundle_uid, path, digest )
+        try:
+            with trace.span( "git index-pack", "git", bytes=os.path.getsize( path ) ):
+                pack = PackStream()
+                CornCobRemote.copy_to_sink( path, pack )
+                pack.close()
+        finally:
+            self.remove_bundle_tmp( f"{path_tmp}/B-{bundle_uid}.bundle" )
 
-        bundle_path = f"{path_tmp}/fetch.bundle"
-        self.remote.download_bundle( bundle_uid, bundle_path )
+        commits = sorted( set( sha for [ sha, _ ] in pack.refs ) )
+        shallow_file = self.gitCmd( [ "rev-parse", "--git-path", "shallow" ] ).stdout.strip()
+        with open( shallow_file, "a" ) as strm:
+            strm.write( "".join( f"{sha}\n" for sha in commits ) )
+        return commits
 
-        self.gitCmd( [ "bundle", "verify", bundle_path ] )
-        self.gitCmd( [ "fetch", tmp_remote ] )
 
-        return 0
+    def deepen( self ):
+        """ Fetch the history a shallow clone left out: the newest checkpoint's
+        full snapshot (or, without one, the whole chain).
+        """
+        shallow_file = self.gitCmd( [ "rev-parse", "--git-path", "shallow" ] ).stdout.strip()
+        if not os.path.exists( shallow_file ):
+            print( "Not a shallow clone. Nothing to deepen" )
+            return 0
 
+        latest_link = self.get_latest_link()
+        if None == latest_link:
+            print( f"ERROR: Failed to fetch latest link '{self.url}' ({program_title})" )
+            return -1
 
-    def merge_from_remote( self, branches ):
-        print( f"MERGE {self.remote_name} {branches}" )
-        branch = branches[ 0 ]
+        checkpoint = latest_link[ 3 ].get( "last_checkpoint" )
+        checkpoint_link = None if None == checkpoint else self.remote.get_link( checkpoint[ 1 ] )
+        if None != checkpoint_link:
+            bundles = Corncob.bundle_digests( checkpoint_link[ 2 ] )
+        else:
+            bundles = self.resolve_missing_links( latest_link, True )
+            if None == bundles:
+                return -1
 
-        [ tmp_remote, _ ] = self.bundle_tmp()
+        with trace.span( "fetch bundles", "phase" ):
+            result = self.fetch_plans( [ [ self, None, bundles ] ] )
+        if 0 == result:
+            # Every shallow commit's history is here now
+            os.remove( shallow_file )
+        return result
 
-        self.gitCmd( [ "merge", f"{tmp_remote}/{branch}" ] )
-        return 0
 
+    def fetch_from_remote( self, branches ):
+        [ latest_link, version ] = self.read_latest_link()
 
-    def get_branches( self ):
-        """ git for-each-ref --format=%(refname:short) refs/heads/
-        with error checking
-        """
-        result = self.gitCmd( [ "for-each-ref", "--format=%(refname:short)", "refs/heads/" ], False )
-        # cwd=repo_path, 
+        if latest_link == None:
+            print( f"ERROR: Failed to fetch latest link '{self.url}' ({program_title})" )
+            return -1
 
-        if 0 == result.returncode:
-            return result.stdout.splitlines()
+        result = self.fetch_chain( latest_link, branches, False )
+        if 0 == result:
+            self.save_state( { self.remote_name: [ version, latest_link[ 0 ][ 0 ] ] } )
+            self.local_index().add_link( self.url, latest_link, latest=True )
+        return result
 
-        return []
 
+    def read_latest_link( self ):
+        """ [ latest link, version token of the remote's latest-link ]
 
-    def get_branch_head_sha( self, branch ):
-        print( f"MLERP {branch}" )
-        result = self.gitCmd( [ "rev-parse", f"refs/heads/{branch}" ], False )
-        # cwd=repo_path,
+        If the token is the one recorded by the last fetch (see save_state),
+        nothing was published since: the latest link is the one that fetch
+        saw (usually from the cache), plus any newer claims. That saves
+        reading and parsing latest-link and walking back from it.
+        """
+        version = self.remote.latest_version()
+        seen = self.load_state().get( self.remote_name )
+        link = None
+        if None != version and None != seen and version == seen[ 0 ]:
+            link = self.follow_claims( self.remote.get_link( seen[ 1 ] ) )
+        if None == link:
+            link = self.get_latest_link()
+        return [ link, version ]
 
-        if 0 == result.returncode:
-            return result.stdout.strip()
 
-        return "0xdeadbeef"
+    def local_index( self ):
+        if None == self.index:
+            self.index = LinkIndex( os.path.join( self.git.git_dir(), "corncob", "links.sqlite" ) )
+        return self.index
 
 
-    def token_hex( num_bytes ):
-        return "".join( f"{b:02x}" for b in secrets.token_bytes( num_bytes ) )
+    def state_path( self ):
+        return os.path.join( self.git.git_dir(), "corncob", "state" )
 
+    def load_state( self ):
+        """ { remote name: [ version token, link uid ] } as of each remote's last fetch
+        """
+        try:
+            with open( self.state_path(), "r", encoding="utf-8" ) as state_strm:
+                return json.load( state_strm )
+        except ( OSError, ValueError ):
+            return {}
 
-    def change_to_root_git_dir( self ):
-        """ cd $( git rev-parse --show-toplevel )
-        with some error checking
+    def save_state( self, updates ):
+        """ Record [ version, link uid ] for each remote in `updates`.
+        The version must have been read before the link, so that a link
+        published in between only makes the next fetch read latest-link again.
         """
-        result = self.gitCmd( [ "rev-parse", "--show-toplevel" ] )
-        git_dir = result.stdout.strip()
-        os.chdir( git_dir )
-        if pathlib.Path( git_dir ).resolve() == pathlib.Path( os.getcwd() ).resolve():
-            return 0
-        print( f"ERROR. Weird os.chdir() failure? {result.stdout} {os.getcwd()} ({program_title})" )
-        return -1
+        state = self.load_state()
+        state.update( updates )
+        path = self.state_path()
+        os.makedirs( os.path.dirname( path ), exist_ok=True )
+        path_tmp = f"{path}.tmp-{Corncob.token_hex( 8 )}"
+        with open( path_tmp, "w", encoding="utf-8" ) as state_strm:
+            json.dump( state, state_strm )
+        os.replace( path_tmp, path )
 
-    def bundle_tmp( self ):
-        return [ f"{self.remote_name}-corncob-bundle-tmp",
-                 f"./.corncob-bundle-tmp/{self.remote_name}" ]
+    def fetch_chain( self, link, branches, doing_clone ):
+        """ Fetch every bundle between `link` and the local history
 
-    def gitCmd( self, git_params, raise_on_error=True ):
-        git_cmd = [ "git" ] + git_params
-        result = subprocess.run( git_cmd, capture_output=True, text=True )
-        if 0 != result.returncode:
-            exn = GitCmdFailed( git_params, result.returncode, result.stdout, result.stderr )
-            if raise_on_error:
-                raise exn
-            else:
-                print( exn )
-        return result
+        1. Work out which links we are missing
+        2. Download all their bundles concurrently
+        3. Apply them to the repo, as many at a time as their prerequisites allow
+        """
+        with trace.span( "resolve missing links", "phase" ) as span:
+            bundles = self.resolve_missing_links( link, doing_clone )
+            span.set( bundles=None if None == bundles else len( bundles ) )
+        if None == bundles:
+            return -1
 
+        with trace.span( "fetch bundles", "phase" ):
+            return self.fetch_plans( [ [ self, link, bundles ] ] )
 
-class GitCmdFailed( Exception ):
-    def __init__( self, params, exit_code, out, err ):
-        self.params = params
-        self.exit_code = exit_code
-        self.out = out
-        self.err = err
 
-    def __str__( self ):
-        return f"ERROR. git cmd failed. `git {' '.join( self.params )}` => {self.exit_code}. o:'{self.out}' e:'{self.err}'"
+    def fetch_all( self ):
+        """ fetch --all: every corncob remote of the repo at once.
 
-class CornCobRemote:
-    """ Abstract class for different kinds of remotes (Google Drive, etc)
-    """
-    @staticmethod
-    def init( url ):
-        if url.startswith( "file://" ):
-            return LocalFolderRemote( url[ 7: ].strip() )
+        The latest links are read concurrently. Then each remote's missing
+        bundles are worked out in turn, counting the heads of the remotes
+        before it as present: a bundle is only downloaded if no other
+        remote brings its commits. All downloads then run concurrently and
+        are applied in one pass. Remotes that can't be opened or read are
+        skipped.
+        """
+        peers = self.open_peers()
+        if 0 == len( peers ):
+            print( f"ERROR: No corncob remotes ({program_title})" )
+            return -1
 
-        raise NotImplementedError( f"Unsupported CornCob cloud protocol. '{corncob_url}'" )
+        def read_latest_link( peer ):
+            try:
+                return peer.read_latest_link()
+            except RemoteFailed as exn:
+                print( exn )
+                return [ None, None ]
 
-    def read_link_blob( self, yaml_strm ):
-        parsed_data = yaml.load( yaml_strm, Loader=yaml.FullLoader )
-        link_ids = parsed_data[ 0 ]
-        branches = parsed_data[ 1 ]
-        bundles = parsed_data[ 2 ]
-        for bundle in bundles:
-            ps = bundle[ 1 ]
-            bundle[ 1 ] = dict( [ ( ps[ i ], ps[ i + 1 ] ) for i in range( 0, len( ps ), 2 ) ] )
-        if len( parsed_data ) > 3:
-            supp_data = parsed_data[ 3 ]
-        else:
-            supp_data = {}
-        return [ link_ids, branches, bundles, supp_data ]
+        try:
+            with trace.span( "read latest links", "phase", remotes=len( peers ) ):
+                with concurrent.futures.ThreadPoolExecutor( len( peers ) ) as pool:
+                    [ links, versions ] = zip( *pool.map( read_latest_link, peers ) )
 
+            plans = []
+            seen = set()
+            for [ peer, link ] in zip( peers, links ):
+                if None == link:
+                    print( f"ERROR: Failed to fetch latest link '{peer.url}' ({program_title})" )
+                    continue
+                with trace.span( "resolve missing links", "phase", remote=peer.remote_name ):
+                    bundles = peer.resolve_missing_links( link, False )
+                if None == bundles:
+                    return -1
+                # Remotes can hold copies of the same bundle
+                bundles = [ bundle for bundle in bundles if not bundle[ 0 ] in seen ]
+                seen.update( bundle[ 0 ] for bundle in bundles )
+                self.promised.update( sha for [ _, sha ] in link[ 1 ] )
+                plans.append( [ peer, link, bundles ] )
+                print( f"{peer.remote_name}: {len( bundles )} bundles to fetch" )
 
-class LocalFolderRemote( CornCobRemote ):
-    """ Mostly for debugging purposes. Pretend a local folder is a cloud location.
-    """
+            with trace.span( "fetch bundles", "phase" ):
+                result = self.fetch_plans( plans )
+            if 0 == result:
+                self.save_state( dict( ( peer.remote_name, [ version, link[ 0 ][ 0 ] ] )
+                                       for [ peer, link, version ] in zip( peers, links, versions ) if None != link ) )
+                for [ peer, link ] in zip( peers, links ):
+                    if None != link:
+                        self.local_index().add_link( peer.url, link, latest=True )
+            return result
+        finally:
+            if None == self.agent:
+                for peer in peers:
+                    peer.remote.close()
 
-    def __init__( self, path ):
-        self.path = None
 
-        if not os.path.isdir( path ):
-            print( f"ERROR: File URL not a folder '{path}' ({program_title})" )
+    def open_peers( self, names=None ):
+        """ A Corncob, with its remote open, for each of the repo's corncob
+        remotes (only those in `names`, if given). They share this one's
+        GitPlumbing and promised commits. Remotes that can't be opened
+        (e.g. a missing folder) are reported and left out.
+        """
+        result = self.gitCmd( [ "config", "--get-regexp", "^remote\\..*\\.url$" ], False )
+        peers = []
+        for line in result.stdout.splitlines():
+            [ key, _, remote_url ] = line.partition( " " )
+            url = Corncob.strip_url_prefix( remote_url )
+            name = key[ len( "remote." ):-len( ".url" ) ]
+            if None == url or ( None != names and not name in names ):
+                continue
+            peer = Corncob( name )
+            peer.git = self.git
+            peer.url = url
+            try:
+                peer.remote = self.open_remote( url )
+            except RemoteFailed as exn:
+                print( f"{exn}. Skipping remote '{name}'" )
+                continue
+            peer.promised = self.promised
+            peer.index = self.local_index()
+            peers.append( peer )
+        return peers
+
+
+    def watch( self, names ):
+        """ watch [remote ...]
+
+        Fetch from the given corncob remotes (default: all of them) whenever
+        they publish a new link, until interrupted.
+
+        Each remote's version token (see read_latest_link) is polled, every
+        watch_interval seconds at first, backing off to watch_max_interval
+        while nothing changes. On Linux, folder remotes are also watched
+        with inotify, which ends the wait as soon as one's latest-link is replaced.
+        """
+        peers = self.open_peers( names or None )
+        missing = set( names ) - set( peer.remote_name for peer in peers )
+        if 0 < len( missing ) or 0 == len( peers ):
+            print( f"ERROR: Not corncob remotes: {', '.join( sorted( missing ) ) or '(none)'} ({program_title})" )
             return -1
 
-        self.path = path
+        folders = [ peer.url[ 7: ].strip() for peer in peers if peer.url.startswith( "file://" ) ]
+        watcher = FolderWatch.open( folders )
+        interval = Corncob.watch_interval
+        try:
+            while True:
+                changed = False
+                for peer in peers:
+                    seen = self.load_state().get( peer.remote_name )
+                    try:
+                        version = peer.remote.latest_version()
+                        if None != version and None != seen and version == seen[ 0 ]:
+                            continue
+                        if 0 != peer.fetch_from_remote( [] ):
+                            continue
+                    except ( RemoteFailed, GitCmdFailed ) as exn:
+                        print( exn )
+                        continue
+                    now = self.load_state().get( peer.remote_name )
+                    if None == seen or None == now or seen[ 1 ] != now[ 1 ]:
+                        print( f"{peer.remote_name}: fetched up to link {None if None == now else now[ 1 ]}", flush=True )
+                        changed = True
 
+                interval = Corncob.watch_interval if changed else min( 2 * interval, Corncob.watch_max_interval )
+                if None != watcher:
+                    watcher.wait( interval )
+                else:
+                    time.sleep( interval )
+        except KeyboardInterrupt:
+            return 0
+        finally:
+            if None != watcher:
+                watcher.close()
+            if None == self.agent:
+                for peer in peers:
+                    peer.remote.close()
 
-    def upload_latest_link( self, link_uid, blob, bundle_uid, local_bundle_path ):
-        path_bundle = f"{self.path}{os.path.sep}B-{bundle_uid}.bundle"
-        # TODO: error handling
-        shutil.copy( local_bundle_path, path_bundle )
 
-        path_latest = f"{self.path}{os.path.sep}latest-link.yaml"
-        with open( path_latest, "w", encoding="utf-8" ) as link_strm:
-            yaml.dump( blob, link_strm, default_flow_style=False )
+    def fetch_plans( self, plans ):
+        """ Download and apply the bundles of each [ corncob, link, [ [ uid, digest ] ] ],
+        then point each remote's tracking branches at its link's heads
+        (in one `git update-ref` transaction; none if the link is None).
 
-        path_uid = f"{self.path}{os.path.sep}L-{link_uid}.yaml"
-        with open( path_uid, "w", encoding="utf-8" ) as link_strm:
-            yaml.dump( blob, link_strm, default_flow_style=False )
+        Each remote downloads on its own event loop, in a thread of its own,
+        at most fetch_workers bundles at a time. Meanwhile the bundles are
+        added to the repo as soon as they have arrived (see apply_bundles).
+        With git config corncob.fetchRepack, the packs that brings are then
+        consolidated (`git repack --geometric`).
+        """
+        arrivals = [ [ concurrent.futures.Future() for _ in bundles ] for [ _, _, bundles ] in plans ]
+        stop = threading.Event()
+        try:
+            with concurrent.futures.ThreadPoolExecutor( max( 1, len( plans ) ) ) as pool:
+                for ( [ peer, _, bundles ], futures ) in zip( plans, arrivals ):
+                    pool.submit( peer.remote.run, peer.download_bundles_async( bundles, futures, stop ) )
+                try:
+                    headers = self.apply_bundles( [ future for futures in arrivals for future in futures ] )
+                except BaseException:
+                    stop.set()
+                    raise
+        finally:
+            for [ peer, _, bundles ] in plans:
+                [ _, path_tmp ] = peer.bundle_tmp()
+                for [ bundle_uid, _ ] in bundles:
+                    self.remove_bundle_tmp( f"{path_tmp}/B-{bundle_uid}.bundle" )
 
+        # The headers come in plan order
+        headers = iter( headers )
+        for [ peer, _, bundles ] in plans:
+            self.local_index().add_bundles( peer.url, [ [ bundle_uid, prerequisites, [ sha for [ sha, _ ] in refs ] ]
+                                                        for ( [ bundle_uid, _ ], [ prerequisites, refs ] ) in zip( bundles, headers ) ] )
 
-    def get_link( self, uid ):
-        if uid == "latest-link":
-            path_link = f"{self.path}{os.path.sep}latest-link.yaml"
-        else:
-            path_link = f"{self.path}{os.path.sep}L-{uid}.yaml"
+        updates = "".join( f"update refs/remotes/{peer.bundle_tmp()[ 0 ]}/{name} {sha}\n"
+                           for [ peer, link, _ ] in plans if None != link for [ name, sha ] in link[ 1 ] )
+        if "" != updates:
+            self.gitCmd( [ "update-ref", "--stdin" ], stdin_text=updates )
+        for [ peer, link, _ ] in plans:
+            if None != link:
+                self.local_index().set_fetched( peer.url, link )
 
-        if not os.path.exists( path_link ):
-            print( f"FILE DOES NOT EXIST {path_link}" )
-            return None
+        if 1 < sum( len( bundles ) for [ _, _, bundles ] in plans ):
+            result = self.gitCmd( [ "config", "--bool", "--default", "false", "--get", "corncob.fetchRepack" ] )
+            if "true" == result.stdout.strip():
+                with trace.span( "git repack", "git" ):
+                    self.gitCmd( [ "repack", "-d", "-q", "--geometric=2" ] )
+        return 0
 
-        with open( path_link, "r" ) as link_file_strm:
-            return self.read_link_blob( link_file_strm )
 
+    def apply_bundles( self, arrivals ):
+        """ Add bundles to the repo as their futures (oldest first) resolve
+        to [ path, verified, digest ] (see download_bundles_async), as many
+        at a time as their prerequisites allow.
+        Returns their headers ( [ prerequisites, refs ], see PackStream.parse_header ).
 
-    def get_latest_link( self ):
-        return self.get_link( "latest-link" )
+        A bundle waits for the bundles whose headers have its prerequisites
+        as refs. It needs nothing else from them: its thin pack only has
+        deltas against objects reachable from its prerequisites. A
+        prerequisite that is neither such a ref nor already in the repo
+        (e.g. a commit a link moved a branch back to) makes it wait for every
+        older bundle. A chain of bundles that each build on the last is
+        still added one at a time, with all the threads for each.
 
+        index-pack doesn't check prerequisites: given a bundle whose
+        prerequisites are missing, it adds the pack anyway and leaves commits
+        with missing parents. So before a bundle with a digest goes to
+        index-pack, its prerequisites must be refs of bundles already
+        added or in the repo. If any aren't, it goes through `git bundle
+        unbundle` instead, which refuses it.
+        """
+        count = len( arrivals )
+        threads = max( 1, ( os.cpu_count() or 1 ) // max( 1, min( Corncob.apply_workers, count ) ) )
+        # Commit => index of the bundle that has it as a ref
+        producers = {}
+        waiting = {}
+        headers = [ None ] * count
+        applied = [ None ] * count
+        seen = 0
+        with concurrent.futures.ThreadPoolExecutor( Corncob.apply_workers ) as pool:
+            while seen < count or None in applied or not all( future.done() for future in applied ):
+                # Work out dependencies in order, so producers has every older bundle
+                while seen < count and arrivals[ seen ].done():
+                    [ bundle_path, verified, digest ] = arrivals[ seen ].result()
+                    headers[ seen ] = PackStream.read_header( bundle_path )
+                    [ prerequisites, refs ] = headers[ seen ]
+                    waiting[ seen ] = [ bundle_path, verified, digest, prerequisites, self.bundle_dependencies( seen, prerequisites, producers ) ]
+                    for [ sha, _ ] in refs:
+                        producers[ sha ] = seen
+                    seen += 1
 
-    def download_bundle( self, bundle_uid, local_bundle_path ):
-        path_bundle = f"{self.path}{os.path.sep}B-{bundle_uid}.bundle"
-        # TODO: error handling
-        shutil.copy( path_bundle, local_bundle_path )
+                for index in sorted( waiting.keys() ):
+                    [ bundle_path, verified, digest, prerequisites, deps ] = waiting[ index ]
+                    if all( None != applied[ dep ] and applied[ dep ].done() for dep in deps ):
+                        others = [ sha for sha in prerequisites if not producers.get( sha, index ) < index ]
+                        if verified and 0 < len( others ) and None in self.git.object_types( others ).values():
+                            verified = False
+                        applied[ index ] = pool.submit( self.apply_bundle, bundle_path, verified, digest, threads )
+                        del waiting[ index ]
 
+                running = [ future for future in applied if None != future and not future.done() ]
+                if seen < count:
+                    running.append( arrivals[ seen ] )
+                concurrent.futures.wait( running, return_when=concurrent.futures.FIRST_COMPLETED )
+                for future in applied:
+                    if None != future and future.done():
+                        # Raises if it failed
+                        future.result()
+        return headers
 
-if __name__ == "__main__":
-    import argparse
 
-    parser = argparse.ArgumentParser( program_title )
-    parser.add_argument( "command", type=str )
-    parser.add_argument( "remote", type=str )
-    parser.add_argument( "branches", nargs=argparse.REMAINDER )
+    def bundle_dependencies( self, index, prerequisites, producers ):
+        """ Indexes of the older bundles the bundle at `index` must wait for
+        """
+        deps = set( producers[ sha ] for sha in prerequisites if sha in producers )
+        others = [ sha for sha in prerequisites if not sha in producers ]
+        if 0 < len( others ) and None in self.git.object_types( others ).values():
+            return set( range( index ) )
+        return deps
 
-    args = parser.parse_args()
 
-    corncob = Corncob( args.remote )
+    def apply_bundle( self, bundle_path, verified, digest, threads ):
+        if verified:
+            try:
+                Corncob.index_bundle( bundle_path, threads, digest )
+            except ValueError as exn:
+                raise RemoteFailed( f"file://{os.path.dirname( bundle_path )}", f"read {os.path.basename( bundle_path )}", str( exn ) )
+        else:
+            self.gitCmd( [ "bundle", "unbundle", bundle_path ] )
+
+
+    def resolve_missing_links( self, link, doing_clone ):
+        """ [ bundle uid, digest ] (oldest first) for the bundles needed to
+        bring the local repo up to `link`, or None on error.
+
+        The join point is just below the oldest link that brings commits the
+        local repo lacks. Presence isn't monotone along the chain (writers push
+        different branches, so a link can be here while an older one from
+        another writer isn't), so every link since the last one fully fetched
+        (see LinkIndex.fetched) is checked, or since the floor if none is
+        known. The index gives their introduced heads, and then the bundles of
+        the missing links, directly; entries missing from it are rebuilt from
+        the links. If the join point is before the newest checkpoint, its
+        snapshot replaces everything up to the checkpoint.
+        """
+        supp_data = link[ 3 ]
+        if not "seq" in supp_data:
+            return self.walk_missing_links( link, doing_clone )
+
+        if not doing_clone and self.link_present( link ):
+            # Up to date; nothing to read
+            return []
+
+        latest_seq = supp_data[ "seq" ]
+        checkpoint = supp_data.get( "last_checkpoint" )
+        # Links before the checkpoint target may have been garbage collected
+        floor = -1 if None == checkpoint else checkpoint[ 2 ] - 1
+
+        shard_size = CornCobRemote.index_shard_size
+        latest_shard = latest_seq // shard_size
+        local = self.local_index()
+        local.add_link( self.url, link )
+        # Links up to the last one fully fetched are all here already
+        low = floor
+        fetched = None if doing_clone else local.fetched( self.url )
+        if None != fetched and floor < fetched[ 1 ] < latest_seq:
+            low = fetched[ 1 ]
+        entries = self.remote.get_index( latest_shard )
+        local.add_entries( self.url, entries )
+        index = dict( ( e[ 0 ], e ) for e in entries )
+
+        # Index files before the newest one don't change: read them from the local mirror if possible
+        shards = range( max( 0, low ) // shard_size, latest_shard )
+        mirrored = dict( ( shard, local.entries( self.url, shard ) ) for shard in shards )
+        missing = [ shard for shard in shards if None == mirrored[ shard ] ]
+        for [ shard, entries ] in zip( missing, self.remote.run( self.get_indexes_async( missing ) ) ):
+            local.add_entries( self.url, entries, shard )
+            mirrored[ shard ] = entries
+        for entries in mirrored.values():
+            for e in entries:
+                index[ e[ 0 ] ] = e
+
+        if low != floor and None == local.fetched( self.url ):
+            # Reading the index showed the remote was started over
+            return self.resolve_missing_links( link, doing_clone )
+
+        # Entries lost to concurrent pushers, or links written by an older version
+        gaps = [ s for s in range( low + 1, latest_seq ) if not s in index ]
+        if 0 < len( gaps ):
+            entries = self.rebuild_index_entries( link, index, gaps )
+            if None == entries:
+                return None
+            index.update( ( e[ 0 ], e ) for e in entries )
+        # Only its bundles are used
+        index[ latest_seq ] = Corncob.index_entry( link, None, latest_seq )
+
+        join_seq = floor
+        if not doing_clone:
+            # Checkpoint links don't introduce any heads
+            candidates = [ index[ s ] for s in range( low + 1, latest_seq ) if 0 < len( index[ s ][ 3 ] ) ]
+            present = self.commits_present( [ sha for e in candidates for [ _, sha ] in e[ 3 ] ] )
+            lacking = [ e[ 0 ] for e in candidates if not all( present[ sha ] for [ _, sha ] in e[ 3 ] ) ]
+            join_seq = lacking[ 0 ] - 1 if 0 < len( lacking ) else latest_seq - 1
+
+        plan = []
+        if None != checkpoint and join_seq < checkpoint[ 2 ]:
+            plan.append( index[ checkpoint[ 0 ] ][ 2 ] )
+            first_seq = checkpoint[ 2 ] + 1
+        else:
+            first_seq = join_seq + 1
+        for seq in range( first_seq, latest_seq + 1 ):
+            # Snapshot bundles of checkpoint links repeat what came before them
+            if len( index[ seq ] ) < 5:
+                plan.append( index[ seq ][ 2 ] )
+        return [ bundle for bundles in plan for bundle in bundles ]
+
+
+    async def get_indexes_async( self, shards ):
+        return await asyncio.gather( *[ self.remote.get_index_async( shard ) for shard in shards ] )
+
+
+    def rebuild_index_entries( self, link, index, gaps ):
+        """ Index entries for the positions in `gaps` (below `link`), rebuilt
+        from the links by following prev pointers down from the nearest link
+        above each, and written back to the local and remote index.
+        None on error.
+        """
+        latest_seq = link[ 3 ][ "seq" ]
+        uid_at = dict( ( s, e[ 1 ] ) for ( s, e ) in index.items() )
+        links_at = { latest_seq: link }
+        entries = []
+        for seq in sorted( gaps, reverse=True ):
+            # Its prev gives its introduced heads
+            for s in [ seq + 1, seq, seq - 1 ]:
+                if 0 > s or s in links_at:
+                    continue
+                if not s in uid_at:
+                    uid_at[ s ] = links_at[ s + 1 ][ 0 ][ 1 ]
+                links_at[ s ] = self.remote.get_link( uid_at[ s ] )
+                if None == links_at[ s ]:
+                    print( f"ERROR: Broken link chain at '{uid_at[ s ]}' ({program_title})" )
+                    return None
+            entries.append( Corncob.index_entry( links_at[ seq ], links_at.get( seq - 1 ), seq ) )
+
+        print( f"Rebuilt {len( entries )} entries missing from the index of '{self.url}'" )
+        try:
+            self.write_index_entries( entries )
+        except RemoteFailed as exn:
+            # The local index has them all the same
+            print( f"WARNING: Couldn't write them back: {exn} ({program_title})" )
+        return entries
+
+
+    def link_present( self, link ):
+        present = self.commits_present( [ sha for [ _, sha ] in link[ 1 ] ] )
+        return all( present.values() )
+
+
+    def commits_present( self, shas ):
+        """ { sha: True if the commit (and so its history) is in the local repo,
+        or will be once the bundles planned so far are applied }
+        """
+        types = self.git.object_types( [ sha for sha in shas if not sha in self.promised ] )
+        return dict( ( sha, sha in self.promised or "commit" == types[ sha ] ) for sha in shas )
+
+
+    def walk_missing_links( self, link, doing_clone ):
+        """ For chains written before links had positions.
+        Follow prev pointers (iteratively) from `link` until reaching
+        a link whose bundle prerequisites are already in the local repo.
+        """
+        missing = []
+        while True:
+            [ link_ids, _, bundles, _ ] = link
+
+            if len( bundles ) != 1:
+                print( f"ERROR: Expected one bundle in link '{link_ids[ 0 ]}' ({program_title})" )
+                return None
+
+            bundle_prereqs = bundles[ 0 ][ 1 ]
+            if 1 != len( bundle_prereqs ) or not "main" in bundle_prereqs.keys():
+                print( f"ERROR: Unexpected prerequisites in link '{link_ids[ 0 ]}' ({program_title})" )
+                return None
+
+            missing += Corncob.bundle_digests( bundles )
+
+            prereq = bundle_prereqs[ "main" ]
+            if "initial-snapshot" == prereq:
+                break
+
+            if not doing_clone and self.commits_present( [ prereq ] )[ prereq ]:
+                break
+
+            link = self.remote.get_link( link_ids[ 1 ] )
+            if None == link:
+                print( f"ERROR: Broken link chain at '{link_ids[ 1 ]}' ({program_title})" )
+                return None
+
+        missing.reverse()
+        return missing
+
+
+    async def download_bundles_async( self, bundles, arrivals, stop ):
+        """ Download the bundles ([ uid, digest ] pairs) concurrently, at most
+        fetch_workers at a time, resolving each one's future in `arrivals`
+        with [ path, verified, digest to check while applying ] (or its error).
+        Gives up on the rest once `stop` is set.
+
+        Downloads are checked against the link's digest as they stream in.
+        Bundles the remote can expose as local files are read in place, and
+        checked as they go into index-pack (see index_bundle).
+        """
+        [ _, path_tmp ] = self.bundle_tmp()
+        os.makedirs( path_tmp, exist_ok=True )
+        slots = asyncio.Semaphore( Corncob.fetch_workers )
+
+        async def fetch_one( bundle_uid, digest, arrival ):
+            try:
+                path = self.remote.bundle_path( bundle_uid )
+                if None != path:
+                    arrival.set_result( [ path, None != digest, digest ] )
+                    return
+                path = f"{path_tmp}/B-{bundle_uid}.bundle"
+                async with slots:
+                    if stop.is_set():
+                        raise asyncio.CancelledError()
+                    with trace.span( "download bundle", "phase", bundle=bundle_uid ) as span:
+                        await self.remote.download_bundle_async( bundle_uid, path, digest )
+                        span.set( bytes=os.path.getsize( path ) )
+                arrival.set_result( [ path, None != digest, None ] )
+            except BaseException as exn:
+                arrival.set_exception( exn )
+
+        await asyncio.gather( *[ fetch_one( uid, digest, arrival ) for ( [ uid, digest ], arrival ) in zip( bundles, arrivals ) ] )
+
+
+    def index_bundle( bundle_path, threads=0, digest=None ):
+        """ Add a bundle's pack to the repo, skipping `git bundle unbundle`'s
+        checks (for bundles that matched the digest their link records).
+        With a `digest`, the bundle is hashed on its way in, and the pack
+        dropped unless it matches.
+        """
+        with trace.span( "git index-pack", "git", bundle=os.path.basename( bundle_path ),
+                         bytes=os.path.getsize( bundle_path ), threads=threads ):
+            pack = PackStream( threads )
+            sink = pack if None == digest else DigestSink( pack, digest )
+            try:
+                CornCobRemote.copy_to_sink( bundle_path, sink )
+                if None != digest:
+                    sink.check()
+            except BaseException:
+                pack.abort()
+                raise
+            pack.close()
+
+
+    def update_refs( self, prefix, heads ):
+        """ Set `prefix`+branch to sha for each [ branch, sha ] in `heads`,
+        in a single `git update-ref` transaction.
+        """
+        updates = "".join( f"update {prefix}{name} {sha}\n" for [ name, sha ] in heads )
+        self.gitCmd( [ "update-ref", "--stdin" ], stdin_text=updates )
+
+
+    def compact_remote( self, args ):
+        """ compact [--gc] [link uid]
+
+        Roll the chain up to the given link (default: latest) into one
+        snapshot bundle, recorded by a new checkpoint link at the end of the
+        chain. Clones and far-behind fetches then download the snapshot plus
+        the links after its target, instead of the whole chain.
+        A second, shallow snapshot (no history) serves clone --depth/--since.
+
+        With --gc, also delete the links and bundles the snapshot supersedes.
+        The local repo must already have the target link's heads.
+        """
+        gc = "--gc" in args
+        args = [ arg for arg in args if arg != "--gc" ]
+
+        latest_link = self.get_latest_link()
+        if None == latest_link:
+            print( f"ERROR: Nothing to compact '{self.url}' ({program_title})" )
+            return -1
+
+        target = latest_link if 0 == len( args ) else self.remote.get_link( args[ 0 ] )
+        if None == target or not "seq" in target[ 3 ]:
+            print( f"ERROR: Can't compact up to link '{args}'. Push with this version first? ({program_title})" )
+            return -1
+
+        if not self.link_present( target ):
+            print( f"ERROR: Missing some of the heads of link '{target[ 0 ][ 0 ]}'. Fetch first ({program_title})" )
+            return -1
+
+        snapshot_uid = Corncob.token_hex( 8 )
+        snapshot_path = self.bundle_create_path( snapshot_uid )
+        self.create_snapshot_bundle( target[ 1 ], snapshot_path )
+        shallow_uid = Corncob.token_hex( 8 )
+        shallow_path = self.bundle_create_path( shallow_uid )
+        self.create_shallow_bundle( target[ 1 ], shallow_path )
+        shallow_digest = Corncob.link_digest( self.remote.upload_bundle( shallow_uid, shallow_path ) )
+        self.remove_bundle_tmp( shallow_path )
+        snapshot_digest = Corncob.link_digest( self.remote.upload_bundle( snapshot_uid, snapshot_path ) )
+        self.remove_bundle_tmp( snapshot_path )
+
+        link_uid = Corncob.token_hex( 8 )
+        supplement = self.next_link_supplement( latest_link )
+        supplement[ "checkpoint" ] = target[ 3 ][ "seq" ]
+        supplement[ "last_checkpoint" ] = [ supplement[ "seq" ], link_uid, supplement[ "checkpoint" ] ]
+        supplement[ "shallow" ] = [ shallow_uid, shallow_digest ]
+        prerequisites = [ x for [ name, _ ] in target[ 1 ] for x in [ name, "initial-snapshot" ] ]
+        blob = [ [ link_uid, latest_link[ 0 ][ 0 ] ],
+                 latest_link[ 1 ],
+                 [ [ snapshot_uid, prerequisites, snapshot_digest ] ],
+                 supplement ]
+
+        print( f"Compacting to checkpoint {link_uid} (up to link {target[ 0 ][ 0 ]})" )
+        published = self.publish_link( blob, snapshot_uid, latest_link )
+        if None == published:
+            # publish_link deleted the full snapshot
+            self.remote.delete_bundle( shallow_uid )
+            return -1
+
+        [ blob, prev_link ] = published
+        self.update_remote_index( blob, prev_link )
+        self.local_index().add_bundles( self.url, [ [ snapshot_uid, [], [ sha for [ _, sha ] in target[ 1 ] ] ] ] )
+
+        if gc:
+            self.collect_garbage( blob )
+        return 0
+
+
+    def create_snapshot_bundle( self, heads, bundle_path ):
+        """ Bundle with the full history of `heads`, with branches named
+        as in the link. Built in a scratch repo that borrows our objects
+        (alternates), so local branches are left alone.
+        """
+        objects_dir = os.path.abspath( self.gitCmd( [ "rev-parse", "--git-path", "objects" ] ).stdout.strip() )
+        bundle_path = os.path.abspath( bundle_path )
+        with tempfile.TemporaryDirectory() as scratch:
+            self.gitCmd( [ "init", "--bare", "-q", scratch ] )
+            with open( f"{scratch}/objects/info/alternates", "w" ) as alternates:
+                alternates.write( f"{objects_dir}\n" )
+            updates = "".join( f"update refs/heads/{name} {sha}\n" for [ name, sha ] in heads )
+            self.gitCmd( [ "-C", scratch, "update-ref", "--stdin" ], stdin_text=updates )
+            self.gitCmd( [ "-C", scratch, "bundle", "create", bundle_path, "--all" ] )
+
+
+    def create_shallow_bundle( self, heads, bundle_path ):
+        """ Bundle with only the commits at `heads` and their trees.
+
+        git bundles can't mark commits as shallow, so this one has no
+        prerequisites and is read with index-pack (see apply_shallow_snapshot),
+        which doesn't look for the missing parents.
+        """
+        shas = sorted( set( sha for [ _, sha ] in heads ) )
+        objects = self.gitCmd( [ "rev-list", "--objects", "--no-walk", "--stdin" ],
+                               stdin_text="".join( f"{sha}\n" for sha in shas ) ).stdout
+        header = "# v2 git bundle\n" + "".join( f"{sha} refs/heads/{name}\n" for [ name, sha ] in heads ) + "\n"
+        with open( bundle_path, "wb" ) as strm:
+            strm.write( header.encode( "utf-8" ) )
+            strm.flush()
+            with trace.span( "git pack-objects", "git" ):
+                result = subprocess.run( [ "git", "pack-objects", "--stdout", "-q" ], input=objects.encode( "utf-8" ),
+                                         stdout=strm, stderr=subprocess.PIPE )
+        if 0 != result.returncode:
+            raise GitCmdFailed( [ "pack-objects", "--stdout" ], result.returncode, "", result.stderr.decode() )
+
+
+    def collect_garbage( self, checkpoint_link ):
+        """ Delete what the checkpoint's snapshot supersedes:
+        - links before the checkpoint target, and their bundles
+        - the bundles of the target itself (its link stays: fetch reads the chain down to it)
+        - snapshots of older checkpoints
+        - index files entirely before the target
+        - chunks (chunk store mode) that no remaining bundle's manifest names
+
+        Chunks are checked against the manifests on the remote at the time,
+        so a push uploading meanwhile can lose chunks it found already there.
+        Run --gc when nobody is pushing.
+        """
+        [ link_ids, _, bundles, supp_data ] = checkpoint_link
+        target_seq = supp_data[ "checkpoint" ]
+
+        # The checkpoint's snapshots, and the bundles of links pushed since, stay
+        kept = [ bundle[ 0 ] for bundle in bundles ] + [ supp_data[ "shallow" ][ 0 ] ]
+        # With the links claimed but not yet published as latest-link
+        link = self.get_latest_link()
+        while None != link and link[ 0 ][ 0 ] != link_ids[ 0 ] and "initial-snapshot" != link[ 0 ][ 0 ]:
+            kept += Corncob.link_bundle_uids( link )
+            link = self.remote.get_link( link[ 0 ][ 1 ] )
+
+        deleted = []
+        stale_links = []
+        uid = link_ids[ 1 ]
+        while True:
+            link = self.remote.get_link( uid )
+            if None == link:
+                break
+            [ ids, _, _, supp ] = link
+            seq = supp.get( "seq", -1 )
+            if target_seq >= seq or "checkpoint" in supp:
+                deleted += Corncob.link_bundle_uids( link )
+            else:
+                kept += Corncob.link_bundle_uids( link )
+            if target_seq > seq:
+                stale_links.append( ids[ 0 ] )
+            if "initial-snapshot" == ids[ 0 ]:
+                break
+            uid = ids[ 1 ]
+
+        # Read before the deleted manifests go
+        manifests = self.remote.run( self.get_chunk_manifests_async( deleted + kept ) )
+        for bundle_uid in deleted:
+            self.remote.delete_bundle( bundle_uid )
+        for uid in stale_links:
+            self.remote.delete_link( uid )
+        for shard in range( target_seq // CornCobRemote.index_shard_size ):
+            self.remote.delete_index( shard )
+        for seq in range( target_seq ):
+            self.remote.delete_claim( seq )
+
+        def chunk_shas( manifests ):
+            return set( sha for manifest in manifests if CornCobRemote.stored_as_chunks( manifest )
+                        for [ sha, _ ] in manifest[ "chunks" ] )
+        dropped = chunk_shas( manifests[ :len( deleted ) ] )
+        live = chunk_shas( manifests[ len( deleted ): ] )
+        # Where the remote can list its chunks, also those of uploads that never got a manifest
+        dropped.update( self.remote.list_chunks() or [] )
+        unreferenced = sorted( dropped - live )
+        if 0 < len( unreferenced ):
+            self.remote.run( self.delete_chunks_async( unreferenced ) )
+            print( f"Deleted {len( unreferenced )} unreferenced chunks" )
+
+
+    def link_bundle_uids( link ):
+        """ Uids of a link's bundles, including its shallow snapshot
+        """
+        shallow = link[ 3 ].get( "shallow" )
+        return [ bundle[ 0 ] for bundle in link[ 2 ] ] + ( [] if None == shallow else [ shallow[ 0 ] ] )
+
+
+    async def get_chunk_manifests_async( self, bundle_uids ):
+        return await asyncio.gather( *[ self.remote.get_chunk_manifest_async( uid ) for uid in bundle_uids ] )
+
+
+    async def delete_chunks_async( self, shas ):
+        await asyncio.gather( *[ self.remote.delete_chunk_async( sha ) for sha in shas ] )
+
+
+    def merge_from_remote( self, branches ):
+        branch = branches[ 0 ]
+
+        [ tmp_remote, _ ] = self.bundle_tmp()
+
+        self.gitCmd( [ "merge", f"{tmp_remote}/{branch}" ] )
+        return 0
+
+
+    def status( self ):
+        """ status <remote>
+
+        How each local branch compares with the remote's heads, as of the
+        last fetch or push (from the link index; the remote isn't read).
+        """
+        latest = self.local_index().latest_link( self.url )
+        if None == latest:
+            print( f"{self.remote_name}: never fetched or pushed" )
+            return 0
+
+        [ uid, seq, remote_heads ] = latest
+        print( f"{self.remote_name}: link {uid}" + ( "" if None == seq else f" (#{seq})" ) )
+        local_heads = self.git.refs( "refs/heads/" )
+        present = self.commits_present( sorted( set( remote_heads.values() ) ) )
+        for name in sorted( set( local_heads.keys() ) | set( remote_heads.keys() ) ):
+            if not name in remote_heads:
+                state = "not on the remote"
+            elif not name in local_heads:
+                state = "only on the remote"
+            elif local_heads[ name ] == remote_heads[ name ]:
+                state = "up to date"
+            elif not present[ remote_heads[ name ] ]:
+                state = "behind (fetch first)"
+            else:
+                counts = self.gitCmd( [ "rev-list", "--left-right", "--count", f"{local_heads[ name ]}...{remote_heads[ name ]}" ] )
+                [ ahead, behind ] = counts.stdout.split()
+                state = f"ahead {ahead}, behind {behind}"
+            print( f"  {name}: {state}" )
+        return 0
+
+
+    def token_hex( num_bytes ):
+        return "".join( f"{b:02x}" for b in secrets.token_bytes( num_bytes ) )
+
+
+    def change_to_root_git_dir( self ):
+        """ cd $( git rev-parse --show-toplevel )
+        with some error checking
+        """
+        if None != self.agent:
+            os.chdir( self.agent.root )
+            return 0
+        result = self.gitCmd( [ "rev-parse", "--show-toplevel" ] )
+        git_dir = result.stdout.strip()
+        os.chdir( git_dir )
+        if pathlib.Path( git_dir ).resolve() == pathlib.Path( os.getcwd() ).resolve():
+            return 0
+        print( f"ERROR. Weird os.chdir() failure? {result.stdout} {os.getcwd()} ({program_title})" )
+        return -1
+
+    def bundle_create_path( self, bundle_uid ):
+        """ Where `git bundle create` should write a new bundle: straight
+        into the remote if the backend allows it, else the temp folder
+        """
+        path = self.remote.bundle_create_path( bundle_uid )
+        if None != path:
+            return path
+
+        [ _, path_tmp ] = self.bundle_tmp()
+        os.makedirs( path_tmp, exist_ok=True )
+        return f"{path_tmp}/B-{bundle_uid}.bundle"
+
+    def remove_bundle_tmp( self, bundle_path ):
+        """ Delete `bundle_path` if it is one of our temp files (and not,
+        for example, a bundle read in place from the remote)
+        """
+        [ _, path_tmp ] = self.bundle_tmp()
+        if os.path.dirname( os.path.abspath( bundle_path ) ) == os.path.abspath( path_tmp ):
+            if os.path.exists( bundle_path ):
+                os.remove( bundle_path )
+
+    def bundle_tmp( self ):
+        return [ f"{self.remote_name}-corncob-bundle-tmp",
+                 f"./.corncob-bundle-tmp/{self.remote_name}" ]
+
+    def close( self ):
+        if None != self.agent:
+            # Kept open for the agent's next command
+            return
+        self.git.close()
+        if None != self.remote:
+            self.remote.close()
+        if None != self.index:
+            self.index.close()
+
+    def gitCmd( self, git_params, raise_on_error=True, stdin_text=None ):
+        git_cmd = [ "git" ] + git_params
+        with trace.span( f"git {git_params[ 0 ]}", "git", args=git_params ) as span:
+            result = subprocess.run( git_cmd, input=stdin_text, capture_output=True, text=True )
+            span.set( exit_code=result.returncode, bytes=len( result.stdout ) + len( stdin_text or "" ) )
+        if 0 != result.returncode:
+            exn = GitCmdFailed( git_params, result.returncode, result.stdout, result.stderr )
+            if raise_on_error:
+                raise exn
+            else:
+                print( exn )
+        return result
+
+
+class GitPlumbing:
+    """ Bulk queries against the local repo, so that the number of git
+    processes doesn't grow with the number of refs/objects involved.
+    - Refs come from a single `git for-each-ref`
+    - Object lookups go through one long-lived `git cat-file --batch-check`
+    """
+
+    # Lines written to cat-file before reading its answers back.
+    # Keeps both pipes well under the OS buffer size.
+    batch_size = 500
+
+    def __init__( self, corncob ):
+        self.corncob = corncob
+        self.batch_check = None
+        self.path = None
+
+    def git_dir( self ):
+        if None == self.path:
+            self.path = self.corncob.gitCmd( [ "rev-parse", "--git-dir" ] ).stdout.strip()
+        return self.path
+
+    def refs( self, prefix ):
+        """ { name (without prefix): sha } for every ref under `prefix`
+        """
+        result = self.corncob.gitCmd( [ "for-each-ref", "--format=%(objectname) %(refname)", prefix ], False )
+        refs = {}
+        if 0 != result.returncode:
+            return refs
+
+        for line in result.stdout.splitlines():
+            [ sha, refname ] = line.split( " ", 1 )
+            refs[ refname[ len( prefix ): ] ] = sha
+        return refs
+
+    def object_types( self, names ):
+        """ { name: "commit"/"tree"/"blob"/"tag" or None if missing }
+        """
+        if None == self.batch_check:
+            self.batch_check = subprocess.Popen(
+                [ "git", "cat-file", "--batch-check=%(objecttype)" ],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True )
+
+        types = {}
+        names = list( names )
+        with trace.span( "git cat-file --batch-check", "git", objects=len( names ) ):
+            self.lookup_types( names, types )
+        return types
+
+    def lookup_types( self, names, types ):
+        for i in range( 0, len( names ), GitPlumbing.batch_size ):
+            chunk = names[ i : i + GitPlumbing.batch_size ]
+            self.batch_check.stdin.write( "".join( f"{name}\n" for name in chunk ) )
+            self.batch_check.stdin.flush()
+            for name in chunk:
+                line = self.batch_check.stdout.readline().strip()
+                if "" == line or line.endswith( " missing" ) or line.endswith( " ambiguous" ):
+                    types[ name ] = None
+                else:
+                    types[ name ] = line
+
+    def close( self ):
+        if None != self.batch_check:
+            self.batch_check.stdin.close()
+            self.batch_check.wait()
+            self.batch_check = None
+
+
+class CorncobCache:
+    """ Per-repo cache of links and bundles, keyed by uid, and of chunks
+    from chunk stores (see ChunkStoreRemote), keyed by their SHA-256.
+    Link and bundle uids are never reused, so entries never go stale.
+    - Each entry has a .sha256 sidecar; entries that fail the check are dropped
+    - The total size is capped (git config corncob.cacheSize);
+      least recently used entries are evicted first
+    """
+
+    default_size = "512m"
+
+    kinds = [ "links", "bundles", "chunks" ]
+
+    def __init__( self, path, max_bytes ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.evict_lock = threading.Lock()
+        for kind in CorncobCache.kinds:
+            os.makedirs( os.path.join( path, kind ), exist_ok=True )
+
+    def entry_path( self, kind, uid ):
+        """ None for uids that can't be cached: anything that isn't a plain
+        token (uids come from the remote), and "initial-snapshot",
+        which every remote uses for its own first link
+        """
+        if None == re.fullmatch( "[0-9a-f]+", uid ):
+            return None
+        return os.path.join( self.path, kind, uid )
+
+    def lookup( self, kind, uid ):
+        """ Path of the cached entry, or None if missing or corrupt
+        """
+        path = self.entry_path( kind, uid )
+        if None == path or not os.path.exists( path ):
+            return None
+
+        try:
+            with open( f"{path}.sha256", "r" ) as digest_strm:
+                expected = digest_strm.read().strip()
+        except FileNotFoundError:
+            expected = None
+
+        if expected != CorncobCache.file_digest( path ):
+            print( f"WARNING: Dropping corrupt cache entry '{path}' ({program_title})" )
+            self.remove( path )
+            return None
+
+        # mtime doubles as the LRU timestamp
+        os.utime( path )
+        return path
+
+    def temp_path( self, name=None ):
+        """ A random name, unless a (safe) `name` is given
+        """
+        if None == name or None == re.fullmatch( "[0-9A-Za-z-]+", name ):
+            name = Corncob.token_hex( 8 )
+        return os.path.join( self.path, f"tmp-{name}" )
+
+    def insert( self, kind, uid, tmp_path ):
+        """ Move `tmp_path` (from temp_path) into the cache.
+        Returns its new path, or `tmp_path` if it can't be cached.
+        """
+        path = self.entry_path( kind, uid )
+        if None == path or os.path.getsize( tmp_path ) > self.max_bytes:
+            return tmp_path
+
+        with open( f"{path}.sha256", "w" ) as digest_strm:
+            digest_strm.write( CorncobCache.file_digest( tmp_path ) )
+        os.replace( tmp_path, path )
+        self.evict( path )
+        return path
+
+    def insert_text( self, kind, uid, text ):
+        self.insert_bytes( kind, uid, text.encode( "utf-8" ) )
+
+    def insert_bytes( self, kind, uid, data ):
+        tmp_path = self.temp_path()
+        with open( tmp_path, "wb" ) as strm:
+            strm.write( data )
+        if tmp_path == self.insert( kind, uid, tmp_path ):
+            os.remove( tmp_path )
+
+    def evict( self, keep ):
+        """ Remove least recently used entries (except `keep`) until under the size cap
+        """
+        with self.evict_lock:
+            entries = []
+            total = 0
+            for kind in CorncobCache.kinds:
+                for entry in os.scandir( os.path.join( self.path, kind ) ):
+                    if entry.name.endswith( ".sha256" ):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append( ( stat.st_mtime, stat.st_size, entry.path ) )
+                    total += stat.st_size
+
+            for ( _, size, path ) in sorted( entries ):
+                if total <= self.max_bytes:
+                    break
+                if path != keep:
+                    self.remove( path )
+                    total -= size
+
+    def remove( self, path ):
+        for victim in [ path, f"{path}.sha256" ]:
+            try:
+                os.remove( victim )
+            except FileNotFoundError:
+                pass
+
+    def file_digest( path ):
+        digest = hashlib.sha256()
+        with open( path, "rb" ) as strm:
+            for chunk in iter( lambda: strm.read( 1 << 20 ), b"" ):
+                digest.update( chunk )
+        return digest.hexdigest()
+
+
+class LinkIndex:
+    """ Local SQLite index (.git/corncob/links.sqlite) of the chains seen
+    on each remote, keyed by URL:
+    - entries: the remote's index entries (see update_remote_index), from
+      its index files and from our own pushes
+    - shards: index files mirrored in full. Only files that were no longer
+      the newest are, as those don't change any more.
+    - links: links read in full (heads, prev) and which of them was the
+      latest as of the last fetch or push
+    - fetched: the newest link whose heads (and so those of every link
+      before it) were all in the repo after a fetch; fetch only checks
+      the links after it
+    - bundles: the prerequisites and tips (commits) of the bundles fetched,
+      pushed or written by compact
+
+    Fetch reads mirrored index files from here instead of the remote, and
+    `status` works without the remote. Positions in a chain are only ever
+    taken once, so a different uid at a known position means the remote was
+    started over: everything known about it is dropped.
+    """
+
+    def __init__( self, path ):
+        import sqlite3
+        os.makedirs( os.path.dirname( path ), exist_ok=True )
+        self.db = sqlite3.connect( path, timeout=30 )
+        with self.db:
+            self.db.executescript( """
+                CREATE TABLE IF NOT EXISTS entries ( remote TEXT, seq INTEGER, uid TEXT, entry TEXT, PRIMARY KEY ( remote, seq ) );
+                CREATE TABLE IF NOT EXISTS shards ( remote TEXT, shard INTEGER, PRIMARY KEY ( remote, shard ) );
+                CREATE TABLE IF NOT EXISTS links ( remote TEXT, uid TEXT, seq INTEGER, prev TEXT, heads TEXT, PRIMARY KEY ( remote, uid ) );
+                CREATE TABLE IF NOT EXISTS latest ( remote TEXT PRIMARY KEY, uid TEXT );
+                CREATE TABLE IF NOT EXISTS fetched ( remote TEXT PRIMARY KEY, uid TEXT, seq INTEGER );
+                CREATE TABLE IF NOT EXISTS bundles ( remote TEXT, uid TEXT, prerequisites TEXT, tips TEXT, PRIMARY KEY ( remote, uid ) );
+            """ )
+
+    def check_position( self, remote, seq, uid ):
+        row = self.db.execute( "SELECT uid FROM entries WHERE remote = ? AND seq = ?", ( remote, seq ) ).fetchone()
+        if None == row:
+            row = self.db.execute( "SELECT uid FROM links WHERE remote = ? AND seq = ?", ( remote, seq ) ).fetchone()
+        if None != row and row[ 0 ] != uid:
+            for table in [ "entries", "shards", "links", "latest", "fetched", "bundles" ]:
+                self.db.execute( f"DELETE FROM {table} WHERE remote = ?", ( remote, ) )
+
+    def add_entries( self, remote, entries, shard=None ):
+        """ Record index entries; with `shard`, as that whole index file
+        """
+        with self.db:
+            for e in entries:
+                self.check_position( remote, e[ 0 ], e[ 1 ] )
+                self.db.execute( "INSERT OR REPLACE INTO entries VALUES ( ?, ?, ?, ? )",
+                                 ( remote, e[ 0 ], e[ 1 ], json.dumps( e ) ) )
+            if None != shard:
+                self.db.execute( "INSERT OR REPLACE INTO shards VALUES ( ?, ? )", ( remote, shard ) )
+
+    def entries( self, remote, shard ):
+        """ The entries of a mirrored index file, or None if it isn't mirrored
+        """
+        if None == self.db.execute( "SELECT 1 FROM shards WHERE remote = ? AND shard = ?", ( remote, shard ) ).fetchone():
+            return None
+        size = CornCobRemote.index_shard_size
+        rows = self.db.execute( "SELECT entry FROM entries WHERE remote = ? AND seq >= ? AND seq < ?",
+                                ( remote, shard * size, ( shard + 1 ) * size ) )
+        return [ json.loads( entry ) for ( entry, ) in rows ]
+
+    def add_link( self, remote, link, latest=False ):
+        [ link_ids, branches, _, supp_data ] = link
+        seq = supp_data.get( "seq" )
+        with self.db:
+            if None != seq:
+                self.check_position( remote, seq, link_ids[ 0 ] )
+            self.db.execute( "INSERT OR REPLACE INTO links VALUES ( ?, ?, ?, ?, ? )",
+                             ( remote, link_ids[ 0 ], seq, link_ids[ 1 ], json.dumps( branches ) ) )
+            if latest:
+                self.db.execute( "INSERT OR REPLACE INTO latest VALUES ( ?, ? )", ( remote, link_ids[ 0 ] ) )
+
+    def add_bundles( self, remote, bundles ):
+        """ Record [ bundle uid, [ prerequisite shas ], [ tip shas ] ] for each of `bundles`
+        """
+        with self.db:
+            for [ uid, prerequisites, tips ] in bundles:
+                self.db.execute( "INSERT OR REPLACE INTO bundles VALUES ( ?, ?, ?, ? )",
+                                 ( remote, uid, json.dumps( sorted( set( prerequisites ) ) ), json.dumps( sorted( set( tips ) ) ) ) )
+
+    def set_fetched( self, remote, link ):
+        [ link_ids, _, _, supp_data ] = link
+        if not "seq" in supp_data:
+            return
+        with self.db:
+            self.check_position( remote, supp_data[ "seq" ], link_ids[ 0 ] )
+            self.db.execute( "INSERT OR REPLACE INTO fetched VALUES ( ?, ?, ? )", ( remote, link_ids[ 0 ], supp_data[ "seq" ] ) )
+
+    def fetched( self, remote ):
+        """ [ uid, seq ] of the newest link fully fetched, or None
+        """
+        row = self.db.execute( "SELECT uid, seq FROM fetched WHERE remote = ?", ( remote, ) ).fetchone()
+        return None if None == row else list( row )
+
+    def latest_link( self, remote ):
+        """ [ uid, seq, { branch: sha } ] of the latest link as of the last fetch or push, or None
+        """
+        row = self.db.execute( "SELECT links.uid, links.seq, links.heads FROM latest JOIN links "
+                               "ON latest.remote = links.remote AND latest.uid = links.uid WHERE latest.remote = ?",
+                               ( remote, ) ).fetchone()
+        if None == row:
+            return None
+        return [ row[ 0 ], row[ 1 ], dict( ( name, sha ) for [ name, sha ] in json.loads( row[ 2 ] ) ) ]
+
+    def close( self ):
+        self.db.close()
+
+
+class CachedRemote:
+    """ Wraps a CornCobRemote, serving links and bundles from a CorncobCache
+    when possible. Everything else goes straight to the remote.
+    """
+
+    def __init__( self, remote, cache ):
+        self.remote = remote
+        self.cache = cache
+
+    def __getattr__( self, name ):
+        return getattr( self.remote, name )
+
+    def get_link( self, uid ):
+        path = self.cache.lookup( "links", uid )
+        if None != path:
+            with open( path, "r", encoding="utf-8" ) as link_strm:
+                return self.remote.read_link_blob( link_strm.read() )
+
+        text = self.remote.get_link_text( uid )
+        if None == text:
+            return None
+        link = self.remote.read_link_blob( text )
+        # Caches latest-link too, under its real uid
+        self.cache.insert_text( "links", link[ 0 ][ 0 ], text )
+        return link
+
+    def get_latest_link( self ):
+        return self.get_link( "latest-link" )
+
+    async def get_link_async( self, uid ):
+        path = self.cache.lookup( "links", uid )
+        if None != path:
+            with open( path, "r", encoding="utf-8" ) as link_strm:
+                return self.remote.read_link_blob( link_strm.read() )
+
+        text = await self.remote.get_link_text_async( uid )
+        if None == text:
+            return None
+        link = self.remote.read_link_blob( text )
+        self.cache.insert_text( "links", link[ 0 ][ 0 ], text )
+        return link
+
+    async def get_latest_link_async( self ):
+        return await self.get_link_async( "latest-link" )
+
+    def download_bundle( self, bundle_uid, local_bundle_path, digest=None ):
+        self.run( self.download_bundle_async( bundle_uid, local_bundle_path, digest ) )
+
+    async def stream_bundle_async( self, bundle_uid, sink ):
+        path = self.cache.lookup( "bundles", bundle_uid )
+        if None != path:
+            return CornCobRemote.copy_to_sink( path, sink )
+        await self.remote.stream_bundle_async( bundle_uid, sink )
+
+    async def download_bundle_async( self, bundle_uid, local_bundle_path, digest=None ):
+        path = self.cache.lookup( "bundles", bundle_uid )
+        if None == path:
+            # Named after the bundle, so a chunked download that breaks off
+            # is picked up again by the next fetch
+            tmp_path = self.cache.temp_path( f"B-{bundle_uid}" )
+            await self.remote.download_bundle_async( bundle_uid, tmp_path, digest )
+            path = self.cache.insert( "bundles", bundle_uid, tmp_path )
+            if path == tmp_path:
+                os.replace( tmp_path, local_bundle_path )
+                return
+
+        CornCobRemote.copy_file( path, local_bundle_path )
+
+
+class ChunkStoreRemote:
+    """ Wraps a CornCobRemote so that new bundles go into its chunk store
+    (git config corncob.chunkStore) instead of B-<uid>.bundle files.
+
+    Bundles are split into content-defined chunks (ContentChunker), each
+    kept once per remote as K-<sha256>, and B-<uid>.chunks lists the
+    bundle's chunks in order. Chunks the remote already has (from earlier
+    pushes, snapshots that repeat them, or an upload that broke off) are
+    not sent again. Readers fetch only the chunks missing from their
+    local cache, so a bundle holding objects already fetched from another
+    remote mostly comes from the cache.
+
+    Any reader can read such bundles (see CornCobRemote.download_stored_chunks_async);
+    this is only needed to write them. Everything but uploads goes
+    straight to the remote.
+    """
+
+    # Chunks checked for and uploaded at a time
+    chunk_streams = 4
+
+    def __init__( self, remote ):
+        self.remote = remote
+
+    def __getattr__( self, name ):
+        return getattr( self.remote, name )
+
+    def bundle_create_path( self, bundle_uid ):
+        # Never a B-<uid>.bundle in the remote's own folder
+        return None
+
+    def upload_bundle( self, bundle_uid, local_bundle_path ):
+        return self.run( self.upload_bundle_async( bundle_uid, local_bundle_path ) )
+
+    async def upload_bundle_async( self, bundle_uid, local_bundle_path ):
+        async def chunks():
+            with open( local_bundle_path, "rb" ) as strm:
+                for chunk in iter( lambda: strm.read( 1 << 20 ), b"" ):
+                    yield chunk
+        return await self.upload_bundle_stream_async( bundle_uid, chunks() )
+
+    async def upload_bundle_stream_async( self, bundle_uid, chunks ):
+        """ Returns the bundle's manifest, which is written last: if the
+        upload fails, no bundle appears under its uid
+        """
+        sink = DigestSink()
+        chunker = ContentChunker()
+        entries = []
+        seen = set()
+        slots = asyncio.Semaphore( ChunkStoreRemote.chunk_streams )
+        tasks = []
+
+        async def store( sha, data ):
+            try:
+                if not await self.remote.has_chunk_async( sha ):
+                    await self.remote.put_chunk_async( sha, data )
+            finally:
+                slots.release()
+
+        async def add( pieces ):
+            for data in pieces:
+                sha = hashlib.sha256( data ).hexdigest()
+                entries.append( [ sha, len( data ) ] )
+                if sha in seen:
+                    continue
+                seen.add( sha )
+                await slots.acquire()
+                tasks.append( asyncio.create_task( store( sha, data ) ) )
+
+        try:
+            async for chunk in chunks:
+                sink.write( chunk )
+                await add( chunker.write( chunk ) )
+            await add( chunker.close() )
+            await asyncio.gather( *tasks )
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather( *tasks, return_exceptions=True )
+
+        manifest = dict( sink.digest(), store="chunks", chunks=entries )
+        await self.remote.put_chunk_manifest_async( bundle_uid, manifest )
+        return manifest
+
+
+class FolderWatch:
+    """ Waits for latest-link.yaml to be replaced in any of a set of folders,
+    with Linux inotify (through ctypes, no extra packages)
+    """
+
+    # From sys/inotify.h
+    IN_MOVED_TO = 0x80
+    IN_CLOSE_WRITE = 0x08
+
+    def __init__( self, fd ):
+        self.fd = fd
+
+    def open( folders ):
+        """ None if there are no folders or inotify isn't available
+        """
+        if 0 == len( folders ):
+            return None
+        try:
+            import ctypes
+            import ctypes.util
+            libc = ctypes.CDLL( ctypes.util.find_library( "c" ), use_errno=True )
+            fd = libc.inotify_init1( os.O_NONBLOCK | os.O_CLOEXEC )
+        except ( OSError, AttributeError ):
+            return None
+        if fd < 0:
+            return None
+        for folder in folders:
+            libc.inotify_add_watch( fd, os.fsencode( folder ), FolderWatch.IN_MOVED_TO | FolderWatch.IN_CLOSE_WRITE )
+        return FolderWatch( fd )
+
+    def wait( self, timeout ):
+        """ True if latest-link.yaml changed in one of the folders within `timeout` seconds
+        """
+        import select
+        deadline = time.monotonic() + timeout
+        while True:
+            [ ready, _, _ ] = select.select( [ self.fd ], [], [], max( 0, deadline - time.monotonic() ) )
+            if 0 == len( ready ):
+                return False
+            if self.drain():
+                return True
+
+    def drain( self ):
+        """ Read the pending events. True if one was for latest-link.yaml
+        """
+        found = False
+        while True:
+            try:
+                data = os.read( self.fd, 64 << 10 )
+            except BlockingIOError:
+                return found
+            offset = 0
+            while offset + 16 <= len( data ):
+                # struct inotify_event { int wd; uint32_t mask, cookie, len; char name[] }
+                name_len = int.from_bytes( data[ offset + 12:offset + 16 ], sys.byteorder )
+                name = data[ offset + 16:offset + 16 + name_len ].rstrip( b"\0" )
+                found = found or b"latest-link.yaml" == name
+                offset += 16 + name_len
+
+    def close( self ):
+        os.close( self.fd )
+
+
+class RemoteFailed( Exception ):
+    def __init__( self, url, operation, reason ):
+        self.url = url
+        self.operation = operation
+        self.reason = reason
+
+    def __str__( self ):
+        return f"ERROR. remote operation failed. {self.operation} '{self.url}' => {self.reason}"
+
+class GitCmdFailed( Exception ):
+    def __init__( self, params, exit_code, out, err ):
+        self.params = params
+        self.exit_code = exit_code
+        self.out = out
+        self.err = err
+
+    def __str__( self ):
+        return f"ERROR. git cmd failed. `git {' '.join( self.params )}` => {self.exit_code}. o:'{self.out}' e:'{self.err}'"
+
+class Tracer:
+    """ Spans for git calls, remote operations and the phases of each command.
+
+        with trace.span( "fetch", "phase" ) as span:
+            ...
+            span.set( bytes=n )
+
+    Written as JSON lines (one object per span, appended) or, for trace
+    files ending in .json, Chrome trace events (chrome://tracing, Perfetto).
+    Until open() is called, span() hands back a shared no-op object.
+    """
+
+    class Span:
+        def __init__( self, tracer, name, category, fields ):
+            self.tracer = tracer
+            self.name = name
+            self.category = category
+            self.fields = fields
+
+        def set( self, **fields ):
+            self.fields.update( fields )
+
+        def __enter__( self ):
+            self.start = time.perf_counter()
+            return self
+
+        def __exit__( self, exc_type, exc, tb ):
+            if None != exc_type:
+                self.fields[ "error" ] = exc_type.__name__
+            self.tracer.emit( self, time.perf_counter() - self.start )
+            return False
+
+    class NoSpan:
+        def set( self, **fields ):
+            pass
+
+        def __enter__( self ):
+            return self
+
+        def __exit__( self, exc_type, exc, tb ):
+            return False
+
+    no_span = NoSpan()
+
+    def __init__( self ):
+        self.strm = None
+        self.lock = threading.Lock()
+
+    def open( self, path, trace_format=None ):
+        """ trace_format: "jsonl" or "chrome" (default: from the file name)
+        """
+        if None == trace_format:
+            trace_format = "chrome" if path.endswith( ".json" ) else "jsonl"
+        if not trace_format in [ "jsonl", "chrome" ]:
+            raise ValueError( f"Unknown trace format '{trace_format}'" )
+        self.chrome = "chrome" == trace_format
+        self.strm = open( path, "w" if self.chrome else "a", encoding="utf-8" )
+        self.origin = time.perf_counter()
+        self.wall_origin = time.time()
+        if self.chrome:
+            self.strm.write( "[\n" )
+        self.first = True
+
+    def enabled( self ):
+        return None != self.strm
+
+    def span( self, name, category, **fields ):
+        if None == self.strm:
+            return Tracer.no_span
+        return Tracer.Span( self, name, category, fields )
+
+    def emit( self, span, duration ):
+        start = span.start - self.origin
+        if self.chrome:
+            event = { "name": span.name, "cat": span.category, "ph": "X",
+                      "ts": round( start * 1e6, 1 ), "dur": round( duration * 1e6, 1 ),
+                      "pid": os.getpid(), "tid": threading.get_ident(), "args": span.fields }
+        else:
+            event = { "name": span.name, "cat": span.category,
+                      "start": round( self.wall_origin + start, 6 ), "dur": round( duration, 6 ),
+                      "pid": os.getpid(), "tid": threading.get_ident() }
+            event.update( span.fields )
+        line = json.dumps( event, default=str )
+        with self.lock:
+            if self.chrome:
+                line = ( "" if self.first else ",\n" ) + line
+                self.first = False
+            else:
+                line += "\n"
+            self.strm.write( line )
+
+    def close( self ):
+        if None == self.strm:
+            return
+        if self.chrome:
+            self.strm.write( "\n]\n" )
+        self.strm.close()
+        self.strm = None
+
+trace = Tracer()
+
+
+class TracedRemote:
+    """ CornCobRemote wrapper recording a span for every operation
+    (only put in place while tracing)
+    """
+
+    untraced = { "run", "close", "close_async", "bundle_path", "bundle_create_path",
+                 "read_link_blob", "write_link_blob" }
+
+    def __init__( self, remote ):
+        self.remote = remote
+
+    def __getattr__( self, name ):
+        attr = getattr( self.remote, name )
+        if name in TracedRemote.untraced or not callable( attr ):
+            return attr
+
+        if inspect.iscoroutinefunction( attr ):
+            async def traced_async( *args, **kwargs ):
+                with trace.span( f"remote {name}", "remote" ) as span:
+                    result = await attr( *args, **kwargs )
+                    span.set( bytes=TracedRemote.size_of( result, args ) )
+                    return result
+            return traced_async
+
+        def traced( *args, **kwargs ):
+            with trace.span( f"remote {name}", "remote" ) as span:
+                result = attr( *args, **kwargs )
+                span.set( bytes=TracedRemote.size_of( result, args ) )
+                return result
+        return traced
+
+    def size_of( result, args ):
+        """ Bytes moved: the text read, or the size of the bundle file involved
+        """
+        if isinstance( result, ( str, bytes ) ):
+            return len( result )
+        if isinstance( result, dict ) and "size" in result:
+            return result[ "size" ]
+        for arg in args:
+            if isinstance( arg, str ) and arg.endswith( ".bundle" ) and os.path.isfile( arg ):
+                return os.path.getsize( arg )
+        return None
+
+
+class DigestSink:
+    """ Passes a bundle's bytes on to `strm` (if any), hashing them on the way.
+
+    Links record { "size": bytes, "sha256": hex } for each bundle. Against
+    such an `expected` digest, write() fails as soon as there is more data
+    than recorded, and check() fails on short or different data.
+    """
+
+    def __init__( self, strm=None, expected=None ):
+        self.strm = strm
+        self.expected = expected
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+
+    def write( self, chunk ):
+        self.size += len( chunk )
+        if None != self.expected and self.size > self.expected[ "size" ]:
+            raise ValueError( f"Bundle is longer than the {self.expected[ 'size' ]} bytes recorded" )
+        self.sha256.update( chunk )
+        if None != self.strm:
+            self.strm.write( chunk )
+
+    def rewind( self ):
+        """ Start again from the first byte (for retries). False if `strm` can't.
+        """
+        if None != self.strm:
+            if not hasattr( self.strm, "seek" ):
+                return False
+            self.strm.seek( 0 )
+            self.strm.truncate()
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+        return True
+
+    def digest( self ):
+        return { "size": self.size, "sha256": self.sha256.hexdigest() }
+
+    def check( self ):
+        if None == self.expected:
+            return
+        if self.size != self.expected[ "size" ]:
+            raise ValueError( f"Bundle is {self.size} bytes, {self.expected[ 'size' ]} recorded" )
+        if self.sha256.hexdigest() != self.expected[ "sha256" ]:
+            raise ValueError( "Bundle doesn't match its recorded SHA-256" )
+
+
+class ManifestSink( DigestSink ):
+    """ DigestSink that also hashes each `chunk_size` piece, for the
+    bundle's chunk manifest (see ChunkedFile)
+    """
+
+    def __init__( self, chunk_size, strm=None ):
+        DigestSink.__init__( self, strm )
+        self.chunk_size = chunk_size
+        self.chunks = []
+        self.chunk = hashlib.sha256()
+        self.chunk_fill = 0
+
+    def write( self, data ):
+        DigestSink.write( self, data )
+        view = memoryview( data )
+        while 0 < len( view ):
+            take = min( len( view ), self.chunk_size - self.chunk_fill )
+            self.chunk.update( view[ :take ] )
+            self.chunk_fill += take
+            view = view[ take: ]
+            if self.chunk_fill == self.chunk_size:
+                self.chunks.append( self.chunk.hexdigest() )
+                self.chunk = hashlib.sha256()
+                self.chunk_fill = 0
+
+    def rewind( self ):
+        if not DigestSink.rewind( self ):
+            return False
+        self.chunks = []
+        self.chunk = hashlib.sha256()
+        self.chunk_fill = 0
+        return True
+
+    def manifest( self ):
+        chunks = self.chunks + ( [ self.chunk.hexdigest() ] if 0 < self.chunk_fill else [] )
+        return dict( self.digest(), chunk_size=self.chunk_size, chunks=chunks )
+
+
+class ContentChunker:
+    """ Splits a stream into content-defined chunks, for the chunk store
+    (see ChunkStoreRemote). A chunk ends just after an anchor (a short
+    byte pattern), but no sooner than min_size and no later than max_size
+    bytes in. Where chunks end depends only on the bytes around the cut,
+    so bundles holding the same objects mostly share chunks, even when
+    the objects sit at different offsets.
+
+    Pack data is mostly zlib output, which is close enough to random for
+    a fixed pattern to serve as the anchor; re finds it at C speed.
+    """
+
+    min_size = 256 << 10
+    max_size = 4 << 20
+    # About one match per MiB of random data (2 ** -20 per position)
+    anchor = re.compile( rb"\x8c\x52[\x00-\x0f]" )
+
+    def __init__( self ):
+        self.buffer = bytearray()
+
+    def write( self, data ):
+        """ The chunks completed by `data`
+        """
+        self.buffer += data
+        chunks = []
+        while True:
+            match = ContentChunker.anchor.search( self.buffer, ContentChunker.min_size, ContentChunker.max_size )
+            if None != match:
+                cut = match.end()
+            elif len( self.buffer ) >= ContentChunker.max_size:
+                cut = ContentChunker.max_size
+            else:
+                return chunks
+            chunks.append( bytes( self.buffer[ :cut ] ) )
+            del self.buffer[ :cut ]
+
+    def close( self ):
+        """ The last chunk (if the stream wasn't empty)
+        """
+        chunks = [ bytes( self.buffer ) ] if 0 < len( self.buffer ) else []
+        self.buffer = bytearray()
+        return chunks
+
+
+class ChunkedFile:
+    """ A bundle written chunk by chunk, in any order, against its chunk
+    manifest (B-<uid>.chunks next to the bundle on the remote):
+
+        { "size": bytes, "sha256": hex, "chunk_size": bytes, "chunks": [ hex, ... ] }
+
+    or, for bundles kept in the chunk store (see ChunkStoreRemote), with
+    chunks of any size:
+
+        { "size": bytes, "sha256": hex, "store": "chunks", "chunks": [ [ hex, bytes ], ... ] }
+
+    Chunks are checked against the manifest, written to <path>.part and
+    logged in <path>.part.log. A transfer that breaks off leaves both
+    behind; the next one to the same path keeps the chunks that still
+    check out and only needs the rest.
+    """
+
+    def __init__( self, path, manifest ):
+        self.path = path
+        self.manifest = manifest
+        self.part_path = f"{path}.part"
+        self.log_path = f"{path}.part.log"
+        self.fd = None
+        self.log = None
+        self.done = set()
+        self.offsets = ChunkedFile.offsets_of( manifest )
+
+    def manifest_of_file( path, chunk_size ):
+        sink = ManifestSink( chunk_size )
+        CornCobRemote.copy_to_sink( path, sink )
+        return sink.manifest()
+
+    def parse_manifest( text ):
+        """ None unless `text` is a usable manifest
+        """
+        try:
+            manifest = json.loads( text )
+            if manifest[ "size" ] == ChunkedFile.offsets_of( manifest )[ -1 ] and isinstance( manifest[ "sha256" ], str ):
+                return manifest
+        except ( ValueError, KeyError, TypeError, IndexError, ZeroDivisionError ):
+            pass
+        return None
+
+    def offsets_of( manifest ):
+        """ Where each chunk starts, and then where the last one ends
+        """
+        offsets = [ 0 ]
+        if "chunk_size" in manifest:
+            count = -( -manifest[ "size" ] // manifest[ "chunk_size" ] )
+            if count != len( manifest[ "chunks" ] ):
+                raise ValueError( "Chunk count doesn't match the size" )
+            offsets += [ min( ( index + 1 ) * manifest[ "chunk_size" ], manifest[ "size" ] ) for index in range( count ) ]
+        else:
+            for [ _, size ] in manifest[ "chunks" ]:
+                offsets.append( offsets[ -1 ] + size )
+        return offsets
+
+    def chunk_hash( self, index ):
+        chunk = self.manifest[ "chunks" ][ index ]
+        return chunk if isinstance( chunk, str ) else chunk[ 0 ]
+
+    def chunk_range( self, index ):
+        return [ self.offsets[ index ], self.offsets[ index + 1 ] ]
+
+    def open( self ):
+        """ Start or resume the transfer. Returns the indexes of the chunks still missing.
+        """
+        self.done = set()
+        if os.path.exists( self.part_path ) and os.path.exists( self.log_path ):
+            with open( self.log_path, "r" ) as log_strm:
+                lines = log_strm.read().split()
+            if 0 < len( lines ) and lines[ 0 ] == self.manifest[ "sha256" ]:
+                self.fd = os.open( self.part_path, os.O_RDWR )
+                for index in set( int( x ) for x in lines[ 1: ] if x.isdigit() ):
+                    if index < len( self.manifest[ "chunks" ] ) and self.matches( index, self.read( index ) ):
+                        self.done.add( index )
+
+        if None == self.fd:
+            self.fd = os.open( self.part_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC )
+            with open( self.log_path, "w" ) as log_strm:
+                log_strm.write( f"{self.manifest[ 'sha256' ]}\n" )
+        os.ftruncate( self.fd, self.manifest[ "size" ] )
+        self.log = open( self.log_path, "a" )
+        return [ index for index in range( len( self.manifest[ "chunks" ] ) ) if index not in self.done ]
+
+    def read( self, index ):
+        [ start, end ] = self.chunk_range( index )
+        return os.pread( self.fd, end - start, start )
+
+    def matches( self, index, data ):
+        [ start, end ] = self.chunk_range( index )
+        return len( data ) == end - start and hashlib.sha256( data ).hexdigest() == self.chunk_hash( index )
+
+    def write( self, index, data ):
+        """ Store chunk `index`. ValueError if it doesn't match the manifest.
+        """
+        if not self.matches( index, data ):
+            raise ValueError( f"Chunk {index} doesn't match its recorded SHA-256" )
+        [ start, _ ] = self.chunk_range( index )
+        view = memoryview( data )
+        while 0 < len( view ):
+            num_bytes = os.pwrite( self.fd, view, start )
+            view = view[ num_bytes: ]
+            start += num_bytes
+        self.log.write( f"{index}\n" )
+        self.log.flush()
+        self.done.add( index )
+
+    def finish( self ):
+        """ Check the whole file and move it to `path`. ValueError if it doesn't match.
+        """
+        self.close()
+        sink = DigestSink( expected=self.manifest )
+        CornCobRemote.copy_to_sink( self.part_path, sink )
+        try:
+            sink.check()
+        except ValueError:
+            self.discard()
+            raise
+        os.replace( self.part_path, self.path )
+        os.remove( self.log_path )
+
+    def close( self ):
+        """ Stop for now, keeping what arrived for a later open()
+        """
+        if None != self.fd:
+            os.close( self.fd )
+            self.fd = None
+        if None != self.log:
+            self.log.close()
+            self.log = None
+
+    def discard( self ):
+        self.close()
+        for path in [ self.part_path, self.log_path ]:
+            if os.path.exists( path ):
+                os.remove( path )
+
+
+class CornCobRemote:
+    """ Abstract class for different kinds of remotes (Google Drive, etc)
+    """
+
+    # Number of links per index file (I-<shard>.yaml)
+    index_shard_size = 256
+
+    # Bundles are uploaded with a chunk manifest (B-<uid>.chunks), so
+    # transfers can be checked and resumed a chunk at a time
+    chunk_size = 4 << 20
+
+    # Where chunks of chunk-stored bundles are looked for before
+    # they're downloaded (a CorncobCache), if anywhere
+    chunk_cache = None
+
+    @staticmethod
+    def init( url, chunk_cache=None ):
+        if url.startswith( "file://" ):
+            remote = LocalFolderRemote( url[ 7: ].strip() )
+        elif url.startswith( "http://" ) or url.startswith( "https://" ):
+            remote = HttpRemote( url.strip() )
+        else:
+            raise NotImplementedError( f"Unsupported CornCob cloud protocol. '{url}'" )
+
+        remote.chunk_cache = chunk_cache
+        return TracedRemote( remote ) if trace.enabled() else remote
+
+    # Every operation has a blocking and an asyncio version.
+    # Backends implement whichever is natural; the async defaults
+    # run the blocking version in a worker thread.
+
+    def run( self, coro ):
+        """ Run `coro` to completion on this remote's event loop.
+        The loop lives as long as the remote, so connections can be reused.
+        """
+        if None == getattr( self, "loop", None ):
+            self.loop = asyncio.new_event_loop()
+        return self.loop.run_until_complete( coro )
+
+    def close( self ):
+        if None != getattr( self, "loop", None ):
+            self.loop.run_until_complete( self.close_async() )
+            self.loop.close()
+            self.loop = None
+
+    async def close_async( self ):
+        pass
+
+    async def get_link_text_async( self, uid ):
+        return await asyncio.to_thread( self.get_link_text, uid )
+
+    async def get_link_async( self, uid ):
+        text = await self.get_link_text_async( uid )
+        if None == text:
+            return None
+        return self.read_link_blob( text )
+
+    async def get_latest_link_async( self ):
+        return await self.get_link_async( "latest-link" )
+
+    def latest_version( self ):
+        """ A token that changes whenever latest-link does (and is cheap
+        to get: no read or parse). None if the backend has none.
+        """
+        return None
+
+    async def latest_version_async( self ):
+        return await asyncio.to_thread( self.latest_version )
+
+    async def get_index_async( self, shard ):
+        return await asyncio.to_thread( self.get_index, shard )
+
+    async def upload_index_async( self, shard, entries ):
+        return await asyncio.to_thread( self.upload_index, shard, entries )
+
+    async def download_bundle_async( self, bundle_uid, local_bundle_path, digest=None ):
+        """ With a `digest` (from the link), fail unless the copy matches it
+        """
+        await asyncio.to_thread( self.download_bundle, bundle_uid, local_bundle_path )
+        if None != digest:
+            sink = DigestSink( expected=digest )
+            try:
+                CornCobRemote.copy_to_sink( local_bundle_path, sink )
+                sink.check()
+            except ValueError as exn:
+                raise RemoteFailed( getattr( self, "url", None ), f"download B-{bundle_uid}.bundle", str( exn ) )
+
+    async def upload_bundle_async( self, bundle_uid, local_bundle_path ):
+        return await asyncio.to_thread( self.upload_bundle, bundle_uid, local_bundle_path )
+
+    async def upload_bundle_stream_async( self, bundle_uid, chunks ):
+        """ Upload a bundle from an async iterator of byte strings, and
+        return its chunk manifest. If the iterator fails, nothing may be left
+        under the bundle's name. This default goes through a temp file;
+        backends that can, stream.
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join( tmp, f"B-{bundle_uid}.bundle" )
+            with open( path, "wb" ) as strm:
+                sink = ManifestSink( CornCobRemote.chunk_size, strm )
+                async for chunk in chunks:
+                    sink.write( chunk )
+            await self.upload_bundle_async( bundle_uid, path )
+        return sink.manifest()
+
+    async def stream_bundle_async( self, bundle_uid, sink ):
+        """ Write the bundle's bytes to `sink` (anything with write( bytes )).
+        Bundles available as local files are read in place; otherwise this
+        default downloads to a temp file first. Backends that can, stream.
+        """
+        path = self.bundle_path( bundle_uid )
+        if None != path:
+            return CornCobRemote.copy_to_sink( path, sink )
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join( tmp, f"B-{bundle_uid}.bundle" )
+            await self.download_bundle_async( bundle_uid, path )
+            CornCobRemote.copy_to_sink( path, sink )
+
+    def stored_as_chunks( manifest ):
+        """ True for the manifest of a bundle kept in the chunk store
+        """
+        return None != manifest and "chunks" == manifest.get( "store" )
+
+    async def has_chunk_async( self, sha ):
+        return await asyncio.to_thread( self.has_chunk, sha )
+
+    async def get_chunk_async( self, sha ):
+        return await asyncio.to_thread( self.get_chunk, sha )
+
+    async def put_chunk_async( self, sha, data ):
+        return await asyncio.to_thread( self.put_chunk, sha, data )
+
+    async def put_chunk_manifest_async( self, bundle_uid, manifest ):
+        return await asyncio.to_thread( self.put_chunk_manifest, bundle_uid, manifest )
+
+    async def get_chunk_manifest_async( self, bundle_uid ):
+        return await asyncio.to_thread( self.get_chunk_manifest, bundle_uid )
+
+    async def delete_chunk_async( self, sha ):
+        return await asyncio.to_thread( self.delete_chunk, sha )
+
+    def list_chunks( self ):
+        """ shas of every chunk in the chunk store. None if the backend can't list its files
+        """
+        return None
+
+    async def get_stored_chunk_async( self, sha ):
+        """ Chunk `sha` of the chunk store, from chunk_cache if it's there
+        (and added to it if not)
+        """
+        if None != self.chunk_cache:
+            path = self.chunk_cache.lookup( "chunks", sha )
+            if None != path:
+                with open( path, "rb" ) as strm:
+                    return strm.read()
+
+        data = await self.get_chunk_async( sha )
+        if None == data:
+            raise RemoteFailed( getattr( self, "url", None ), f"read K-{sha}", "Missing from the chunk store" )
+        if hashlib.sha256( data ).hexdigest() != sha:
+            raise RemoteFailed( getattr( self, "url", None ), f"read K-{sha}", "Chunk doesn't match its SHA-256" )
+        if None != self.chunk_cache:
+            self.chunk_cache.insert_bytes( "chunks", sha, data )
+        return data
+
+    async def download_stored_chunks_async( self, bundle_uid, local_bundle_path, manifest, digest=None ):
+        """ Put together a bundle kept in the chunk store, chunk_streams
+        chunks at a time. Like other chunked downloads (ChunkedFile), one
+        that breaks off is picked up again by the next one to the same path.
+        """
+        if None != digest and [ digest[ "size" ], digest[ "sha256" ] ] != [ manifest[ "size" ], manifest[ "sha256" ] ]:
+            raise RemoteFailed( getattr( self, "url", None ), f"read B-{bundle_uid}.chunks", "Manifest doesn't match the link's digest" )
+
+        transfer = ChunkedFile( local_bundle_path, manifest )
+        slots = asyncio.Semaphore( ChunkStoreRemote.chunk_streams )
+
+        async def fetch_chunk( index ):
+            async with slots:
+                transfer.write( index, await self.get_stored_chunk_async( transfer.chunk_hash( index ) ) )
+
+        tasks = [ asyncio.create_task( fetch_chunk( index ) ) for index in transfer.open() ]
+        try:
+            await asyncio.gather( *tasks )
+            transfer.finish()
+        except ValueError as exn:
+            raise RemoteFailed( getattr( self, "url", None ), f"read B-{bundle_uid}.chunks", str( exn ) )
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather( *tasks, return_exceptions=True )
+            transfer.close()
+
+    async def stream_stored_chunks_async( self, manifest, sink ):
+        """ Write a chunk-stored bundle to `sink` in order, fetching up to
+        chunk_streams chunks ahead
+        """
+        shas = [ sha for [ sha, _ ] in manifest[ "chunks" ] ]
+        ahead = [ asyncio.create_task( self.get_stored_chunk_async( sha ) ) for sha in shas[ :ChunkStoreRemote.chunk_streams ] ]
+        try:
+            for index in range( len( shas ) ):
+                data = await ahead[ index ]
+                ahead[ index ] = None
+                if index + ChunkStoreRemote.chunk_streams < len( shas ):
+                    ahead.append( asyncio.create_task( self.get_stored_chunk_async( shas[ index + ChunkStoreRemote.chunk_streams ] ) ) )
+                sink.write( data )
+        finally:
+            for task in ahead:
+                if None != task:
+                    task.cancel()
+            await asyncio.gather( *[ task for task in ahead if None != task ], return_exceptions=True )
+
+    async def upload_link_async( self, link_uid, blob ):
+        return await asyncio.to_thread( self.upload_link, link_uid, blob )
+
+    async def claim_link_async( self, seq, link_uid ):
+        return await asyncio.to_thread( self.claim_link, seq, link_uid )
+
+    async def get_claim_async( self, seq ):
+        return await asyncio.to_thread( self.get_claim, seq )
+
+    async def set_latest_link_async( self, blob ):
+        return await asyncio.to_thread( self.set_latest_link, blob )
+
+    def bundle_path( self, bundle_uid ):
+        """ Path of the bundle if it can be read in place, read-only. None otherwise.
+        """
+        return None
+
+    def bundle_create_path( self, bundle_uid ):
+        """ Path where a new bundle can be written directly (before
+        upload_bundle is called with it). None otherwise.
+        """
+        return None
+
+    # ioctl to share extents between files (reflink), from linux/fs.h
+    FICLONE = 0x40049409
+
+    def copy_to_sink( path, sink ):
+        with open( path, "rb" ) as strm:
+            for chunk in iter( lambda: strm.read( 1 << 20 ), b"" ):
+                sink.write( chunk )
+
+
+    def link_file( src, dst ):
+        """ Make `dst` share `src`'s data without copying it (hardlink, else
+        reflink). False if the filesystem can't.
+        """
+        if os.path.exists( dst ):
+            os.remove( dst )
+        try:
+            os.link( src, dst )
+            return True
+        except OSError:
+            pass
+
+        with open( src, "rb" ) as src_strm, open( dst, "wb" ) as dst_strm:
+            try:
+                import fcntl
+                fcntl.ioctl( dst_strm.fileno(), CornCobRemote.FICLONE, src_strm.fileno() )
+                return True
+            except ( ImportError, OSError ):
+                pass
+        os.remove( dst )
+        return False
+
+    def copy_file( src, dst ):
+        """ Copy `src` to `dst`, moving as little data as the filesystem allows:
+        hardlink, else reflink, else copy_file_range (in the kernel), else a plain copy.
+        Only for files that are never modified in place, like bundles.
+        """
+        if CornCobRemote.link_file( src, dst ):
+            return
+
+        with open( src, "rb" ) as src_strm, open( dst, "wb" ) as dst_strm:
+            size = os.fstat( src_strm.fileno() ).st_size
+            copied = 0
+            try:
+                while copied < size:
+                    num_bytes = os.copy_file_range( src_strm.fileno(), dst_strm.fileno(), size - copied )
+                    if 0 == num_bytes:
+                        break
+                    copied += num_bytes
+            except ( AttributeError, OSError ):
+                pass
+            if copied == size:
+                return
+
+            src_strm.seek( 0 )
+            dst_strm.seek( 0 )
+            dst_strm.truncate()
+            shutil.copyfileobj( src_strm, dst_strm, 1 << 20 )
+
+    def get_link( self, uid ):
+        text = self.get_link_text( uid )
+        if None == text:
+            return None
+        return self.read_link_blob( text )
+
+    def get_latest_link( self ):
+        return self.get_link( "latest-link" )
+
+    # Links (and index files) are written as canonical JSON:
+    #   { "corncob-link": link_format, "ids": ..., "branches": ..., "bundles": ..., "supp": ... }
+    # Links written before that are YAML lists: [ ids, branches, bundles, supp ]
+    # Versions from before the JSON format can't read these: they parse them
+    # as YAML, get a mapping instead of a list and fail (KeyError 0).
+    # Links with bundles in the chunk store are format 3 (format 2 otherwise),
+    # so that versions that read format 2 refuse them instead of looking for
+    # B-<uid>.bundle.
+    link_format = 3
+
+    def read_link_blob( self, link_text ):
+        if not isinstance( link_text, str ):
+            link_text = link_text.read()
+
+        with trace.span( "parse link", "parse", bytes=len( link_text ) ):
+            return CornCobRemote.parse_link_text( link_text )
+
+    def parse_link_text( link_text ):
+        if link_text.lstrip().startswith( "{" ):
+            parsed_data = json.loads( link_text )
+            if parsed_data.get( "corncob-link", 0 ) > CornCobRemote.link_format:
+                raise ValueError( f"Link format {parsed_data[ 'corncob-link' ]} is newer than this version of CornCob" )
+            parsed_data = [ parsed_data[ "ids" ], parsed_data[ "branches" ], parsed_data[ "bundles" ], parsed_data[ "supp" ] ]
+        else:
+            parsed_data = CornCobRemote.load_legacy_yaml( link_text )
+
+        link_ids = parsed_data[ 0 ]
+        branches = parsed_data[ 1 ]
+        bundles = parsed_data[ 2 ]
+        for bundle in bundles:
+            ps = bundle[ 1 ]
+            bundle[ 1 ] = dict( zip( ps[ 0::2 ], ps[ 1::2 ] ) )
+        if len( parsed_data ) > 3:
+            supp_data = parsed_data[ 3 ]
+        else:
+            supp_data = {}
+        return [ link_ids, branches, bundles, supp_data ]
+
+    def write_link_blob( self, blob ):
+        [ link_ids, branches, bundles, supp_data ] = blob
+        digests = [ bundle[ 2 ] for bundle in bundles if 2 < len( bundle ) ] + [ supp_data.get( "shallow", [ None, None ] )[ 1 ] ]
+        chunked = any( None != digest and "store" in digest for digest in digests )
+        return CornCobRemote.write_json( {
+            "corncob-link": CornCobRemote.link_format if chunked else 2,
+            "ids": link_ids,
+            "branches": branches,
+            "bundles": bundles,
+            "supp": supp_data } )
+
+    def read_index( self, index_text ):
+        """ Entries with bundles as [ uid, digest ] (older indexes list bare uids)
+        """
+        if index_text.lstrip().startswith( "[" ):
+            entries = json.loads( index_text )
+        else:
+            entries = CornCobRemote.load_legacy_yaml( index_text ) or []
+        for e in entries:
+            e[ 2 ] = [ b if isinstance( b, list ) else [ b, None ] for b in e[ 2 ] ]
+        return entries
+
+    def write_json( data ):
+        return json.dumps( data, sort_keys=True, separators=( ",", ":" ) )
+
+    def load_legacy_yaml( text ):
+        # Only needed for old remotes, so don't pay for the import otherwise
+        import yaml
+        loader = getattr( yaml, "CSafeLoader", yaml.SafeLoader )
+        return yaml.load( text, Loader=loader )
+
+
+class LocalFolderRemote( CornCobRemote ):
+    """ Mostly for debugging purposes. Pretend a local folder is a cloud location.
+    """
+
+    # Bundle copies that fail part way are retried (from the chunks
+    # already copied) this many times, after `backoff` seconds, doubling
+    retries = 5
+    backoff = 0.2
+
+    def __init__( self, path ):
+        self.path = None
+
+        if not os.path.isdir( path ):
+            raise RemoteFailed( f"file://{path}", "open", "not a folder" )
+
+        self.path = path
+
+
+    def write_file( self, name, text, exclusive=False ):
+        """ Write via a temp file and a rename, so readers never see a partial file.
+        With `exclusive`, only create `name` if it doesn't exist yet.
+        Returns False if it already did.
+        """
+        path = f"{self.path}{os.path.sep}{name}"
+        path_tmp = f"{self.path}{os.path.sep}.tmp-{Corncob.token_hex( 8 )}"
+        with open( path_tmp, "w", encoding="utf-8" ) as strm:
+            strm.write( text )
+
+        if not exclusive:
+            os.replace( path_tmp, path )
+            return True
+
+        try:
+            # link() fails if the target exists: an atomic create-if-absent
+            os.link( path_tmp, path )
+            return True
+        except FileExistsError:
+            return False
+        except OSError:
+            # Filesystems without hardlinks. Still exclusive, but not atomic.
+            try:
+                fd = os.open( path, os.O_WRONLY | os.O_CREAT | os.O_EXCL )
+            except FileExistsError:
+                return False
+            with os.fdopen( fd, "w", encoding="utf-8" ) as strm:
+                strm.write( text )
+            return True
+        finally:
+            if os.path.exists( path_tmp ):
+                os.remove( path_tmp )
+
+
+    def upload_bundle( self, bundle_uid, local_bundle_path ):
+        path_bundle = self.bundle_create_path( bundle_uid )
+        manifest = ChunkedFile.manifest_of_file( local_bundle_path, CornCobRemote.chunk_size )
+        if os.path.abspath( local_bundle_path ) != path_bundle:
+            if not CornCobRemote.link_file( local_bundle_path, path_bundle ):
+                self.copy_chunks( local_bundle_path, path_bundle, manifest )
+        self.write_file( f"B-{bundle_uid}.chunks", CornCobRemote.write_json( manifest ) )
+        return manifest
+
+
+    async def upload_bundle_stream_async( self, bundle_uid, chunks ):
+        path_bundle = self.bundle_create_path( bundle_uid )
+        path_tmp = f"{self.path}{os.path.sep}.tmp-{Corncob.token_hex( 8 )}"
+        try:
+            with open( path_tmp, "wb" ) as strm:
+                sink = ManifestSink( CornCobRemote.chunk_size, strm )
+                async for chunk in chunks:
+                    sink.write( chunk )
+            os.replace( path_tmp, path_bundle )
+        finally:
+            if os.path.exists( path_tmp ):
+                os.remove( path_tmp )
+        manifest = sink.manifest()
+        self.write_file( f"B-{bundle_uid}.chunks", CornCobRemote.write_json( manifest ) )
+        return manifest
+
+
+    def copy_chunks( self, src, dst, manifest ):
+        """ Copy a chunk at a time, so a copy to or from a folder that drops
+        out (network mount, synced folder) carries on where it stopped
+        """
+        transfer = ChunkedFile( dst, manifest )
+        for attempt in range( LocalFolderRemote.retries + 1 ):
+            try:
+                missing = transfer.open()
+                with open( src, "rb" ) as src_strm:
+                    for index in missing:
+                        [ start, end ] = transfer.chunk_range( index )
+                        src_strm.seek( start )
+                        transfer.write( index, src_strm.read( end - start ) )
+                return transfer.finish()
+            except OSError as exn:
+                reason = repr( exn )
+                transfer.close()
+            if attempt < LocalFolderRemote.retries:
+                time.sleep( LocalFolderRemote.backoff * ( 2 ** attempt ) )
+
+        raise RemoteFailed( self.path, f"copy {src} to {dst}", reason )
+
+
+    def upload_link( self, link_uid, blob ):
+        return self.write_file( f"L-{link_uid}.yaml", self.write_link_blob( blob ), exclusive=True )
+
+
+    def claim_link( self, seq, link_uid ):
+        if self.write_file( f"C-{seq}", link_uid, exclusive=True ):
+            return link_uid
+        return self.get_claim( seq )
+
+
+    def get_claim( self, seq ):
+        path_claim = f"{self.path}{os.path.sep}C-{seq}"
+        if not os.path.exists( path_claim ):
+            return None
+        with open( path_claim, "r", encoding="utf-8" ) as claim_strm:
+            return claim_strm.read().strip() or None
+
+
+    def set_latest_link( self, blob ):
+        self.write_file( "latest-link.yaml", self.write_link_blob( blob ) )
+
+
+    def latest_version( self ):
+        # set_latest_link replaces the file, so the inode changes even
+        # when mtime and size don't
+        try:
+            stat = os.stat( f"{self.path}{os.path.sep}latest-link.yaml" )
+        except FileNotFoundError:
+            return None
+        return f"{stat.st_ino}-{stat.st_size}-{stat.st_mtime_ns}"
+
+
+    def get_link_text( self, uid ):
+        if uid == "latest-link":
+            path_link = f"{self.path}{os.path.sep}latest-link.yaml"
+        else:
+            path_link = f"{self.path}{os.path.sep}L-{uid}.yaml"
+
+        if not os.path.exists( path_link ):
+            return None
+
+        with open( path_link, "r", encoding="utf-8" ) as link_file_strm:
+            return link_file_strm.read()
+
+
+    def get_index( self, shard ):
+        path_index = f"{self.path}{os.path.sep}I-{shard}.yaml"
+        if not os.path.exists( path_index ):
+            return []
+
+        with open( path_index, "r", encoding="utf-8" ) as index_strm:
+            return self.read_index( index_strm.read() )
+
+
+    def upload_index( self, shard, entries ):
+        self.write_file( f"I-{shard}.yaml", CornCobRemote.write_json( entries ) )
+
+
+    def download_bundle( self, bundle_uid, local_bundle_path, digest=None ):
+        manifest = self.get_chunk_manifest( bundle_uid )
+        if CornCobRemote.stored_as_chunks( manifest ):
+            return self.run( self.download_stored_chunks_async( bundle_uid, local_bundle_path, manifest, digest ) )
+        path_bundle = f"{self.path}{os.path.sep}B-{bundle_uid}.bundle"
+        if CornCobRemote.link_file( path_bundle, local_bundle_path ):
+            return
+        if None == manifest:
+            CornCobRemote.copy_file( path_bundle, local_bundle_path )
+        else:
+            self.copy_chunks( path_bundle, local_bundle_path, manifest )
+
+
+    async def download_bundle_async( self, bundle_uid, local_bundle_path, digest=None ):
+        manifest = self.get_chunk_manifest( bundle_uid )
+        if CornCobRemote.stored_as_chunks( manifest ):
+            return await self.download_stored_chunks_async( bundle_uid, local_bundle_path, manifest, digest )
+        return await CornCobRemote.download_bundle_async( self, bundle_uid, local_bundle_path, digest )
+
+
+    def get_chunk_manifest( self, bundle_uid ):
+        path_manifest = f"{self.path}{os.path.sep}B-{bundle_uid}.chunks"
+        if not os.path.exists( path_manifest ):
+            return None
+        with open( path_manifest, "r", encoding="utf-8" ) as manifest_strm:
+            return ChunkedFile.parse_manifest( manifest_strm.read() )
+
+
+    def has_chunk( self, sha ):
+        return os.path.exists( f"{self.path}{os.path.sep}K-{sha}" )
+
+
+    def get_chunk( self, sha ):
+        path_chunk = f"{self.path}{os.path.sep}K-{sha}"
+        if not os.path.exists( path_chunk ):
+            return None
+        with open( path_chunk, "rb" ) as chunk_strm:
+            return chunk_strm.read()
+
+
+    def put_chunk( self, sha, data ):
+        path_tmp = f"{self.path}{os.path.sep}.tmp-{Corncob.token_hex( 8 )}"
+        try:
+            with open( path_tmp, "wb" ) as strm:
+                strm.write( data )
+            os.replace( path_tmp, f"{self.path}{os.path.sep}K-{sha}" )
+        finally:
+            if os.path.exists( path_tmp ):
+                os.remove( path_tmp )
+
+
+    def put_chunk_manifest( self, bundle_uid, manifest ):
+        self.write_file( f"B-{bundle_uid}.chunks", CornCobRemote.write_json( manifest ) )
+
+
+    def bundle_path( self, bundle_uid ):
+        path_bundle = f"{self.path}{os.path.sep}B-{bundle_uid}.bundle"
+        if os.path.exists( path_bundle ):
+            return path_bundle
+        return None
+
+
+    def bundle_create_path( self, bundle_uid ):
+        # `git bundle create` writes through a lock file, so readers
+        # never see a partial bundle under the final name
+        return os.path.abspath( f"{self.path}{os.path.sep}B-{bundle_uid}.bundle" )
+
+
+    def delete_bundle( self, bundle_uid ):
+        for name in [ f"B-{bundle_uid}.bundle", f"B-{bundle_uid}.chunks" ]:
+            path = f"{self.path}{os.path.sep}{name}"
+            if os.path.exists( path ):
+                os.remove( path )
+
+
+    def delete_chunk( self, sha ):
+        path_chunk = f"{self.path}{os.path.sep}K-{sha}"
+        if os.path.exists( path_chunk ):
+            os.remove( path_chunk )
+
+
+    def list_chunks( self ):
+        return [ name[ 2: ] for name in os.listdir( self.path ) if name.startswith( "K-" ) ]
+
+
+    def delete_link( self, uid ):
+        path_link = f"{self.path}{os.path.sep}L-{uid}.yaml"
+        if os.path.exists( path_link ):
+            os.remove( path_link )
+
+
+    def delete_index( self, shard ):
+        path_index = f"{self.path}{os.path.sep}I-{shard}.yaml"
+        if os.path.exists( path_index ):
+            os.remove( path_index )
+
+
+    def delete_claim( self, seq ):
+        path_claim = f"{self.path}{os.path.sep}C-{seq}"
+        if os.path.exists( path_claim ):
+            os.remove( path_claim )
+
+
+class HttpRemote( CornCobRemote ):
+    """ Remote kept on a plain HTTP server, as files under the URL's path
+    (same names as LocalFolderRemote), read with GET and written with PUT.
+    A stand-in for cloud storage APIs.
+
+    - Keep-alive connections are pooled, at most max_connections at a time
+    - Failed requests (connection errors, 5xx, 429) are retried with
+      exponential backoff
+    """
+
+    max_connections = 8
+    retries = 5
+    # Seconds before the first retry. Doubles each time, with jitter.
+    backoff = 0.2
+    # Parallel range requests per chunked download
+    chunk_streams = 4
+
+    def __init__( self, url ):
+        parts = urllib.parse.urlsplit( url )
+        self.url = url
+        self.use_ssl = "https" == parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port or ( 443 if self.use_ssl else 80 )
+        self.base = parts.path.rstrip( "/" )
+        self.connections = None
+
+
+    async def request( self, method, name, body=None, body_path=None, response_path=None, headers={}, response_headers=None, body_chunks=None ):
+        """ [ status, response body ]
+        The body is streamed from/to a file when body_path/response_path is given
+        (then the response body is None for 2xx responses). response_path
+        can also be a ResponseSink, to stream the body elsewhere.
+        body_chunks (an async iterator of bytes) is sent with chunked transfer
+        encoding. It can only be sent once, so such requests aren't retried.
+        The response's headers (lower case names) go into `response_headers`, if given.
+        """
+        if None == self.connections:
+            self.connections = HttpConnectionPool( self.host, self.port, self.use_ssl, HttpRemote.max_connections )
+
+        path = urllib.parse.quote( f"{self.base}/{name}" )
+        for attempt in range( HttpRemote.retries + 1 ):
+            try:
+                [ status, data, reply_headers ] = await self.connections.request( method, path, headers, body, body_path, body_chunks, response_path )
+                if status < 500 and 429 != status:
+                    if None != response_headers:
+                        response_headers.update( reply_headers )
+                    return [ status, data ]
+                reason = f"HTTP {status}"
+            except ( OSError, asyncio.IncompleteReadError, ValueError ) as exn:
+                reason = repr( exn )
+                if isinstance( response_path, ResponseSink ) and not response_path.rewind():
+                    # Part of the body has gone downstream already
+                    break
+            if None != body_chunks:
+                break
+
+            if attempt < HttpRemote.retries:
+                await asyncio.sleep( HttpRemote.backoff * ( 2 ** attempt ) * random.uniform( 0.5, 1.5 ) )
+
+        raise RemoteFailed( self.url, f"{method} {name}", reason )
+
+
+    async def get_text_async( self, name ):
+        [ status, data ] = await self.request( "GET", name )
+        if 404 == status:
+            return None
+        if 200 != status:
+            raise RemoteFailed( self.url, f"GET {name}", f"HTTP {status}" )
+        return data.decode( "utf-8" )
+
+
+    async def put_async( self, name, body=None, body_path=None, body_chunks=None ):
+        [ status, _ ] = await self.request( "PUT", name, body=body, body_path=body_path, body_chunks=body_chunks )
+        if not 200 <= status < 300:
+            raise RemoteFailed( self.url, f"PUT {name}", f"HTTP {status}" )
+
+
+    async def delete_async( self, name ):
+        [ status, _ ] = await self.request( "DELETE", name )
+        if not ( 200 <= status < 300 or 404 == status ):
+            raise RemoteFailed( self.url, f"DELETE {name}", f"HTTP {status}" )
+
+
+    async def get_link_text_async( self, uid ):
+        name = "latest-link.yaml" if uid == "latest-link" else f"L-{uid}.yaml"
+        return await self.get_text_async( name )
+
+
+    async def latest_version_async( self ):
+        """ latest-link's ETag (else Last-Modified and size), from a HEAD request
+        """
+        response_headers = {}
+        [ status, _ ] = await self.request( "HEAD", "latest-link.yaml", response_headers=response_headers )
+        if 404 == status:
+            return None
+        if 200 != status:
+            raise RemoteFailed( self.url, "HEAD latest-link.yaml", f"HTTP {status}" )
+        if "etag" in response_headers:
+            return response_headers[ "etag" ]
+        if "last-modified" in response_headers:
+            return f"{response_headers[ 'last-modified' ]} {response_headers.get( 'content-length' )}"
+        return None
+
+
+    async def get_index_async( self, shard ):
+        text = await self.get_text_async( f"I-{shard}.yaml" )
+        if None == text:
+            return []
+        return self.read_index( text )
+
+
+    async def upload_index_async( self, shard, entries ):
+        await self.put_async( f"I-{shard}.yaml", body=CornCobRemote.write_json( entries ).encode( "utf-8" ) )
+
+
+    async def download_bundle_async( self, bundle_uid, local_bundle_path, digest=None ):
+        """ The bundle is hashed as it arrives. Bundles of more than one chunk
+        are fetched in chunks (see download_chunks_async); a failed or corrupt
+        transfer of anything smaller is retried from the start.
+        """
+        manifest = None
+        if None == digest or "store" in digest or digest[ "size" ] > CornCobRemote.chunk_size:
+            manifest = await self.get_chunk_manifest_async( bundle_uid )
+        if CornCobRemote.stored_as_chunks( manifest ):
+            return await self.download_stored_chunks_async( bundle_uid, local_bundle_path, manifest, digest )
+        if None != manifest and 1 < len( manifest[ "chunks" ] ) and \
+           ( None == digest or [ digest[ "size" ], digest[ "sha256" ] ] == [ manifest[ "size" ], manifest[ "sha256" ] ] ):
+            return await self.download_chunks_async( bundle_uid, local_bundle_path, manifest )
+
+        name = f"B-{bundle_uid}.bundle"
+        with open( local_bundle_path, "wb" ) as strm:
+            sink = DigestSink( strm, digest )
+            [ status, _ ] = await self.request( "GET", name, response_path=ResponseSink( sink ) )
+            if 200 != status:
+                raise RemoteFailed( self.url, f"GET {name}", f"HTTP {status}" )
+            try:
+                sink.check()
+            except ValueError as exn:
+                raise RemoteFailed( self.url, f"GET {name}", str( exn ) )
+
+
+    async def download_chunks_async( self, bundle_uid, local_bundle_path, manifest ):
+        """ Range requests for one chunk each, chunk_streams at a time, every
+        chunk checked as it arrives and retried on its own. The chunks are
+        kept (ChunkedFile) if the transfer fails, so the next attempt at
+        the same path only fetches what is missing.
+        """
+        name = f"B-{bundle_uid}.bundle"
+        transfer = ChunkedFile( local_bundle_path, manifest )
+        slots = asyncio.Semaphore( HttpRemote.chunk_streams )
+
+        async def fetch_chunk( index ):
+            async with slots:
+                [ start, end ] = transfer.chunk_range( index )
+                for attempt in range( HttpRemote.retries + 1 ):
+                    if index in transfer.done:
+                        return
+                    [ status, data ] = await self.request( "GET", name, headers={ "Range": f"bytes={start}-{end - 1}" } )
+                    if 200 == status and len( data ) == manifest[ "size" ]:
+                        # The server ignored the range and sent everything
+                        for other in range( len( manifest[ "chunks" ] ) ):
+                            if other not in transfer.done:
+                                [ other_start, other_end ] = transfer.chunk_range( other )
+                                transfer.write( other, data[ other_start:other_end ] )
+                        return
+                    if 206 != status:
+                        raise RemoteFailed( self.url, f"GET {name}", f"HTTP {status}" )
+                    try:
+                        return transfer.write( index, data )
+                    except ValueError as exn:
+                        reason = str( exn )
+                raise RemoteFailed( self.url, f"GET {name}", reason )
+
+        tasks = [ asyncio.create_task( fetch_chunk( index ) ) for index in transfer.open() ]
+        try:
+            await asyncio.gather( *tasks )
+            transfer.finish()
+        except ValueError as exn:
+            raise RemoteFailed( self.url, f"GET {name}", str( exn ) )
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather( *tasks, return_exceptions=True )
+            transfer.close()
+
+
+    async def get_chunk_manifest_async( self, bundle_uid ):
+        text = await self.get_text_async( f"B-{bundle_uid}.chunks" )
+        return None if None == text else ChunkedFile.parse_manifest( text )
+
+
+    async def stream_bundle_async( self, bundle_uid, sink ):
+        name = f"B-{bundle_uid}.bundle"
+        [ status, _ ] = await self.request( "GET", name, response_path=ResponseSink( sink ) )
+        if 404 == status:
+            manifest = await self.get_chunk_manifest_async( bundle_uid )
+            if CornCobRemote.stored_as_chunks( manifest ):
+                return await self.stream_stored_chunks_async( manifest, sink )
+        if 200 != status:
+            raise RemoteFailed( self.url, f"GET {name}", f"HTTP {status}" )
+
+
+    async def create_async( self, name, body ):
+        """ PUT `name` only if it doesn't exist yet (If-None-Match: *).
+        False if it already did. A retried PUT that had in fact succeeded
+        also reports False, so callers read back what is there.
+        """
+        [ status, _ ] = await self.request( "PUT", name, body=body, headers={ "If-None-Match": "*" } )
+        if 412 == status:
+            return False
+        if not 200 <= status < 300:
+            raise RemoteFailed( self.url, f"PUT {name}", f"HTTP {status}" )
+        return True
+
+
+    async def upload_bundle_stream_async( self, bundle_uid, chunks ):
+        """ One PUT, with a chunked request body (not retried; see Corncob.create_bundle)
+        """
+        sink = ManifestSink( CornCobRemote.chunk_size )
+
+        async def hashed():
+            async for chunk in chunks:
+                sink.write( chunk )
+                yield chunk
+
+        await self.put_async( f"B-{bundle_uid}.bundle", body_chunks=hashed() )
+        manifest = sink.manifest()
+        await self.put_async( f"B-{bundle_uid}.chunks", body=CornCobRemote.write_json( manifest ).encode( "utf-8" ) )
+        return manifest
+
+
+    async def upload_bundle_async( self, bundle_uid, local_bundle_path ):
+        # Plain PUT can't continue a partial upload; a failed one is retried whole
+        manifest = await asyncio.to_thread( ChunkedFile.manifest_of_file, local_bundle_path, CornCobRemote.chunk_size )
+        await self.put_async( f"B-{bundle_uid}.bundle", body_path=local_bundle_path )
+        await self.put_async( f"B-{bundle_uid}.chunks", body=CornCobRemote.write_json( manifest ).encode( "utf-8" ) )
+        return manifest
+
+
+    async def has_chunk_async( self, sha ):
+        name = f"K-{sha}"
+        [ status, _ ] = await self.request( "HEAD", name )
+        if 404 == status:
+            return False
+        if 200 != status:
+            raise RemoteFailed( self.url, f"HEAD {name}", f"HTTP {status}" )
+        return True
+
+
+    async def get_chunk_async( self, sha ):
+        name = f"K-{sha}"
+        [ status, data ] = await self.request( "GET", name )
+        if 404 == status:
+            return None
+        if 200 != status:
+            raise RemoteFailed( self.url, f"GET {name}", f"HTTP {status}" )
+        return data
+
+
+    async def put_chunk_async( self, sha, data ):
+        await self.put_async( f"K-{sha}", body=data )
+
+
+    async def put_chunk_manifest_async( self, bundle_uid, manifest ):
+        await self.put_async( f"B-{bundle_uid}.chunks", body=CornCobRemote.write_json( manifest ).encode( "utf-8" ) )
+
+
+    async def delete_chunk_async( self, sha ):
+        await self.delete_async( f"K-{sha}" )
+
+
+    async def upload_link_async( self, link_uid, blob ):
+        return await self.create_async( f"L-{link_uid}.yaml", self.write_link_blob( blob ).encode( "utf-8" ) )
+
+
+    async def claim_link_async( self, seq, link_uid ):
+        if await self.create_async( f"C-{seq}", link_uid.encode( "utf-8" ) ):
+            return link_uid
+        return await self.get_claim_async( seq )
+
+
+    async def get_claim_async( self, seq ):
+        text = await self.get_text_async( f"C-{seq}" )
+        return None if None == text else ( text.strip() or None )
+
+
+    async def set_latest_link_async( self, blob ):
+        await self.put_async( "latest-link.yaml", body=self.write_link_blob( blob ).encode( "utf-8" ) )
+
+
+    async def close_async( self ):
+        if None != self.connections:
+            await self.connections.close()
+            self.connections = None
+
+
+    def get_link_text( self, uid ):
+        return self.run( self.get_link_text_async( uid ) )
+
+    def get_index( self, shard ):
+        return self.run( self.get_index_async( shard ) )
+
+    def latest_version( self ):
+        return self.run( self.latest_version_async() )
+
+    def upload_index( self, shard, entries ):
+        return self.run( self.upload_index_async( shard, entries ) )
+
+    def download_bundle( self, bundle_uid, local_bundle_path, digest=None ):
+        return self.run( self.download_bundle_async( bundle_uid, local_bundle_path, digest ) )
+
+    def upload_bundle( self, bundle_uid, local_bundle_path ):
+        return self.run( self.upload_bundle_async( bundle_uid, local_bundle_path ) )
+
+    def upload_link( self, link_uid, blob ):
+        return self.run( self.upload_link_async( link_uid, blob ) )
+
+    def claim_link( self, seq, link_uid ):
+        return self.run( self.claim_link_async( seq, link_uid ) )
+
+    def get_claim( self, seq ):
+        return self.run( self.get_claim_async( seq ) )
+
+    def set_latest_link( self, blob ):
+        return self.run( self.set_latest_link_async( blob ) )
+
+    def delete_bundle( self, bundle_uid ):
+        self.run( self.delete_async( f"B-{bundle_uid}.bundle" ) )
+        self.run( self.delete_async( f"B-{bundle_uid}.chunks" ) )
+
+    def get_chunk_manifest( self, bundle_uid ):
+        return self.run( self.get_chunk_manifest_async( bundle_uid ) )
+
+    def delete_chunk( self, sha ):
+        return self.run( self.delete_chunk_async( sha ) )
+
+    def delete_link( self, uid ):
+        return self.run( self.delete_async( f"L-{uid}.yaml" ) )
+
+    def delete_index( self, shard ):
+        return self.run( self.delete_async( f"I-{shard}.yaml" ) )
+
+    def delete_claim( self, seq ):
+        return self.run( self.delete_async( f"C-{seq}" ) )
+
+
+class ResponseSink:
+    """ Destination for a streamed HTTP response body, counting what it has passed on
+    """
+    def __init__( self, sink ):
+        self.sink = sink
+        self.written = 0
+
+    def write( self, chunk ):
+        self.sink.write( chunk )
+        self.written += len( chunk )
+
+    def rewind( self ):
+        """ Ready to receive the body again? (Only if nothing was passed on,
+        or the sink itself can start over.)
+        """
+        if 0 == self.written:
+            return True
+        if not hasattr( self.sink, "rewind" ) or not self.sink.rewind():
+            return False
+        self.written = 0
+        return True
+
+
+class HttpConnectionPool:
+    """ Minimal HTTP/1.1 client on asyncio streams.
+    Keeps idle keep-alive connections to one server for reuse.
+    """
+
+    chunk_size = 1 << 20
+
+    def __init__( self, host, port, use_ssl, max_connections ):
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.slots = asyncio.Semaphore( max_connections )
+        self.idle = []
+
+    async def request( self, method, path, headers, body, body_path, body_chunks, response_path ):
+        async with self.slots:
+            if 0 < len( self.idle ):
+                [ reader, writer ] = self.idle.pop()
+            else:
+                [ reader, writer ] = await asyncio.open_connection( self.host, self.port, ssl=self.use_ssl or None )
+
+            try:
+                [ status, data, response_headers, keep_alive ] = await self.exchange( reader, writer, method, path, headers, body, body_path, body_chunks, response_path )
+            except BaseException:
+                writer.close()
+                raise
+
+            if keep_alive:
+                self.idle.append( [ reader, writer ] )
+            else:
+                writer.close()
+            return [ status, data, response_headers ]
+
+    async def exchange( self, reader, writer, method, path, headers, body, body_path, body_chunks, response_path ):
+        if None != body_chunks:
+            framing = "Transfer-Encoding: chunked"
+        elif None != body_path:
+            framing = f"Content-Length: {os.path.getsize( body_path )}"
+        else:
+            framing = f"Content-Length: {0 if None == body else len( body )}"
+
+        extra = "".join( f"{key}: {value}\r\n" for ( key, value ) in headers.items() )
+        head = f"{method} {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n{framing}\r\n{extra}\r\n"
+        writer.write( head.encode( "ascii" ) )
+        if None != body_chunks:
+            async for chunk in body_chunks:
+                if 0 < len( chunk ):
+                    writer.write( f"{len( chunk ):x}\r\n".encode( "ascii" ) )
+                    writer.write( chunk )
+                    writer.write( b"\r\n" )
+                    await writer.drain()
+            writer.write( b"0\r\n\r\n" )
+        elif None != body_path:
+            with open( body_path, "rb" ) as body_strm:
+                for chunk in iter( lambda: body_strm.read( HttpConnectionPool.chunk_size ), b"" ):
+                    writer.write( chunk )
+                    await writer.drain()
+        elif None != body:
+            writer.write( body )
+        await writer.drain()
+
+        status_line = ( await reader.readline() ).decode( "latin-1" ).split( " ", 2 )
+        if len( status_line ) < 2 or not status_line[ 0 ].startswith( "HTTP/" ):
+            raise ValueError( f"Bad HTTP status line {status_line}" )
+        status = int( status_line[ 1 ] )
+        response_headers = {}
+        while True:
+            line = ( await reader.readline() ).decode( "latin-1" ).strip()
+            if "" == line:
+                break
+            [ key, value ] = line.split( ":", 1 )
+            response_headers[ key.strip().lower() ] = value.strip()
+
+        keep_alive = "close" != response_headers.get( "connection", "" ).lower() and "HTTP/1.1" == status_line[ 0 ]
+        streaming = None != response_path and 200 <= status < 300
+        owns_sink = streaming and not isinstance( response_path, ResponseSink )
+        sink = open( response_path, "wb" ) if owns_sink else response_path
+        data = bytearray()
+
+        def consume( chunk ):
+            if streaming:
+                sink.write( chunk )
+            else:
+                data.extend( chunk )
+
+        try:
+            if "HEAD" == method or status in [ 204, 304 ]:
+                pass
+            elif "chunked" == response_headers.get( "transfer-encoding", "" ).lower():
+                while True:
+                    size = int( ( await reader.readline() ).split( b";" )[ 0 ], 16 )
+                    if 0 == size:
+                        await reader.readline()
+                        break
+                    consume( await reader.readexactly( size ) )
+                    await reader.readexactly( 2 )
+            elif "content-length" in response_headers:
+                remaining = int( response_headers[ "content-length" ] )
+                while 0 < remaining:
+                    chunk = await reader.readexactly( min( remaining, HttpConnectionPool.chunk_size ) )
+                    consume( chunk )
+                    remaining -= len( chunk )
+            else:
+                keep_alive = False
+                while True:
+                    chunk = await reader.read( HttpConnectionPool.chunk_size )
+                    if b"" == chunk:
+                        break
+                    consume( chunk )
+        finally:
+            if owns_sink:
+                sink.close()
+
+        return [ status, None if streaming else bytes( data ), response_headers, keep_alive ]
+
+    async def close( self ):
+        for [ _, writer ] in self.idle:
+            writer.close()
+        self.idle = []
+
+
+class PackStream:
+    """ Sink for the bytes of a bundle. Checks and drops the bundle header
+    and pipes the pack after it straight into `git index-pack --stdin --fix-thin`,
+    so bundles never need a local copy.
+    index-pack doesn't check the prerequisites: with some missing, it still
+    adds the pack (unless its deltas need them), leaving commits whose parents
+    are missing. Callers check first (see Corncob.apply_bundles), or pass
+    `missing_commits` to have the header's prerequisites checked.
+    """
+
+    max_header = 64 << 20
+
+    def __init__( self, threads=0, missing_commits=None ):
+        """ `threads` for index-pack (0: git's default).
+        `missing_commits`: shas => the ones not in the repo
+        """
+        self.threads = threads
+        self.missing_commits = missing_commits
+        self.header = bytearray()
+        self.proc = None
+        self.written = 0
+        # [ sha, refname ] from the header
+        self.refs = []
+
+    def write( self, chunk ):
+        self.written += len( chunk )
+        if None != self.proc:
+            self.proc.stdin.write( chunk )
+            return
+
+        self.header.extend( chunk )
+        end = self.header.find( b"\n\n" )
+        if -1 == end:
+            if len( self.header ) > PackStream.max_header:
+                raise ValueError( "Bundle header too long" )
+            return
+
+        [ prerequisites, self.refs ] = PackStream.parse_header( bytes( self.header[ :end ] ) )
+        if None != self.missing_commits:
+            missing = self.missing_commits( prerequisites )
+            if 0 < len( missing ):
+                raise ValueError( f"Repository lacks these prerequisite commits: {' '.join( missing )}" )
+        params = [ "index-pack", "--stdin", "--fix-thin" ] + ( [ f"--threads={self.threads}" ] if 0 < self.threads else [] )
+        self.proc = subprocess.Popen( [ "git" ] + params, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE )
+        self.proc.stdin.write( self.header[ end + 2: ] )
+        self.header = None
+
+    def parse_header( header ):
+        """ [ prerequisite shas, [ sha, refname ] ] from a bundle header (up to the blank line)
+        """
+        lines = header.decode( "utf-8" ).split( "\n" )
+        if not lines[ 0 ] in [ "# v2 git bundle", "# v3 git bundle" ]:
+            raise ValueError( f"Not a git bundle ({lines[ 0 ][ :40 ]})" )
+        # Capabilities (@...) are skipped
+        prerequisites = [ line[ 1: ].split( " ", 1 )[ 0 ] for line in lines[ 1: ] if line.startswith( "-" ) ]
+        refs = [ line.split( " ", 1 ) for line in lines[ 1: ] if "" != line and not line[ 0 ] in "@-" ]
+        return [ prerequisites, refs ]
+
+    def read_header( bundle_path ):
+        """ parse_header for a bundle file
+        """
+        header = bytearray()
+        with open( bundle_path, "rb" ) as strm:
+            while True:
+                end = header.find( b"\n\n" )
+                if -1 != end:
+                    return PackStream.parse_header( bytes( header[ :end ] ) )
+                chunk = strm.read( 1 << 16 )
+                if b"" == chunk or len( header ) > PackStream.max_header:
+                    raise ValueError( f"No bundle header in '{bundle_path}'" )
+                header.extend( chunk )
+
+    def abort( self ):
+        """ Stop index-pack before it writes the pack
+        """
+        if None != self.proc:
+            self.proc.kill()
+            self.proc.communicate()
+
+    def close( self ):
+        if None == self.proc:
+            raise ValueError( "Truncated bundle" )
+        [ out, err ] = self.proc.communicate()
+        if 0 != self.proc.returncode:
+            raise GitCmdFailed( self.proc.args[ 1: ], self.proc.returncode, out.decode(), err.decode() )
+
+
+class Agent:
+    """ `agent`: a long-lived process per repo that runs corncob commands
+    for the CLI, which sends them over a Unix socket (.git/corncob/agent.sock).
+    Between commands it keeps what each one would otherwise set up again:
+    - the interpreter and its imports
+    - remote handles, with their event loop, HTTP connections and cache
+    - the cat-file batch process (GitPlumbing) and the link index
+    - remote URLs from git config (read again when the config file changes)
+
+    Commands run one at a time, in the order they arrive. The CLI runs
+    them itself when no agent is listening. The agent exits after
+    idle_timeout seconds without a command, or on `agent stop`.
+    """
+
+    idle_timeout = 1800
+
+    # Commands the CLI always runs itself
+    local_commands = { "agent", "clone", "watch" }
+
+    def __init__( self, corncob ):
+        self.root = os.getcwd()
+        self.git = corncob.git
+        self.index = None
+        self.remotes = {}
+        self.urls = None
+        self.config_mtime = None
+        self.stopping = False
+
+    def socket_path( git_dir ):
+        return os.path.join( git_dir, "corncob", "agent.sock" )
+
+    def main( corncob, args ):
+        """ agent [stop]
+        """
+        if [ "stop" ] == args:
+            exit_code = Agent.run_client( [ "agent", "stop" ] )
+            if None == exit_code:
+                print( f"No agent running ({program_title})" )
+                return 0
+            return exit_code
+        if 0 < len( args ):
+            print( f"ERROR: agent takes no arguments but 'stop' ({program_title})" )
+            return -1
+        return Agent( corncob ).serve()
+
+    def serve( self ):
+        import socket
+        path = os.path.abspath( Agent.socket_path( self.git.git_dir() ) )
+        os.makedirs( os.path.dirname( path ), exist_ok=True )
+        if os.path.exists( path ):
+            probe = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+            try:
+                probe.connect( path )
+                print( f"ERROR: An agent is already running for this repo ({program_title})" )
+                return -1
+            except OSError:
+                # Left behind by an agent that didn't exit cleanly
+                os.remove( path )
+            finally:
+                probe.close()
+
+        listener = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+        try:
+            listener.bind( path )
+            os.chmod( path, 0o600 )
+            listener.listen()
+            listener.settimeout( Agent.idle_timeout )
+            print( f"Agent listening on {path}", flush=True )
+            while not self.stopping:
+                try:
+                    [ conn, _ ] = listener.accept()
+                except socket.timeout:
+                    break
+                with conn:
+                    conn.settimeout( None )
+                    self.handle( conn )
+        except KeyboardInterrupt:
+            pass
+        finally:
+            listener.close()
+            if os.path.exists( path ):
+                os.remove( path )
+            self.close()
+        return 0
+
+    def handle( self, conn ):
+        """ One request: { "argv": [ ... ] } in; { "out": text } lines and
+        then { "exit": code } back
+        """
+        import contextlib
+        strm = conn.makefile( "rw", encoding="utf-8" )
+        try:
+            request = json.loads( strm.readline() )
+            output = AgentOutput( strm )
+            with contextlib.redirect_stdout( output ), contextlib.redirect_stderr( output ):
+                exit_code = self.run_command( request[ "argv" ] )
+            strm.write( json.dumps( { "exit": exit_code } ) + "\n" )
+            strm.flush()
+        except ( OSError, ValueError, KeyError ):
+            # The client went away, or sent nonsense
+            pass
+
+    def run_command( self, argv ):
+        if [ "agent", "stop" ] == argv:
+            self.stopping = True
+            print( "Agent stopping" )
+            return 0
+        try:
+            args = parse_command_line( argv )
+        except SystemExit as exn:
+            return exn.code
+
+        corncob = Corncob( args.remote )
+        corncob.agent = self
+        corncob.git = self.git
+        corncob.index = self.index
+        self.git.corncob = corncob
+        try:
+            return corncob.main( args.command, args.branches )
+        except GitCmdFailed as e:
+            print( e )
+            return e.exit_code
+        except RemoteFailed as e:
+            print( e )
+            return -1
+        except Exception:
+            import traceback
+            traceback.print_exc()
+            # Don't trust what was kept from a command that blew up
+            self.close()
+            return -1
+        finally:
+            self.index = corncob.index
+
+    def remote_urls( self ):
+        """ { remote name: url } from git config, read again only when it changed
+        """
+        config_path = os.path.join( self.git.git_dir(), "config" )
+        mtime = os.stat( config_path ).st_mtime_ns
+        if mtime != self.config_mtime:
+            result = self.git.corncob.gitCmd( [ "config", "--get-regexp", "^remote\\..*\\.url$" ], False )
+            self.urls = {}
+            for line in result.stdout.splitlines():
+                [ key, _, remote_url ] = line.partition( " " )
+                self.urls[ key[ len( "remote." ):-len( ".url" ) ] ] = remote_url
+            self.config_mtime = mtime
+        return self.urls
+
+    def close( self ):
+        for remote in self.remotes.values():
+            remote.close()
+        self.remotes = {}
+        self.git.close()
+        if None != self.index:
+            self.index.close()
+            self.index = None
+        self.config_mtime = None
+
+    def find_socket():
+        """ The agent socket of the repo around the current directory (found
+        without running git), or None if there is none
+        """
+        if None != os.getenv( "GIT_DIR" ):
+            return None
+        folder = os.getcwd()
+        while True:
+            dot_git = os.path.join( folder, ".git" )
+            if os.path.isdir( dot_git ):
+                git_dir = dot_git
+                break
+            if os.path.isfile( dot_git ):
+                with open( dot_git, "r" ) as strm:
+                    line = strm.readline().strip()
+                if not line.startswith( "gitdir:" ):
+                    return None
+                git_dir = os.path.join( folder, line[ len( "gitdir:" ): ].strip() )
+                break
+            parent = os.path.dirname( folder )
+            if parent == folder:
+                return None
+            folder = parent
+
+        path = Agent.socket_path( git_dir )
+        return path if os.path.exists( path ) else None
+
+    def run_client( argv ):
+        """ Exit code of the command in `argv`, run by the repo's agent.
+        None if no agent is listening (or the command is one the CLI runs itself).
+        """
+        if 0 == len( argv ) or argv[ 0 ].startswith( "-" ) or ( argv[ 0 ] in Agent.local_commands and [ "agent", "stop" ] != argv ):
+            return None
+        path = Agent.find_socket()
+        if None == path:
+            return None
+
+        import socket
+        conn = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+        try:
+            conn.connect( path )
+        except OSError:
+            conn.close()
+            return None
+
+        with conn:
+            strm = conn.makefile( "rw", encoding="utf-8" )
+            strm.write( json.dumps( { "argv": argv } ) + "\n" )
+            strm.flush()
+            for line in strm:
+                message = json.loads( line )
+                if "exit" in message:
+                    return message[ "exit" ]
+                sys.stdout.write( message[ "out" ] )
+                sys.stdout.flush()
+        print( f"ERROR: The agent went away part way through the command ({program_title})" )
+        return -1
+
+
+class AgentOutput:
+    """ stdout/stderr of a command run by the Agent, sent on to the client as it comes
+    """
+    def __init__( self, strm ):
+        self.strm = strm
+
+    def write( self, text ):
+        if "" != text:
+            self.strm.write( json.dumps( { "out": text } ) + "\n" )
+        return len( text )
+
+    def flush( self ):
+        self.strm.flush()
+
+
+class RemoteHelper:
+    """ git remote helper (see gitremote-helpers(7)) for corncob::<url> remotes.
+    git runs git-remote-corncob <remote> <url>, which hands over to run().
+
+    - list: the heads of the latest link
+    - fetch: the missing links' bundles are streamed into index-pack, oldest first
+    - push: each batch of refspecs becomes one link, as with `push`
+    """
+
+    def __init__( self, remote_name, url ):
+        self.corncob = Corncob( remote_name )
+        self.corncob.url = url
+        self.latest_link = None
+
+    def run( self, stdin, stdout ):
+        """ Answer git's commands until it closes stdin or sends a blank line.
+        Anything printed along the way goes to stderr, as stdout is git's.
+        """
+        saved_stdout = sys.stdout
+        sys.stdout = sys.stderr
+        try:
+            self.corncob.remote = self.corncob.open_remote( self.corncob.url )
+            while True:
+                line = stdin.readline()
+                if "" == line.strip():
+                    return 0
+                [ cmd, _, arg ] = line.strip().partition( " " )
+                if "capabilities" == cmd:
+                    reply = [ "fetch", "push", "option" ]
+                elif "list" == cmd:
+                    reply = self.list()
+                elif "option" == cmd:
+                    reply = [ "ok" if arg.split( " " )[ 0 ] in [ "verbosity", "progress" ] else "unsupported" ]
+                    stdout.write( reply[ 0 ] + "\n" )
+                    stdout.flush()
+                    continue
+                elif "fetch" == cmd:
+                    reply = self.fetch( self.read_batch( stdin, line ) )
+                elif "push" == cmd:
+                    reply = self.push( self.read_batch( stdin, line ) )
+                else:
+                    print( f"ERROR: Unknown remote helper command '{cmd}' ({program_title})" )
+                    return -1
+                stdout.write( "".join( f"{r}\n" for r in reply ) + "\n" )
+                stdout.flush()
+        finally:
+            sys.stdout = saved_stdout
+            self.corncob.close()
+
+    def read_batch( self, stdin, first_line ):
+        """ Arguments of a batch of fetch/push lines, up to a blank line
+        """
+        batch = [ first_line.strip().partition( " " )[ 2 ] ]
+        while True:
+            line = stdin.readline()
+            if "" == line.strip():
+                return batch
+            batch.append( line.strip().partition( " " )[ 2 ] )
+
+    def list( self ):
+        self.latest_link = self.corncob.get_latest_link()
+        if None == self.latest_link:
+            return []
+        heads = self.latest_link[ 1 ]
+        refs = [ f"{sha} refs/heads/{name}" for [ name, sha ] in heads ]
+        if "main" in [ name for [ name, _ ] in heads ]:
+            refs.append( "@refs/heads/main HEAD" )
+        return refs
+
+    def fetch( self, wanted ):
+        link = self.latest_link or self.corncob.get_latest_link()
+        if None == link:
+            return []
+        with trace.span( "resolve missing links", "phase" ):
+            bundles = self.corncob.resolve_missing_links( link, False )
+        if None == bundles:
+            raise RemoteFailed( self.corncob.url, "fetch", "can't work out the missing links" )
+        self.corncob.remote.run( self.stream_bundles_async( bundles ) )
+        self.corncob.local_index().set_fetched( self.corncob.url, link )
+        return []
+
+    async def stream_bundles_async( self, bundles ):
+        """ Each bundle is hashed on its way into index-pack; the pack is
+        dropped unless it matches the link's digest.
+        """
+        for [ bundle_uid, digest ] in bundles:
+            with trace.span( "stream bundle", "phase", bundle=bundle_uid ) as span:
+                pack = PackStream( missing_commits=self.missing_commits )
+                sink = DigestSink( pack, digest )
+                try:
+                    await self.corncob.remote.stream_bundle_async( bundle_uid, sink )
+                    sink.check()
+                except ( ValueError, RemoteFailed ) as exn:
+                    pack.abort()
+                    if isinstance( exn, RemoteFailed ):
+                        raise
+                    raise RemoteFailed( self.corncob.url, f"GET B-{bundle_uid}.bundle", str( exn ) )
+                await asyncio.to_thread( pack.close )
+                span.set( bytes=pack.written )
+
+    def missing_commits( self, shas ):
+        types = self.corncob.git.object_types( shas )
+        return [ sha for sha in shas if "commit" != types[ sha ] ]
+
+    def push( self, refspecs ):
+        updates = {}
+        forced = []
+        reply = []
+        for refspec in refspecs:
+            [ src, _, dst ] = refspec.lstrip( "+" ).partition( ":" )
+            if refspec.startswith( "+" ):
+                forced.append( dst[ len( "refs/heads/" ): ] )
+            if not dst.startswith( "refs/heads/" ):
+                reply.append( f"error {dst} only branches can be pushed" )
+            elif "" == src:
+                reply.append( f"error {dst} deleting branches is not supported" )
+            else:
+                sha = self.corncob.gitCmd( [ "rev-parse", "--verify", f"{src}^{{commit}}" ] ).stdout.strip()
+                updates[ dst[ len( "refs/heads/" ): ] ] = [ src, sha ]
+
+        if 0 < len( updates ):
+            result = self.corncob.push_heads( updates, forced )
+            status = "ok {dst}" if 0 == result else "error {dst} push failed"
+            reply += [ status.format( dst=f"refs/heads/{name}" ) for name in sorted( updates.keys() ) ]
+        return reply
+
+
+def parse_command_line( argv ):
+    import argparse
+
+    parser = argparse.ArgumentParser( program_title )
+    parser.add_argument( "--trace", metavar="FILE", default=os.getenv( "CORNCOB_TRACE" ),
+                         help="record spans to FILE (default: $CORNCOB_TRACE)" )
+    parser.add_argument( "--trace-format", choices=[ "jsonl", "chrome" ], default=os.getenv( "CORNCOB_TRACE_FORMAT" ),
+                         help="default: chrome for *.json, else jsonl" )
+    parser.add_argument( "command", type=str )
+    # Optional for `fetch --all` and `watch` only
+    parser.add_argument( "remote", type=str, nargs="?" )
+    parser.add_argument( "branches", nargs=argparse.REMAINDER )
+
+    args = parser.parse_args( argv )
+    if None == args.remote and not "--all" in args.branches and not args.command in [ "watch", "agent" ]:
+        parser.error( "the remote is required" )
+    return args
+
+
+if __name__ == "__main__":
+    if None == os.getenv( "CORNCOB_TRACE" ):
+        exit_code = Agent.run_client( sys.argv[ 1: ] )
+        if None != exit_code:
+            sys.exit( exit_code )
+
+    args = parse_command_line( sys.argv[ 1: ] )
+    if args.trace:
+        trace.open( args.trace, args.trace_format )
+
+    corncob = Corncob( args.remote )
     try:
         exit_code = corncob.main( args.command, args.branches )
     except GitCmdFailed as e:
         print( e )
         exit_code = e.exit_code
+    except RemoteFailed as e:
+        print( e )
+        exit_code = -1
+    finally:
+        corncob.close()
+        trace.close()
     sys.exit( exit_code )
@@ -0,0 +1,207 @@
+import os
+import sys
+import json
+import random
+import shutil
+import tempfile
+import time
+import itertools
+import subprocess
+from corncob_test_utils import CorncobTest, gitCmd
+
+# Time push, clone, fetch and merge on synthetic repositories.
+#
+# Each configuration is a point on four axes:
+#   commits  - commits on main before the first push
+#   branches - branches pushed (main plus branches-1 feature branches)
+#   size     - bytes in the file every commit modifies
+#   behind   - links the cloner is behind when it fetches
+#
+# For every operation the results record wall time, the number of git
+# processes corncob started and the bytes it added on each side.
+#
+#   bench_corncob.py [--commits 10,100] [--branches 1,10] [--size 10k,1m]
+#                    [--behind 1,10] [--repeat 3] [--out results.json]
+#   bench_corncob.py --compare before.json after.json
+
+def parse_size( text ):
+    units = { "k": 1 << 10, "m": 1 << 20, "g": 1 << 30 }
+    if text[ -1 ].lower() in units:
+        return int( float( text[ :-1 ] ) * units[ text[ -1 ].lower() ] )
+    return int( text )
+
+def parse_axis( text, parse=int ):
+    return [ parse( x ) for x in text.split( "," ) if x ]
+
+def dir_size( path ):
+    total = 0
+    for ( dir_path, _, file_names ) in os.walk( path ):
+        for name in file_names:
+            full_path = os.path.join( dir_path, name )
+            if not os.path.islink( full_path ):
+                total += os.path.getsize( full_path )
+    return total
+
+class GitCounter:
+    """ Puts a `git` shim first on PATH that logs each call, so spawns
+    made by corncob (and its children) can be counted.
+    """
+    def __init__( self, shim_dir ):
+        self.log_path = os.path.join( shim_dir, "git-calls.log" )
+        real_git = shutil.which( "git" )
+        shim_path = os.path.join( shim_dir, "git" )
+        with open( shim_path, "w" ) as strm:
+            strm.write( f'#!/bin/sh\necho "$1" >> "{self.log_path}"\nexec "{real_git}" "$@"\n' )
+        os.chmod( shim_path, 0o755 )
+        self.path = f"{shim_dir}{os.pathsep}{os.environ[ 'PATH' ]}"
+
+    def run( self, fn ):
+        """ [ seconds, git spawns ] for fn()
+        """
+        open( self.log_path, "w" ).close()
+        saved_path = os.environ[ "PATH" ]
+        os.environ[ "PATH" ] = self.path
+        try:
+            start = time.perf_counter()
+            fn()
+            seconds = time.perf_counter() - start
+        finally:
+            os.environ[ "PATH" ] = saved_path
+        with open( self.log_path ) as strm:
+            return [ seconds, len( strm.readlines() ) ]
+
+def fast_import( commits, size, branches, rng, start=0 ):
+    """ Add `commits` commits to main, each rewriting a window of data.bin,
+    and one commit on each of `branches` feature branches.
+    """
+    stream = []
+    data = bytearray( rng.randbytes( size ) ) if 0 == start else bytearray( open( "data.bin", "rb" ).read() )
+    parent = None if 0 == start else gitCmd( [ "rev-parse", "main" ] ).stdout.strip()
+    mark = 0
+
+    def commit( ref, message, files, from_ref ):
+        nonlocal mark
+        mark += 1
+        stream.append( f"commit {ref}\nmark :{mark}\ncommitter Bench <bench@example.com> {1700000000 + start + mark} +0000\n".encode() )
+        stream.append( f"data {len( message )}\n{message}\n".encode() )
+        if None != from_ref:
+            stream.append( f"from {from_ref}\n".encode() )
+        for ( name, content ) in files:
+            stream.append( f"M 644 inline {name}\ndata {len( content )}\n".encode() + content + b"\n" )
+        return f":{mark}"
+
+    for i in range( commits ):
+        window = rng.randrange( max( 1, size - 64 ) )
+        data[ window:window + 64 ] = rng.randbytes( min( 64, size - window ) )
+        parent = commit( "refs/heads/main", f"commit {start + i}", [ ( "data.bin", bytes( data ) ) ], parent )
+    for b in range( branches ):
+        commit( f"refs/heads/feature-{b}", f"feature {b}", [ ( f"feature-{b}.txt", rng.randbytes( 256 ) ) ], parent )
+
+    subprocess.run( [ "git", "fast-import", "--quiet" ], input=b"".join( stream ), check=True )
+    gitCmd( [ "checkout", "-f", "main" ] )
+
+def bench_config( test_utils, counter, config, rng ):
+    """ One pass over push, clone, fetch and merge for `config`
+    """
+    results = []
+
+    def record( op, fn, local, remote ):
+        [ local_before, remote_before ] = [ dir_size( local ), dir_size( remote ) ]
+        [ seconds, spawns ] = counter.run( fn )
+        results.append( dict( config, op=op, seconds=seconds, git_spawns=spawns,
+                              local_bytes=dir_size( local ) - local_before,
+                              remote_bytes=dir_size( remote ) - remote_before ) )
+
+    with ( tempfile.TemporaryDirectory() as alice_local,
+           tempfile.TemporaryDirectory() as alice_remote,
+           tempfile.TemporaryDirectory() as bob_local ):
+        os.chdir( alice_local )
+        gitCmd( [ "init", "-b", "main" ] )
+        fast_import( config[ "commits" ], config[ "size" ], config[ "branches" ] - 1, rng )
+        test_utils.corncob_cmd( [ "add", "alice", f"file://{alice_remote}" ] )
+        record( "push", lambda: test_utils.corncob_cmd( [ "push", "alice" ] ), alice_local, alice_remote )
+
+        os.chdir( bob_local )
+        record( "clone", lambda: test_utils.corncob_cmd( [ "clone", "alice", f"file://{alice_remote}" ] ), bob_local, alice_remote )
+
+        os.chdir( alice_local )
+        for i in range( config[ "behind" ] ):
+            fast_import( 1, config[ "size" ], 0, rng, start=config[ "commits" ] + i )
+            test_utils.corncob_cmd( [ "push", "alice", "main" ] )
+
+        os.chdir( bob_local )
+        record( "fetch", lambda: test_utils.corncob_cmd( [ "fetch", "alice" ] ), bob_local, alice_remote )
+        record( "merge", lambda: test_utils.corncob_cmd( [ "merge", "alice", "main" ] ), bob_local, alice_remote )
+    return results
+
+def revision( corncob_dir ):
+    result = subprocess.run( [ "git", "-C", corncob_dir, "describe", "--always", "--dirty" ], capture_output=True, text=True )
+    return result.stdout.strip() or None
+
+def compare( before_path, after_path ):
+    with open( before_path ) as strm:
+        before = json.load( strm )
+    with open( after_path ) as strm:
+        after = json.load( strm )
+
+    def key( row ):
+        return ( row[ "op" ], row[ "commits" ], row[ "branches" ], row[ "size" ], row[ "behind" ] )
+
+    old_rows = dict( ( key( row ), row ) for row in before[ "results" ] )
+    print( f"{before[ 'revision' ]} -> {after[ 'revision' ]}" )
+    print( f"{'op':>6} {'commits':>8} {'branches':>8} {'size':>9} {'behind':>6} {'old s':>8} {'new s':>8} {'ratio':>6} {'spawns':>11}" )
+    for row in after[ "results" ]:
+        old = old_rows.get( key( row ) )
+        if None == old:
+            continue
+        ratio = row[ "seconds" ] / old[ "seconds" ] if old[ "seconds" ] else float( "nan" )
+        print( f"{row[ 'op' ]:>6} {row[ 'commits' ]:>8} {row[ 'branches' ]:>8} {row[ 'size' ]:>9} {row[ 'behind' ]:>6} "
+               f"{old[ 'seconds' ]:>8.3f} {row[ 'seconds' ]:>8.3f} {ratio:>6.2f} {old[ 'git_spawns' ]:>5}->{row[ 'git_spawns' ]:<5}" )
+    return 0
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser( description="Benchmark corncob push/clone/fetch/merge" )
+    parser.add_argument( "--commits", default="10,100" )
+    parser.add_argument( "--branches", default="1,10" )
+    parser.add_argument( "--size", default="10k,1m" )
+    parser.add_argument( "--behind", default="1,10" )
+    parser.add_argument( "--repeat", type=int, default=1, help="keep the fastest of N runs" )
+    parser.add_argument( "--seed", type=int, default=1 )
+    parser.add_argument( "--out", help="write results as JSON" )
+    parser.add_argument( "--compare", nargs=2, metavar=( "BEFORE", "AFTER" ) )
+    args = parser.parse_args()
+
+    if None != args.compare:
+        return compare( *args.compare )
+
+    corncob_dir = os.getenv( "CORNCOB_DIR" )
+    if corncob_dir == None:
+        print( "ERROR. CORNCOB_DIR env var not defined" )
+        return 1
+
+    test_utils = CorncobTest( corncob_dir )
+    results = []
+    with tempfile.TemporaryDirectory() as shim_dir:
+        counter = GitCounter( shim_dir )
+        axes = itertools.product( parse_axis( args.commits ), parse_axis( args.branches ),
+                                  parse_axis( args.size, parse_size ), parse_axis( args.behind ) )
+        for ( commits, branches, size, behind ) in axes:
+            config = { "commits": commits, "branches": branches, "size": size, "behind": behind }
+            best = {}
+            for _ in range( args.repeat ):
+                for row in bench_config( test_utils, counter, config, random.Random( args.seed ) ):
+                    if row[ "op" ] not in best or row[ "seconds" ] < best[ row[ "op" ] ][ "seconds" ]:
+                        best[ row[ "op" ] ] = row
+            for row in best.values():
+                print( f"{row[ 'op' ]:>6} {commits:>6} commits {branches:>4} branches {size:>9} B {behind:>4} behind: "
+                       f"{row[ 'seconds' ]:8.3f}s {row[ 'git_spawns' ]:>4} git {row[ 'local_bytes' ]:>10} B local {row[ 'remote_bytes' ]:>10} B remote" )
+                results.append( row )
+
+    if None != args.out:
+        with open( args.out, "w" ) as strm:
+            json.dump( { "revision": revision( corncob_dir ), "results": results }, strm, indent=1 )
+    return 0
+
+if __name__ == "__main__":
+    sys.exit( main() )
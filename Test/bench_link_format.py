@@ -0,0 +1,58 @@
+import os
+import sys
+import secrets
+import timeit
+import yaml
+from corncob_test_utils import load_corncob_module
+
+# Compare the legacy YAML link encoding with the current JSON one:
+# serialize time, parse time and size, for a range of branch counts.
+
+def make_blob( num_branches ):
+    def sha():
+        return secrets.token_hex( 20 )
+    branches = [ [ f"branch-{i}", sha() ] for i in range( num_branches ) ]
+    prerequisites = [ x for [ name, _ ] in branches for x in [ name, sha() ] ]
+    bundles = [ [ secrets.token_hex( 8 ), prerequisites ] ]
+    supplement = { "seq": 1000, "skips": [ [ 1000 - 2 ** k, secrets.token_hex( 8 ) ] for k in range( 1, 10 ) ] }
+    return [ [ secrets.token_hex( 8 ), secrets.token_hex( 8 ) ], branches, bundles, supplement ]
+
+def best_time( fn, number ):
+    return min( timeit.repeat( fn, number=number, repeat=3 ) ) / number
+
+def main():
+    corncob_dir = os.getenv( "CORNCOB_DIR" )
+    if corncob_dir == None:
+        print( "ERROR. CORNCOB_DIR env var not defined" )
+        return 1
+
+    corncob = load_corncob_module( corncob_dir )
+    remote = corncob.CornCobRemote()
+
+    print( f"{'branches':>8} {'format':>14} {'bytes':>9} {'write us':>10} {'read us':>10}" )
+    for num_branches in [ 1, 10, 100, 1000, 10000 ]:
+        blob = make_blob( num_branches )
+        number = max( 1, 2000 // num_branches )
+
+        yaml_text = yaml.dump( blob, default_flow_style=False )
+        json_text = remote.write_link_blob( blob )
+
+        rows = [
+            ( "yaml-full", yaml_text,
+              lambda: yaml.dump( blob, default_flow_style=False ),
+              lambda: yaml.load( yaml_text, Loader=yaml.FullLoader ) ),
+            ( "yaml-legacy", yaml_text,
+              lambda: yaml.dump( blob, default_flow_style=False ),
+              lambda: remote.read_link_blob( yaml_text ) ),
+            ( "json", json_text,
+              lambda: remote.write_link_blob( blob ),
+              lambda: remote.read_link_blob( json_text ) ),
+        ]
+        for ( name, text, write, read ) in rows:
+            write_us = best_time( write, number ) * 1e6
+            read_us = best_time( read, number ) * 1e6
+            print( f"{num_branches:>8} {name:>14} {len( text.encode() ):>9} {write_us:>10.1f} {read_us:>10.1f}" )
+    return 0
+
+if __name__ == "__main__":
+    sys.exit( main() )
@@ -37,3 +37,163 @@ class CorncobTest:
             else:
                 print( exn )
         return result
+
+def load_corncob_module( corncob_dir ):
+    """ Import git-remote-workalike-corncob.py (not a valid module name) for in-process use
+    """
+    import importlib.util
+    path = f"{corncob_dir}{os.path.sep}git-remote-workalike-corncob.py"
+    spec = importlib.util.spec_from_file_location( "corncob", path )
+    module = importlib.util.module_from_spec( spec )
+    spec.loader.exec_module( module )
+    return module
+
+class StorageServer:
+    """ In-process HTTP server standing in for cloud storage.
+    Files under `root` are read with GET, written with PUT and removed with DELETE.
+    PUT honours "If-None-Match: *" (412 if the file exists), like the stores do,
+    and takes chunked request bodies.
+    GET honours single "Range: bytes=a-b" headers (206). GET and HEAD send an ETag.
+    Use as a context manager; `url` is set while it runs.
+
+    For fault injection, `fault( path )` is asked before each GET response;
+    if it returns True, the connection is dropped half way through the body.
+    Every GET is logged in `gets` as [ path, range header or None ].
+    `connections` counts the client connections accepted.
+    """
+    def __init__( self, root, fault=None ):
+        self.root = root
+        self.url = None
+        self.fault = fault
+        self.gets = []
+        self.connections = 0
+
+    def __enter__( self ):
+        import http.server
+        import threading
+
+        root = self.root
+        lock = threading.Lock()
+        server = self
+
+        class Handler( http.server.BaseHTTPRequestHandler ):
+            protocol_version = "HTTP/1.1"
+
+            def setup( self ):
+                with lock:
+                    server.connections += 1
+                super().setup()
+
+            def file_path( self ):
+                path = os.path.normpath( os.path.join( root, self.path.lstrip( "/" ) ) )
+                if not path.startswith( os.path.abspath( root ) ):
+                    return None
+                return path
+
+            def reply( self, status, body=b"", etag=None ):
+                self.send_response( status )
+                self.send_header( "Content-Length", str( len( body ) ) )
+                if None != etag:
+                    self.send_header( "ETag", etag )
+                self.end_headers()
+                self.wfile.write( body )
+
+            def etag( self, path ):
+                stat = os.stat( path )
+                return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+            def do_HEAD( self ):
+                path = self.file_path()
+                if None == path or not os.path.isfile( path ):
+                    return self.reply( 404 )
+                self.send_response( 200 )
+                self.send_header( "Content-Length", str( os.path.getsize( path ) ) )
+                self.send_header( "ETag", self.etag( path ) )
+                self.end_headers()
+
+            def do_GET( self ):
+                path = self.file_path()
+                byte_range = self.headers.get( "Range" )
+                with lock:
+                    server.gets.append( [ self.path, byte_range ] )
+                if None == path or not os.path.isfile( path ):
+                    return self.reply( 404 )
+                with open( path, "rb" ) as strm:
+                    etag = self.etag( path )
+                    body = strm.read()
+
+                status = 200
+                if None != byte_range and byte_range.startswith( "bytes=" ):
+                    [ first, last ] = byte_range[ 6: ].split( "-" )
+                    [ first, last ] = [ int( first ), min( int( last ), len( body ) - 1 ) ]
+                    if first > last:
+                        return self.reply( 416 )
+                    [ status, body ] = [ 206, body[ first:last + 1 ] ]
+
+                if None != server.fault and server.fault( self.path ):
+                    self.send_response( status )
+                    self.send_header( "Content-Length", str( len( body ) ) )
+                    self.end_headers()
+                    self.wfile.write( body[ :len( body ) // 2 ] )
+                    self.wfile.flush()
+                    self.close_connection = True
+                    return
+                self.reply( status, body, etag )
+
+            def do_PUT( self ):
+                path = self.file_path()
+                if None == path:
+                    return self.reply( 403 )
+                if "chunked" == self.headers.get( "Transfer-Encoding", "" ).lower():
+                    body = self.read_chunked()
+                    if None == body:
+                        # Cut off part way: store nothing
+                        self.close_connection = True
+                        return
+                else:
+                    body = self.rfile.read( int( self.headers.get( "Content-Length", 0 ) ) )
+                os.makedirs( os.path.dirname( path ), exist_ok=True )
+                with lock:
+                    if "*" == self.headers.get( "If-None-Match" ) and os.path.exists( path ):
+                        return self.reply( 412 )
+                    with open( f"{path}.tmp", "wb" ) as strm:
+                        strm.write( body )
+                    os.replace( f"{path}.tmp", path )
+                self.reply( 201 )
+
+            def read_chunked( self ):
+                """ Request body sent with chunked transfer encoding. None if incomplete.
+                """
+                body = bytearray()
+                while True:
+                    line = self.rfile.readline()
+                    if not line.endswith( b"\n" ):
+                        return None
+                    size = int( line.split( b";" )[ 0 ], 16 )
+                    if 0 == size:
+                        self.rfile.readline()
+                        return bytes( body )
+                    data = self.rfile.read( size + 2 )
+                    if len( data ) != size + 2:
+                        return None
+                    body.extend( data[ :size ] )
+
+            def do_DELETE( self ):
+                path = self.file_path()
+                if None == path or not os.path.isfile( path ):
+                    return self.reply( 404 )
+                os.remove( path )
+                self.reply( 204 )
+
+            def log_message( self, format, *args ):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer( ( "127.0.0.1", 0 ), Handler )
+        self.thread = threading.Thread( target=self.server.serve_forever, daemon=True )
+        self.thread.start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[ 1 ]}"
+        return self
+
+    def __exit__( self, *exn_info ):
+        self.server.shutdown()
+        self.server.server_close()
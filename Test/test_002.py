@@ -0,0 +1,74 @@
+import tempfile
+import os
+import sys
+from corncob_test_utils import CorncobTest, StorageServer, gitCmd
+
+# Alice and Bob share through remotes kept on an HTTP server
+# (an in-process stand-in for cloud storage)
+
+def main():
+
+    corncob_dir = os.getenv( "CORNCOB_DIR" )
+    if corncob_dir == None:
+        print( "ERROR. CORNCOB_DIR env var not defined" )
+        return 1
+
+    test_utils = CorncobTest( corncob_dir )
+
+    with ( tempfile.TemporaryDirectory() as storage,
+           tempfile.TemporaryDirectory() as alice_local,
+           tempfile.TemporaryDirectory() as bob_local,
+           StorageServer( storage ) as server ):
+        alice_url = f"{server.url}/alice"
+        bob_url = f"{server.url}/bob"
+        print( f'Storage: {storage} ({server.url})  Alice local: {alice_local}  Bob local: {bob_local}' )
+
+        os.chdir( alice_local )
+
+        gitCmd( [ "init" ] )
+        with open( "hi_bob.txt", "w" ) as file:
+            file.write( "Hi there Bob!" )
+        gitCmd( [ "add", "hi_bob.txt" ] )
+        gitCmd( [ "commit", "-m", "greeting" ] )
+
+        test_utils.corncob_cmd( [ "add", "a_team_alice", alice_url ] )
+        test_utils.corncob_cmd( [ "push", "a_team_alice" ] )
+
+        os.chdir( bob_local )
+        test_utils.corncob_cmd( [ "clone", "a_team_alice", alice_url ] )
+        test_utils.corncob_cmd( [ "add", "a_team_bob", bob_url ] )
+
+        with open( "hi_bob.txt", "a" ) as file:
+            file.write( " Hello Alice!" )
+        gitCmd( [ "commit", "-am", "back at you" ] )
+        test_utils.corncob_cmd( [ "push", "a_team_bob" ] )
+
+        os.chdir( alice_local )
+        test_utils.corncob_cmd( [ "add", "a_team_bob", bob_url ] )
+        test_utils.corncob_cmd( [ "fetch", "a_team_bob" ] )
+        test_utils.corncob_cmd( [ "merge", "a_team_bob", "main" ] )
+
+        # Several pushes, so Bob has a chain of bundles to catch up on
+        for i in range( 5 ):
+            with open( "hi_bob.txt", "a" ) as file:
+                file.write( f" Dinner at {i + 5}?" )
+            gitCmd( [ "commit", "-am", f"proposal {i}" ] )
+            test_utils.corncob_cmd( [ "push", "a_team_alice" ] )
+
+        print( "Alice's remote:" )
+        print( sorted( os.listdir( os.path.join( storage, "alice" ) ) ) )
+
+        os.chdir( bob_local )
+        test_utils.corncob_cmd( [ "fetch", "a_team_alice" ] )
+        test_utils.corncob_cmd( [ "merge", "a_team_alice", "main" ] )
+
+        with open( "hi_bob.txt", "r" ) as file:
+            text = file.read()
+        print( text )
+        if not text.endswith( "Dinner at 9?" ):
+            print( "ERROR. Bob didn't get all of Alice's changes" )
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit( main() )
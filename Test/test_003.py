@@ -0,0 +1,62 @@
+import tempfile
+import os
+import sys
+from corncob_test_utils import CorncobTest, gitCmd
+
+# Plain git clone/push/pull through the git-remote-corncob helper,
+# sharing a remote with the work-a-like commands
+
+def main():
+
+    corncob_dir = os.getenv( "CORNCOB_DIR" )
+    if corncob_dir == None:
+        print( "ERROR. CORNCOB_DIR env var not defined" )
+        return 1
+
+    test_utils = CorncobTest( corncob_dir )
+    os.environ[ "PATH" ] = f"{os.path.abspath( corncob_dir )}{os.pathsep}{os.environ[ 'PATH' ]}"
+
+    with ( tempfile.TemporaryDirectory() as alice_local,
+           tempfile.TemporaryDirectory() as alice_remote,
+           tempfile.TemporaryDirectory() as bob_local ):
+        alice_url = f"file://{alice_remote}"
+        print( f'Alice local: {alice_local}  Alice remote: {alice_remote}  Bob local: {bob_local}' )
+
+        os.chdir( alice_local )
+        gitCmd( [ "init" ] )
+        with open( "hi_bob.txt", "w" ) as file:
+            file.write( "Hi there Bob!" )
+        gitCmd( [ "add", "hi_bob.txt" ] )
+        gitCmd( [ "commit", "-m", "greeting" ] )
+        test_utils.corncob_cmd( [ "add", "a_team_alice", alice_url ] )
+        test_utils.corncob_cmd( [ "push", "a_team_alice" ] )
+
+        os.chdir( bob_local )
+        gitCmd( [ "clone", f"corncob::{alice_url}", "alice" ] )
+        os.chdir( "alice" )
+        with open( "hi_bob.txt", "a" ) as file:
+            file.write( " Hello Alice!" )
+        gitCmd( [ "commit", "-am", "back at you" ] )
+        gitCmd( [ "push", "origin", "main" ] )
+
+        os.chdir( alice_local )
+        test_utils.corncob_cmd( [ "fetch", "a_team_alice" ] )
+        test_utils.corncob_cmd( [ "merge", "a_team_alice", "main" ] )
+        with open( "hi_bob.txt", "a" ) as file:
+            file.write( " How about dinner?" )
+        gitCmd( [ "commit", "-am", "a proposal" ] )
+        test_utils.corncob_cmd( [ "push", "a_team_alice" ] )
+
+        os.chdir( os.path.join( bob_local, "alice" ) )
+        gitCmd( [ "pull", "--ff-only", "origin", "main" ] )
+
+        with open( "hi_bob.txt", "r" ) as file:
+            text = file.read()
+        print( text )
+        if text != "Hi there Bob! Hello Alice! How about dinner?":
+            print( "ERROR. Bob didn't get Alice's changes through git pull" )
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit( main() )
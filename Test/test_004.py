@@ -0,0 +1,101 @@
+import tempfile
+import os
+import sys
+import random
+from corncob_test_utils import CorncobTest, StorageServer, gitCmd
+
+# Chunked, resumable bundle downloads from a server that drops connections
+# part way through responses
+
+def main():
+
+    corncob_dir = os.getenv( "CORNCOB_DIR" )
+    if corncob_dir == None:
+        print( "ERROR. CORNCOB_DIR env var not defined" )
+        return 1
+
+    test_utils = CorncobTest( corncob_dir )
+    rng = random.Random( 4 )
+
+    with ( tempfile.TemporaryDirectory() as alice_local,
+           tempfile.TemporaryDirectory() as storage,
+           tempfile.TemporaryDirectory() as bob_local,
+           StorageServer( storage ) as server ):
+        print( f'Alice local: {alice_local}  Storage: {storage}  Bob local: {bob_local}  Server: {server.url}' )
+
+        def push_big_file( name ):
+            # Random data doesn't compress, so the bundle spans several 4 MiB chunks
+            os.chdir( alice_local )
+            with open( name, "wb" ) as file:
+                file.write( rng.randbytes( 9 << 20 ) )
+            gitCmd( [ "add", name ] )
+            gitCmd( [ "commit", "-m", f"add {name}" ] )
+            test_utils.corncob_cmd( [ "push", "storage" ] )
+
+        def bundle_gets():
+            return [ get for get in server.gets if get[ 0 ].endswith( ".bundle" ) ]
+
+        os.chdir( alice_local )
+        gitCmd( [ "init", "-b", "main" ] )
+        with open( "readme.txt", "w" ) as file:
+            file.write( "Big files ahead" )
+        gitCmd( [ "add", "readme.txt" ] )
+        gitCmd( [ "commit", "-m", "readme" ] )
+        test_utils.corncob_cmd( [ "add", "storage", server.url ] )
+        test_utils.corncob_cmd( [ "push", "storage" ] )
+
+        os.chdir( bob_local )
+        test_utils.corncob_cmd( [ "clone", "storage", server.url ] )
+
+        # Every other bundle response is cut off; retries of single chunks get through
+        push_big_file( "one.bin" )
+        drops = [ 0 ]
+        def every_other( path ):
+            if path.endswith( ".bundle" ):
+                drops[ 0 ] += 1
+                return 1 == drops[ 0 ] % 2
+            return False
+        server.fault = every_other
+        server.gets.clear()
+        os.chdir( bob_local )
+        test_utils.corncob_cmd( [ "fetch", "storage" ] )
+        if 0 == len( bundle_gets() ) or any( None == get[ 1 ] for get in bundle_gets() ):
+            print( f"ERROR. Expected range requests for the bundle, got {bundle_gets()}" )
+            return 1
+        if gitCmd( [ "rev-parse", "storage-corncob-bundle-tmp/main" ] ).stdout != gitCmd( [ "-C", alice_local, "rev-parse", "main" ] ).stdout:
+            print( "ERROR. Bob didn't get one.bin through the faulty server" )
+            return 1
+
+        # The server goes away after one chunk. The next fetch only asks for the rest.
+        push_big_file( "two.bin" )
+        served = [ 0 ]
+        def after_one_chunk( path ):
+            if path.endswith( ".bundle" ):
+                served[ 0 ] += 1
+                return 1 < served[ 0 ]
+            return False
+        server.fault = after_one_chunk
+        os.chdir( bob_local )
+        result = test_utils.corncob_cmd( [ "fetch", "storage" ], raise_on_error=False )
+        if 0 == result.returncode:
+            print( "ERROR. Fetch should have failed while the server drops everything" )
+            return 1
+
+        server.fault = None
+        server.gets.clear()
+        test_utils.corncob_cmd( [ "fetch", "storage" ] )
+        ranges = set( get[ 1 ] for get in bundle_gets() )
+        print( f"Resumed with {sorted( ranges )}" )
+        if 2 != len( ranges ):
+            print( f"ERROR. Expected the resumed fetch to skip the chunk it already had, got {sorted( ranges )}" )
+            return 1
+
+        test_utils.corncob_cmd( [ "merge", "storage", "main" ] )
+        with open( "two.bin", "rb" ) as bob_file, open( os.path.join( alice_local, "two.bin" ), "rb" ) as alice_file:
+            if bob_file.read() != alice_file.read():
+                print( "ERROR. two.bin differs after the resumed fetch" )
+                return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit( main() )
@@ -0,0 +1,138 @@
+import tempfile
+import os
+import sys
+import random
+import json
+from corncob_test_utils import CorncobTest, StorageServer, gitCmd
+
+# Remotes in chunk store mode: bundles kept as shared content-defined chunks,
+# downloads that only fetch the chunks missing from the local cache, and a
+# snapshot that mostly reuses the chunks already on the remote
+
+def main():
+
+    corncob_dir = os.getenv( "CORNCOB_DIR" )
+    if corncob_dir == None:
+        print( "ERROR. CORNCOB_DIR env var not defined" )
+        return 1
+
+    test_utils = CorncobTest( corncob_dir )
+    rng = random.Random( 5 )
+
+    with ( tempfile.TemporaryDirectory() as alice_local,
+           tempfile.TemporaryDirectory() as storage_a,
+           tempfile.TemporaryDirectory() as storage_b,
+           tempfile.TemporaryDirectory() as bob_local,
+           StorageServer( storage_a ) as server_a,
+           StorageServer( storage_b ) as server_b ):
+        print( f'Alice local: {alice_local}  Storage: {storage_a} {storage_b}  Bob local: {bob_local}' )
+
+        def stored( storage, prefix ):
+            return dict( ( name, os.path.getsize( os.path.join( storage, name ) ) )
+                         for name in os.listdir( storage ) if name.startswith( prefix ) )
+
+        def chunk_gets( server ):
+            return [ get[ 0 ] for get in server.gets if os.path.basename( get[ 0 ] ).startswith( "K-" ) ]
+
+        os.chdir( alice_local )
+        gitCmd( [ "init", "-b", "main" ] )
+        gitCmd( [ "config", "corncob.chunkStore", "true" ] )
+        with open( "readme.txt", "w" ) as file:
+            file.write( "Big files ahead" )
+        gitCmd( [ "add", "readme.txt" ] )
+        gitCmd( [ "commit", "-m", "readme" ] )
+        test_utils.corncob_cmd( [ "add", "a", server_a.url ] )
+        test_utils.corncob_cmd( [ "add", "b", server_b.url ] )
+        test_utils.corncob_cmd( [ "push", "a" ] )
+        test_utils.corncob_cmd( [ "push", "b" ] )
+
+        # Random data doesn't compress, so the bundle spans several chunks
+        with open( "big.bin", "wb" ) as file:
+            file.write( rng.randbytes( 9 << 20 ) )
+        gitCmd( [ "add", "big.bin" ] )
+        gitCmd( [ "commit", "-m", "add big.bin" ] )
+        test_utils.corncob_cmd( [ "push", "a" ] )
+
+        os.chdir( bob_local )
+        test_utils.corncob_cmd( [ "clone", "a", server_a.url ] )
+        test_utils.corncob_cmd( [ "add", "b", server_b.url ] )
+
+        # b gets big.bin in the same bundle as a commit Bob doesn't have yet
+        os.chdir( alice_local )
+        with open( "readme.txt", "a" ) as file:
+            file.write( ". Here they are" )
+        gitCmd( [ "commit", "-am", "more readme" ] )
+        test_utils.corncob_cmd( [ "push", "b" ] )
+        test_utils.corncob_cmd( [ "push", "a" ] )
+
+        for storage in [ storage_a, storage_b ]:
+            bundles = [ name for name in stored( storage, "B-" ) if not name.endswith( ".chunks" ) ]
+            if 0 != len( bundles ):
+                print( f"ERROR. Expected no bundle files in chunk store mode, got {bundles}" )
+                return 1
+        print( f"Chunks on a: {len( stored( storage_a, 'K-' ) )}  on b: {len( stored( storage_b, 'K-' ) )}" )
+
+        os.chdir( bob_local )
+        server_b.gets.clear()
+        test_utils.corncob_cmd( [ "fetch", "b" ] )
+        fetched = sum( stored( storage_b, "K-" )[ os.path.basename( path ) ] for path in chunk_gets( server_b ) )
+        total = sum( stored( storage_b, "K-" ).values() )
+        print( f"Fetched {fetched} of {total} chunk bytes from b" )
+        if 0 == fetched or fetched * 2 > total:
+            print( "ERROR. Expected most of b's bundle to come from the chunks fetched from a" )
+            return 1
+        if gitCmd( [ "rev-parse", "b-corncob-bundle-tmp/main" ] ).stdout != gitCmd( [ "-C", alice_local, "rev-parse", "main" ] ).stdout:
+            print( "ERROR. Bob didn't get main from b" )
+            return 1
+
+        # The snapshots repeat what a already has, so few new chunks are uploaded
+        os.chdir( alice_local )
+        before = stored( storage_a, "K-" )
+        manifests = stored( storage_a, "B-" )
+        test_utils.corncob_cmd( [ "compact", "a" ] )
+        added = sum( size for ( name, size ) in stored( storage_a, "K-" ).items() if name not in before )
+        snapshot_bytes = 0
+        for name in set( stored( storage_a, "B-" ) ) - set( manifests ):
+            with open( os.path.join( storage_a, name ), "r" ) as strm:
+                snapshot_bytes += json.load( strm )[ "size" ]
+        print( f"Compact added {added} chunk bytes for {snapshot_bytes} bytes of snapshots" )
+        if added * 2 > snapshot_bytes:
+            print( "ERROR. Expected the snapshot to reuse the chunks already on a" )
+            return 1
+
+        os.chdir( bob_local )
+        test_utils.corncob_cmd( [ "fetch", "a" ] )
+        test_utils.corncob_cmd( [ "merge", "a", "main" ] )
+        with open( "big.bin", "rb" ) as bob_file, open( os.path.join( alice_local, "big.bin" ), "rb" ) as alice_file:
+            if bob_file.read() != alice_file.read():
+                print( "ERROR. big.bin differs after fetching from the chunk stores" )
+                return 1
+        with open( "readme.txt", "r" ) as file:
+            if "Big files ahead. Here they are" != file.read():
+                print( "ERROR. Bob didn't get Alice's last commit" )
+                return 1
+
+        # --gc leaves exactly the chunks the remaining manifests name
+        os.chdir( alice_local )
+        chunks_before = stored( storage_a, "K-" )
+        test_utils.corncob_cmd( [ "compact", "a", "--gc" ] )
+        named = set()
+        for name in stored( storage_a, "B-" ):
+            with open( os.path.join( storage_a, name ), "r" ) as strm:
+                named.update( f"K-{sha}" for [ sha, _ ] in json.load( strm )[ "chunks" ] )
+        chunks_after = set( stored( storage_a, "K-" ) )
+        print( f"Chunks on a before --gc: {len( chunks_before )}  after: {len( chunks_after )}" )
+        if chunks_after != named or len( chunks_after ) == len( chunks_before ):
+            print( f"ERROR. Expected --gc to delete just the unreferenced chunks ({len( named )} named)" )
+            return 1
+
+        with tempfile.TemporaryDirectory() as carol_local:
+            os.chdir( carol_local )
+            test_utils.corncob_cmd( [ "clone", "a", server_a.url ] )
+            if gitCmd( [ "rev-parse", "main" ] ).stdout != gitCmd( [ "-C", alice_local, "rev-parse", "main" ] ).stdout:
+                print( "ERROR. Clone after --gc didn't get main" )
+                return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit( main() )
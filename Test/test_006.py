@@ -0,0 +1,86 @@
+import tempfile
+import os
+import sys
+from corncob_test_utils import CorncobTest, StorageServer, gitCmd
+
+# Alice and Bob push different branches to one shared remote, interleaved:
+# Bob's main, Alice's side, Bob's main again. Alice already has the link just
+# below the newest one, but still needs the bundle of Bob's first push
+
+def check_interleaved( test_utils, url, alice_local, bob_local ):
+
+    os.chdir( alice_local )
+    gitCmd( [ "init", "-b", "main" ] )
+    with open( "plan.txt", "w" ) as file:
+        file.write( "The plan\n" )
+    gitCmd( [ "add", "plan.txt" ] )
+    gitCmd( [ "commit", "-m", "plan" ] )
+    test_utils.corncob_cmd( [ "add", "shared", url ] )
+    test_utils.corncob_cmd( [ "push", "shared" ] )
+
+    os.chdir( bob_local )
+    test_utils.corncob_cmd( [ "clone", "shared", url ] )
+    with open( "plan.txt", "a" ) as file:
+        file.write( "Step one\n" )
+    gitCmd( [ "commit", "-am", "step one" ] )
+    test_utils.corncob_cmd( [ "push", "shared", "main" ] )
+
+    os.chdir( alice_local )
+    gitCmd( [ "checkout", "-b", "side" ] )
+    with open( "notes.txt", "w" ) as file:
+        file.write( "Side notes\n" )
+    gitCmd( [ "add", "notes.txt" ] )
+    gitCmd( [ "commit", "-m", "notes" ] )
+    test_utils.corncob_cmd( [ "push", "shared", "side" ] )
+
+    os.chdir( bob_local )
+    with open( "plan.txt", "a" ) as file:
+        file.write( "Step two\n" )
+    gitCmd( [ "commit", "-am", "step two" ] )
+    test_utils.corncob_cmd( [ "push", "shared", "main" ] )
+    bob_main = gitCmd( [ "rev-parse", "main" ] ).stdout
+
+    os.chdir( alice_local )
+    test_utils.corncob_cmd( [ "fetch", "shared" ] )
+    if bob_main != gitCmd( [ "rev-parse", "shared-corncob-bundle-tmp/main" ] ).stdout:
+        print( "ERROR. Alice didn't get both of Bob's pushes to main" )
+        return False
+    if 0 != gitCmd( [ "fsck", "--connectivity-only" ], False ).returncode:
+        print( "ERROR. Alice's repo is missing objects after the fetch" )
+        return False
+
+    os.chdir( bob_local )
+    test_utils.corncob_cmd( [ "fetch", "shared" ] )
+    if gitCmd( [ "-C", alice_local, "rev-parse", "side" ] ).stdout != gitCmd( [ "rev-parse", "shared-corncob-bundle-tmp/side" ] ).stdout:
+        print( "ERROR. Bob didn't get Alice's side branch" )
+        return False
+    return True
+
+
+def main():
+
+    corncob_dir = os.getenv( "CORNCOB_DIR" )
+    if corncob_dir == None:
+        print( "ERROR. CORNCOB_DIR env var not defined" )
+        return 1
+
+    test_utils = CorncobTest( corncob_dir )
+
+    with ( tempfile.TemporaryDirectory() as storage,
+           tempfile.TemporaryDirectory() as alice_local,
+           tempfile.TemporaryDirectory() as bob_local ):
+        print( f'Storage: {storage}  Alice local: {alice_local}  Bob local: {bob_local}' )
+        if not check_interleaved( test_utils, f"file://{storage}", alice_local, bob_local ):
+            return 1
+
+    with ( tempfile.TemporaryDirectory() as storage,
+           tempfile.TemporaryDirectory() as alice_local,
+           tempfile.TemporaryDirectory() as bob_local,
+           StorageServer( storage ) as server ):
+        print( f'Storage: {storage} ({server.url})  Alice local: {alice_local}  Bob local: {bob_local}' )
+        if not check_interleaved( test_utils, server.url, alice_local, bob_local ):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit( main() )
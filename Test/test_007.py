@@ -0,0 +1,113 @@
+import tempfile
+import os
+import json
+import sys
+import subprocess
+from corncob_test_utils import CorncobTest, StorageServer, gitCmd
+
+# Alice and Bob push different branches to one shared HTTP remote at the
+# same time, a few rounds in a row. Every push lands (the later one rebases
+# onto the other's link), and then each side fetches the other's branch.
+# Then an entry goes missing from the index file, as when one pusher's
+# update overwrites the other's: Bob's next fetch must write it back
+
+def start_push( corncob_dir, local, branch ):
+    cmd = [ "python3", f"{corncob_dir}{os.path.sep}git-remote-workalike-corncob.py", "push", "shared", branch ]
+    return subprocess.Popen( cmd, cwd=local, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True )
+
+
+def main():
+
+    corncob_dir = os.getenv( "CORNCOB_DIR" )
+    if corncob_dir == None:
+        print( "ERROR. CORNCOB_DIR env var not defined" )
+        return 1
+
+    test_utils = CorncobTest( corncob_dir )
+
+    with ( tempfile.TemporaryDirectory() as storage,
+           tempfile.TemporaryDirectory() as alice_local,
+           tempfile.TemporaryDirectory() as bob_local,
+           StorageServer( storage ) as server ):
+        print( f'Storage: {storage} ({server.url})  Alice local: {alice_local}  Bob local: {bob_local}' )
+
+        os.chdir( alice_local )
+        gitCmd( [ "init", "-b", "main" ] )
+        with open( "menu.txt", "w" ) as file:
+            file.write( "Menu\n" )
+        gitCmd( [ "add", "menu.txt" ] )
+        gitCmd( [ "commit", "-m", "menu" ] )
+        test_utils.corncob_cmd( [ "add", "shared", server.url ] )
+        test_utils.corncob_cmd( [ "push", "shared" ] )
+
+        os.chdir( bob_local )
+        test_utils.corncob_cmd( [ "clone", "shared", server.url ] )
+
+        gitCmd( [ "-C", alice_local, "checkout", "-b", "starters" ] )
+        gitCmd( [ "-C", bob_local, "checkout", "-b", "desserts" ] )
+        rebases = 0
+        for i in range( 3 ):
+            for [ local, branch ] in [ [ alice_local, "starters" ], [ bob_local, "desserts" ] ]:
+                with open( os.path.join( local, f"{branch}.txt" ), "a" ) as file:
+                    file.write( f"{branch} {i}\n" )
+                gitCmd( [ "-C", local, "add", f"{branch}.txt" ] )
+                gitCmd( [ "-C", local, "commit", "-m", f"{branch} {i}" ] )
+
+            pushes = [ start_push( corncob_dir, alice_local, "starters" ), start_push( corncob_dir, bob_local, "desserts" ) ]
+            for push in pushes:
+                [ out, err ] = push.communicate()
+                if 0 != push.returncode:
+                    print( f"ERROR. Concurrent push failed in round {i}. o:'{out}' e:'{err}'" )
+                    return 1
+                rebases += out.count( "Rebasing" )
+        print( f"Pushes that rebased onto the other's link: {rebases}" )
+
+        os.chdir( alice_local )
+        test_utils.corncob_cmd( [ "fetch", "shared" ] )
+        if gitCmd( [ "-C", bob_local, "rev-parse", "desserts" ] ).stdout != gitCmd( [ "rev-parse", "shared-corncob-bundle-tmp/desserts" ] ).stdout:
+            print( "ERROR. Alice didn't get Bob's branch" )
+            return 1
+
+        os.chdir( bob_local )
+        test_utils.corncob_cmd( [ "fetch", "shared" ] )
+        if gitCmd( [ "-C", alice_local, "rev-parse", "starters" ] ).stdout != gitCmd( [ "rev-parse", "shared-corncob-bundle-tmp/starters" ] ).stdout:
+            print( "ERROR. Bob didn't get Alice's branch" )
+            return 1
+        test_utils.corncob_cmd( [ "merge", "shared", "starters" ] )
+
+        with open( "starters.txt", "r" ) as file:
+            text = file.read()
+        print( text )
+        if "starters 0\nstarters 1\nstarters 2\n" != text:
+            print( "ERROR. Bob's merge of Alice's branch is incomplete" )
+            return 1
+
+        os.chdir( alice_local )
+        for i in range( 3, 5 ):
+            with open( "starters.txt", "a" ) as file:
+                file.write( f"starters {i}\n" )
+            gitCmd( [ "commit", "-am", f"starters {i}" ] )
+            test_utils.corncob_cmd( [ "push", "shared", "starters" ] )
+        index_path = os.path.join( storage, "I-0.yaml" )
+        with open( index_path, "r" ) as file:
+            entries = json.load( file )
+        lost = entries[ -2 ]
+        with open( index_path, "w" ) as file:
+            json.dump( [ e for e in entries if e != lost ], file )
+
+        os.chdir( bob_local )
+        test_utils.corncob_cmd( [ "fetch", "shared" ] )
+        if gitCmd( [ "-C", alice_local, "rev-parse", "starters" ] ).stdout != gitCmd( [ "rev-parse", "shared-corncob-bundle-tmp/starters" ] ).stdout:
+            print( "ERROR. Bob's fetch over a gap in the index didn't reach Alice's branch" )
+            return 1
+        if 0 != gitCmd( [ "fsck", "--connectivity-only" ], False ).returncode:
+            print( "ERROR. Bob's repo is missing objects after fetching over a gap in the index" )
+            return 1
+        with open( index_path, "r" ) as file:
+            if not lost in json.load( file ):
+                print( "ERROR. The fetch didn't write the lost index entry back" )
+                return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit( main() )
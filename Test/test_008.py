@@ -0,0 +1,103 @@
+import tempfile
+import os
+import sys
+from corncob_test_utils import CorncobTest, StorageServer, gitCmd
+
+# Alice compacts her remote and deletes what the snapshot supersedes
+# (compact --gc) while Bob is several links behind. Bob's fetch, and Carol's
+# shallow clone once deepened, must all end at Alice's main
+
+def check_compacted( test_utils, url, storage, alice_local, bob_local, carol_local ):
+
+    def push_notes( first, count ):
+        for i in range( first, first + count ):
+            with open( "notes.txt", "a" ) as file:
+                file.write( f"Note {i}\n" )
+            gitCmd( [ "commit", "-am", f"note {i}" ] )
+            test_utils.corncob_cmd( [ "push", "shared" ] )
+
+    os.chdir( alice_local )
+    gitCmd( [ "init", "-b", "main" ] )
+    with open( "notes.txt", "w" ) as file:
+        file.write( "Notes\n" )
+    gitCmd( [ "add", "notes.txt" ] )
+    gitCmd( [ "commit", "-m", "notes" ] )
+    test_utils.corncob_cmd( [ "add", "shared", url ] )
+    test_utils.corncob_cmd( [ "push", "shared" ] )
+    push_notes( 0, 4 )
+
+    os.chdir( bob_local )
+    test_utils.corncob_cmd( [ "clone", "shared", url ] )
+
+    os.chdir( alice_local )
+    push_notes( 4, 3 )
+    links_before = [ name for name in os.listdir( storage ) if name.startswith( "L-" ) ]
+    test_utils.corncob_cmd( [ "compact", "shared", "--gc" ] )
+    links_after = [ name for name in os.listdir( storage ) if name.startswith( "L-" ) ]
+    print( f"Links before compact --gc: {len( links_before )}  after: {len( links_after )}" )
+    if len( links_after ) >= len( links_before ):
+        print( "ERROR. compact --gc didn't delete the superseded links" )
+        return False
+    push_notes( 7, 2 )
+    alice_main = gitCmd( [ "rev-parse", "main" ] ).stdout
+
+    # Bob's links were deleted: he catches up from the snapshot
+    os.chdir( bob_local )
+    test_utils.corncob_cmd( [ "fetch", "shared" ] )
+    test_utils.corncob_cmd( [ "merge", "shared", "main" ] )
+    if alice_main != gitCmd( [ "rev-parse", "main" ] ).stdout:
+        print( "ERROR. Bob's fetch after compact --gc didn't reach Alice's main" )
+        return False
+
+    os.chdir( carol_local )
+    test_utils.corncob_cmd( [ "clone", "shared", url, "--depth", "2" ] )
+    if not os.path.exists( os.path.join( ".git", "shallow" ) ):
+        print( "ERROR. Expected a shallow clone" )
+        return False
+    if alice_main != gitCmd( [ "rev-parse", "main" ] ).stdout:
+        print( "ERROR. Carol's shallow clone isn't at Alice's main" )
+        return False
+    test_utils.corncob_cmd( [ "deepen", "shared" ] )
+    if os.path.exists( os.path.join( ".git", "shallow" ) ):
+        print( "ERROR. Still shallow after deepen" )
+        return False
+    carol_log = gitCmd( [ "log", "--format=%H", "main" ] ).stdout
+    if gitCmd( [ "-C", alice_local, "log", "--format=%H", "main" ] ).stdout != carol_log:
+        print( "ERROR. Carol's history after deepen differs from Alice's" )
+        return False
+    if 0 != gitCmd( [ "fsck", "--connectivity-only" ], False ).returncode:
+        print( "ERROR. Carol's repo is missing objects after deepen" )
+        return False
+    print( f"Carol has all {len( carol_log.splitlines() )} commits" )
+    return True
+
+
+def main():
+
+    corncob_dir = os.getenv( "CORNCOB_DIR" )
+    if corncob_dir == None:
+        print( "ERROR. CORNCOB_DIR env var not defined" )
+        return 1
+
+    test_utils = CorncobTest( corncob_dir )
+
+    with ( tempfile.TemporaryDirectory() as storage,
+           tempfile.TemporaryDirectory() as alice_local,
+           tempfile.TemporaryDirectory() as bob_local,
+           tempfile.TemporaryDirectory() as carol_local ):
+        print( f'Storage: {storage}  Alice local: {alice_local}  Bob local: {bob_local}  Carol local: {carol_local}' )
+        if not check_compacted( test_utils, f"file://{storage}", storage, alice_local, bob_local, carol_local ):
+            return 1
+
+    with ( tempfile.TemporaryDirectory() as storage,
+           tempfile.TemporaryDirectory() as alice_local,
+           tempfile.TemporaryDirectory() as bob_local,
+           tempfile.TemporaryDirectory() as carol_local,
+           StorageServer( storage ) as server ):
+        print( f'Storage: {storage} ({server.url})  Alice local: {alice_local}  Bob local: {bob_local}  Carol local: {carol_local}' )
+        if not check_compacted( test_utils, server.url, storage, alice_local, bob_local, carol_local ):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit( main() )
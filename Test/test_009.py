@@ -0,0 +1,103 @@
+import tempfile
+import os
+import sys
+import subprocess
+from corncob_test_utils import CorncobTest, StorageServer, gitCmd
+
+# Bob runs push, fetch and status through an agent started in the background.
+# The agent keeps its HTTP connections between commands, so once it has
+# connected, commands that really go through it open no new ones
+
+def main():
+
+    corncob_dir = os.getenv( "CORNCOB_DIR" )
+    if corncob_dir == None:
+        print( "ERROR. CORNCOB_DIR env var not defined" )
+        return 1
+
+    test_utils = CorncobTest( corncob_dir )
+
+    with ( tempfile.TemporaryDirectory() as storage,
+           tempfile.TemporaryDirectory() as alice_local,
+           tempfile.TemporaryDirectory() as bob_local,
+           StorageServer( storage ) as server ):
+        print( f'Storage: {storage} ({server.url})  Alice local: {alice_local}  Bob local: {bob_local}' )
+
+        os.chdir( alice_local )
+        gitCmd( [ "init", "-b", "main" ] )
+        with open( "hi_bob.txt", "w" ) as file:
+            file.write( "Hi there Bob!" )
+        gitCmd( [ "add", "hi_bob.txt" ] )
+        gitCmd( [ "commit", "-m", "greeting" ] )
+        test_utils.corncob_cmd( [ "add", "shared", server.url ] )
+        test_utils.corncob_cmd( [ "push", "shared" ] )
+
+        os.chdir( bob_local )
+        test_utils.corncob_cmd( [ "clone", "shared", server.url ] )
+
+        # Without an agent, each command connects afresh
+        before = server.connections
+        test_utils.corncob_cmd( [ "fetch", "shared" ] )
+        if server.connections == before:
+            print( "ERROR. Expected the CLI to connect to the server itself" )
+            return 1
+
+        cmd = [ "python3", f"{corncob_dir}{os.path.sep}git-remote-workalike-corncob.py", "agent" ]
+        agent = subprocess.Popen( cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True )
+        try:
+            print( agent.stdout.readline().strip() )
+            test_utils.corncob_cmd( [ "fetch", "shared" ] )
+            connected = server.connections
+
+            with open( "hi_bob.txt", "a" ) as file:
+                file.write( " Hello Alice!" )
+            gitCmd( [ "commit", "-am", "back at you" ] )
+            test_utils.corncob_cmd( [ "push", "shared" ] )
+            pushed = server.connections
+
+            # Alice has no agent
+            os.chdir( alice_local )
+            with open( "dinner.txt", "w" ) as file:
+                file.write( "Dinner at 8?" )
+            gitCmd( [ "add", "dinner.txt" ] )
+            gitCmd( [ "commit", "-m", "dinner" ] )
+            test_utils.corncob_cmd( [ "fetch", "shared" ] )
+            test_utils.corncob_cmd( [ "merge", "shared", "main" ] )
+            test_utils.corncob_cmd( [ "push", "shared" ] )
+            connected_alice = server.connections
+
+            os.chdir( bob_local )
+            test_utils.corncob_cmd( [ "fetch", "shared" ] )
+            test_utils.corncob_cmd( [ "merge", "shared", "main" ] )
+            status = test_utils.corncob_cmd( [ "status", "shared" ] ).stdout
+            print( status )
+            opened = ( pushed - connected ) + ( server.connections - connected_alice )
+            print( f"Connections opened by Bob's commands through the agent: {opened}" )
+            if 0 != opened or connected_alice == pushed:
+                print( "ERROR. Expected Bob's commands to reuse the agent's connections" )
+                return 1
+
+            result = test_utils.corncob_cmd( [ "agent", "stop" ] )
+            [ out, _ ] = agent.communicate( timeout=30 )
+        finally:
+            if None == agent.returncode:
+                agent.kill()
+                agent.communicate()
+        if 0 != agent.returncode or not "Agent stopping" in result.stdout:
+            print( f"ERROR. The agent didn't stop cleanly => {agent.returncode}. o:'{out}'" )
+            return 1
+        if os.path.exists( os.path.join( ".git", "corncob", "agent.sock" ) ):
+            print( "ERROR. The agent left its socket behind" )
+            return 1
+
+        with open( "dinner.txt", "r" ) as file:
+            if "Dinner at 8?" != file.read():
+                print( "ERROR. Bob didn't get Alice's changes through the agent" )
+                return 1
+        if gitCmd( [ "rev-parse", "main" ] ).stdout != gitCmd( [ "-C", alice_local, "rev-parse", "main" ] ).stdout:
+            print( "ERROR. Bob's main differs from Alice's" )
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit( main() )
@@ -0,0 +1,88 @@
+import tempfile
+import os
+import sys
+from corncob_test_utils import CorncobTest, StorageServer, gitCmd
+
+# Bob pushes from a stale clone, without fetching Alice's newer push first.
+# The push is refused, the remote keeps Alice's commit, and Bob gets through
+# after fetching and merging. push --force still moves the branch back
+
+def main():
+
+    corncob_dir = os.getenv( "CORNCOB_DIR" )
+    if corncob_dir == None:
+        print( "ERROR. CORNCOB_DIR env var not defined" )
+        return 1
+
+    test_utils = CorncobTest( corncob_dir )
+
+    with ( tempfile.TemporaryDirectory() as storage,
+           tempfile.TemporaryDirectory() as alice_local,
+           tempfile.TemporaryDirectory() as bob_local,
+           StorageServer( storage ) as server ):
+        print( f'Storage: {storage} ({server.url})  Alice local: {alice_local}  Bob local: {bob_local}' )
+
+        def remote_main():
+            os.chdir( alice_local )
+            test_utils.corncob_cmd( [ "fetch", "shared" ] )
+            return gitCmd( [ "rev-parse", "shared-corncob-bundle-tmp/main" ] ).stdout
+
+        os.chdir( alice_local )
+        gitCmd( [ "init", "-b", "main" ] )
+        with open( "plan.txt", "w" ) as file:
+            file.write( "The plan\n" )
+        gitCmd( [ "add", "plan.txt" ] )
+        gitCmd( [ "commit", "-m", "plan" ] )
+        test_utils.corncob_cmd( [ "add", "shared", server.url ] )
+        test_utils.corncob_cmd( [ "push", "shared" ] )
+
+        os.chdir( bob_local )
+        test_utils.corncob_cmd( [ "clone", "shared", server.url ] )
+        first = gitCmd( [ "rev-parse", "main" ] ).stdout
+
+        os.chdir( alice_local )
+        with open( "plan.txt", "a" ) as file:
+            file.write( "Alice's step\n" )
+        gitCmd( [ "commit", "-am", "alice" ] )
+        test_utils.corncob_cmd( [ "push", "shared" ] )
+        alice_main = gitCmd( [ "rev-parse", "main" ] ).stdout
+
+        os.chdir( bob_local )
+        with open( "notes.txt", "w" ) as file:
+            file.write( "Bob's notes\n" )
+        gitCmd( [ "add", "notes.txt" ] )
+        gitCmd( [ "commit", "-m", "bob" ] )
+        result = test_utils.corncob_cmd( [ "push", "shared" ], False )
+        print( result.stdout )
+        if 0 == result.returncode:
+            print( "ERROR. A push from a stale clone went through" )
+            return 1
+        if alice_main != remote_main():
+            print( "ERROR. The stale push moved the remote's main" )
+            return 1
+
+        # Fetched but not merged: the remote head is here, but still not an ancestor
+        os.chdir( bob_local )
+        test_utils.corncob_cmd( [ "fetch", "shared" ] )
+        if 0 == test_utils.corncob_cmd( [ "push", "shared" ], False ).returncode:
+            print( "ERROR. A push that doesn't include the remote's head went through" )
+            return 1
+
+        test_utils.corncob_cmd( [ "merge", "shared", "main" ] )
+        test_utils.corncob_cmd( [ "push", "shared" ] )
+        bob_main = gitCmd( [ "rev-parse", "main" ] ).stdout
+        if bob_main != remote_main():
+            print( "ERROR. Bob's push after merging didn't land" )
+            return 1
+
+        os.chdir( bob_local )
+        gitCmd( [ "checkout", "--detach" ] )
+        gitCmd( [ "branch", "-f", "main", first.strip() ] )
+        test_utils.corncob_cmd( [ "push", "shared", "--force", "main" ] )
+        if first != remote_main():
+            print( "ERROR. push --force didn't move the remote's main back" )
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit( main() )
@@ -0,0 +1,76 @@
+import tempfile
+import os
+import re
+import sys
+from corncob_test_utils import CorncobTest, gitCmd
+
+# Alice pushes the same history to two remotes, north and south. Bob cloned
+# from north, and also has south and a remote whose folder is gone. His
+# `fetch --all` skips the missing one, and downloads the new commits once:
+# south's links bring nothing north's don't
+
+def main():
+
+    corncob_dir = os.getenv( "CORNCOB_DIR" )
+    if corncob_dir == None:
+        print( "ERROR. CORNCOB_DIR env var not defined" )
+        return 1
+
+    test_utils = CorncobTest( corncob_dir )
+
+    with ( tempfile.TemporaryDirectory() as north,
+           tempfile.TemporaryDirectory() as south,
+           tempfile.TemporaryDirectory() as alice_local,
+           tempfile.TemporaryDirectory() as bob_local ):
+        print( f'North: {north}  South: {south}  Alice local: {alice_local}  Bob local: {bob_local}' )
+
+        os.chdir( alice_local )
+        gitCmd( [ "init", "-b", "main" ] )
+        with open( "log.txt", "w" ) as file:
+            file.write( "Day 1\n" )
+        gitCmd( [ "add", "log.txt" ] )
+        gitCmd( [ "commit", "-m", "day 1" ] )
+        for [ name, storage ] in [ [ "north", north ], [ "south", south ] ]:
+            test_utils.corncob_cmd( [ "add", name, f"file://{storage}" ] )
+            test_utils.corncob_cmd( [ "push", name ] )
+
+        os.chdir( bob_local )
+        test_utils.corncob_cmd( [ "clone", "north", f"file://{north}" ] )
+        test_utils.corncob_cmd( [ "add", "south", f"file://{south}" ] )
+        test_utils.corncob_cmd( [ "add", "gone", f"file://{os.path.join( south, 'gone' )}" ] )
+
+        os.chdir( alice_local )
+        for day in [ 2, 3 ]:
+            with open( "log.txt", "a" ) as file:
+                file.write( f"Day {day}\n" )
+            gitCmd( [ "commit", "-am", f"day {day}" ] )
+            test_utils.corncob_cmd( [ "push", "north" ] )
+            test_utils.corncob_cmd( [ "push", "south" ] )
+        alice_main = gitCmd( [ "rev-parse", "main" ] ).stdout
+
+        os.chdir( bob_local )
+        result = test_utils.corncob_cmd( [ "fetch", "--all" ], False )
+        print( result.stdout )
+        if 0 != result.returncode:
+            print( f"ERROR. fetch --all failed over a missing remote => {result.returncode}. e:'{result.stderr}'" )
+            return 1
+        if not "Skipping remote 'gone'" in result.stdout:
+            print( "ERROR. fetch --all didn't report the missing remote" )
+            return 1
+        counts = dict( ( name, int( count ) ) for ( name, count ) in re.findall( r"^(\w+): (\d+) bundles to fetch", result.stdout, re.MULTILINE ) )
+        if sorted( counts.keys() ) != [ "north", "south" ] or sorted( counts.values() ) != [ 0, 2 ]:
+            print( f"ERROR. Expected Alice's two links from one remote only, got {counts}" )
+            return 1
+        for name in [ "north", "south" ]:
+            if alice_main != gitCmd( [ "rev-parse", f"{name}-corncob-bundle-tmp/main" ] ).stdout:
+                print( f"ERROR. Bob's {name}/main isn't at Alice's main" )
+                return 1
+        test_utils.corncob_cmd( [ "merge", "north", "main" ] )
+        with open( "log.txt", "r" ) as file:
+            if "Day 1\nDay 2\nDay 3\n" != file.read():
+                print( "ERROR. Bob didn't get all of Alice's days" )
+                return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit( main() )
@@ -0,0 +1,105 @@
+import tempfile
+import os
+import sys
+import json
+from corncob_test_utils import CorncobTest, gitCmd, load_corncob_module
+
+# Bob fetches, from a folder remote, branches Alice pushed off main and a
+# chain of pushes to main. The bundles are read in place and checked against
+# their digests on their way into index-pack, rather than unbundled. Each one
+# must only be added after the bundles that have its prerequisites as refs
+
+def main():
+
+    corncob_dir = os.getenv( "CORNCOB_DIR" )
+    if corncob_dir == None:
+        print( "ERROR. CORNCOB_DIR env var not defined" )
+        return 1
+
+    test_utils = CorncobTest( corncob_dir )
+    corncob = load_corncob_module( corncob_dir )
+
+    with ( tempfile.TemporaryDirectory() as storage,
+           tempfile.TemporaryDirectory() as alice_local,
+           tempfile.TemporaryDirectory() as bob_local ):
+        print( f'Storage: {storage}  Alice local: {alice_local}  Bob local: {bob_local}' )
+
+        os.chdir( alice_local )
+        gitCmd( [ "init", "-b", "main" ] )
+        with open( "base.txt", "w" ) as file:
+            file.write( "Base\n" )
+        gitCmd( [ "add", "base.txt" ] )
+        gitCmd( [ "commit", "-m", "base" ] )
+        test_utils.corncob_cmd( [ "add", "shared", f"file://{storage}" ] )
+        test_utils.corncob_cmd( [ "push", "shared" ] )
+
+        os.chdir( bob_local )
+        test_utils.corncob_cmd( [ "clone", "shared", f"file://{storage}" ] )
+        bundles_before = set( name for name in os.listdir( storage ) if name.endswith( ".bundle" ) )
+
+        os.chdir( alice_local )
+        branches = [ "main" ]
+        for i in range( 3 ):
+            gitCmd( [ "checkout", "-b", f"topic{i}", "main" ] )
+            with open( f"topic{i}.txt", "w" ) as file:
+                file.write( f"Topic {i}\n" )
+            gitCmd( [ "add", f"topic{i}.txt" ] )
+            gitCmd( [ "commit", "-m", f"topic {i}" ] )
+            test_utils.corncob_cmd( [ "push", "shared", f"topic{i}" ] )
+            branches.append( f"topic{i}" )
+        gitCmd( [ "checkout", "main" ] )
+        for i in range( 3 ):
+            with open( "base.txt", "a" ) as file:
+                file.write( f"Step {i}\n" )
+            gitCmd( [ "commit", "-am", f"step {i}" ] )
+            test_utils.corncob_cmd( [ "push", "shared", "main" ] )
+
+        # [ prerequisites, refs ] of each bundle Bob is missing
+        new_bundles = set( name for name in os.listdir( storage ) if name.endswith( ".bundle" ) ) - bundles_before
+        headers = dict( ( name, corncob.PackStream.read_header( os.path.join( storage, name ) ) ) for name in new_bundles )
+
+        os.chdir( bob_local )
+        trace_path = os.path.join( bob_local, "trace.jsonl" )
+        os.environ[ "CORNCOB_TRACE" ] = trace_path
+        try:
+            test_utils.corncob_cmd( [ "fetch", "shared" ] )
+        finally:
+            del os.environ[ "CORNCOB_TRACE" ]
+        for name in branches:
+            if gitCmd( [ "-C", alice_local, "rev-parse", name ] ).stdout != gitCmd( [ "rev-parse", f"shared-corncob-bundle-tmp/{name}" ] ).stdout:
+                print( f"ERROR. Bob's fetch didn't get Alice's {name}" )
+                return 1
+        if 0 != gitCmd( [ "fsck", "--connectivity-only" ], False ).returncode:
+            print( "ERROR. Bob's repo is missing objects after the fetch" )
+            return 1
+
+        with open( trace_path, "r" ) as file:
+            spans = [ json.loads( line ) for line in file ]
+        if any( [ "bundle", "unbundle" ] == span.get( "args", [] )[ :2 ] for span in spans ):
+            print( "ERROR. Bundles with digests went through `git bundle unbundle`" )
+            return 1
+        applied = dict( ( span[ "bundle" ], span ) for span in spans if "git index-pack" == span[ "name" ] )
+        if set( applied.keys() ) != new_bundles:
+            print( f"ERROR. Expected index-pack for {sorted( new_bundles )}, got {sorted( applied.keys() )}" )
+            return 1
+
+        producers = dict( ( sha, name ) for ( name, [ _, refs ] ) in headers.items() for [ sha, _ ] in refs )
+        waits = 0
+        for ( name, [ prerequisites, _ ] ) in headers.items():
+            for sha in prerequisites:
+                if not sha in producers:
+                    continue
+                before = applied[ producers[ sha ] ]
+                waits += 1
+                if before[ "start" ] + before[ "dur" ] > applied[ name ][ "start" ] + 1e-5:
+                    print( f"ERROR. {name} was added before {producers[ sha ]}, which has its prerequisite {sha}" )
+                    return 1
+        print( f"{len( applied )} bundles index-packed, {waits} of them after the bundle they build on" )
+        # Bob already has what the first step builds on
+        if 2 != waits:
+            print( "ERROR. Expected each later step on main to wait for the one before" )
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit( main() )
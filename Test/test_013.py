@@ -0,0 +1,76 @@
+import tempfile
+import os
+import sys
+from corncob_test_utils import CorncobTest, StorageServer, gitCmd
+
+# A bundle on the HTTP remote gets damaged: first a flipped byte, then cut
+# short. Bob's fetch must fail on the digest its link records, leave his
+# tracking branch where it was, and succeed once the bundle is intact again
+
+def main():
+
+    corncob_dir = os.getenv( "CORNCOB_DIR" )
+    if corncob_dir == None:
+        print( "ERROR. CORNCOB_DIR env var not defined" )
+        return 1
+
+    test_utils = CorncobTest( corncob_dir )
+
+    with ( tempfile.TemporaryDirectory() as storage,
+           tempfile.TemporaryDirectory() as alice_local,
+           tempfile.TemporaryDirectory() as bob_local,
+           StorageServer( storage ) as server ):
+        print( f'Storage: {storage} ({server.url})  Alice local: {alice_local}  Bob local: {bob_local}' )
+
+        os.chdir( alice_local )
+        gitCmd( [ "init", "-b", "main" ] )
+        with open( "recipe.txt", "w" ) as file:
+            file.write( "Flour\n" )
+        gitCmd( [ "add", "recipe.txt" ] )
+        gitCmd( [ "commit", "-m", "recipe" ] )
+        test_utils.corncob_cmd( [ "add", "shared", server.url ] )
+        test_utils.corncob_cmd( [ "push", "shared" ] )
+
+        os.chdir( bob_local )
+        test_utils.corncob_cmd( [ "clone", "shared", server.url ] )
+        bob_tracking = gitCmd( [ "rev-parse", "shared-corncob-bundle-tmp/main" ] ).stdout
+        bundles_before = set( name for name in os.listdir( storage ) if name.endswith( ".bundle" ) )
+
+        os.chdir( alice_local )
+        with open( "recipe.txt", "a" ) as file:
+            file.write( "Eggs\n" * 100 )
+        gitCmd( [ "commit", "-am", "eggs" ] )
+        test_utils.corncob_cmd( [ "push", "shared" ] )
+        alice_main = gitCmd( [ "rev-parse", "main" ] ).stdout
+
+        [ bundle ] = set( name for name in os.listdir( storage ) if name.endswith( ".bundle" ) ) - bundles_before
+        bundle_path = os.path.join( storage, bundle )
+        with open( bundle_path, "rb" ) as file:
+            intact = file.read()
+        flipped = bytearray( intact )
+        flipped[ -30 ] ^= 0xff
+
+        os.chdir( bob_local )
+        for [ damage, data, expected ] in [ [ "flipped byte", bytes( flipped ), "SHA-256" ],
+                                            [ "truncated", intact[ :-30 ], f"{len( intact )} recorded" ] ]:
+            with open( bundle_path, "wb" ) as file:
+                file.write( data )
+            result = test_utils.corncob_cmd( [ "fetch", "shared" ], False )
+            print( result.stdout )
+            if 0 == result.returncode or not expected in result.stdout:
+                print( f"ERROR. Expected the fetch of a {damage} bundle to fail with '{expected}' => {result.returncode}" )
+                return 1
+            if bob_tracking != gitCmd( [ "rev-parse", "shared-corncob-bundle-tmp/main" ] ).stdout:
+                print( f"ERROR. A failed fetch of a {damage} bundle moved Bob's tracking branch" )
+                return 1
+
+        with open( bundle_path, "wb" ) as file:
+            file.write( intact )
+        test_utils.corncob_cmd( [ "fetch", "shared" ] )
+        if alice_main != gitCmd( [ "rev-parse", "shared-corncob-bundle-tmp/main" ] ).stdout:
+            print( "ERROR. Bob's fetch of the repaired bundle didn't reach Alice's main" )
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit( main() )
@@ -0,0 +1,104 @@
+import tempfile
+import os
+import sys
+import queue
+import signal
+import subprocess
+import threading
+from corncob_test_utils import CorncobTest, StorageServer, gitCmd
+
+# Bob fetches twice from an HTTP remote where nothing has changed: the
+# remote's version token is the one his clone saw, so neither fetch reads
+# latest-link, and the second reads no link at all (the first caches the
+# one the clone saw). Then Bob runs `watch`, and it must report Alice's
+# next push
+
+def main():
+
+    corncob_dir = os.getenv( "CORNCOB_DIR" )
+    if corncob_dir == None:
+        print( "ERROR. CORNCOB_DIR env var not defined" )
+        return 1
+
+    test_utils = CorncobTest( corncob_dir )
+
+    with ( tempfile.TemporaryDirectory() as storage,
+           tempfile.TemporaryDirectory() as alice_local,
+           tempfile.TemporaryDirectory() as bob_local,
+           StorageServer( storage ) as server ):
+        print( f'Storage: {storage} ({server.url})  Alice local: {alice_local}  Bob local: {bob_local}' )
+
+        os.chdir( alice_local )
+        gitCmd( [ "init", "-b", "main" ] )
+        with open( "news.txt", "w" ) as file:
+            file.write( "No news\n" )
+        gitCmd( [ "add", "news.txt" ] )
+        gitCmd( [ "commit", "-m", "no news" ] )
+        test_utils.corncob_cmd( [ "add", "shared", server.url ] )
+        test_utils.corncob_cmd( [ "push", "shared" ] )
+        # Past initial-snapshot, which isn't cached
+        with open( "news.txt", "a" ) as file:
+            file.write( "Still no news\n" )
+        gitCmd( [ "commit", "-am", "still no news" ] )
+        test_utils.corncob_cmd( [ "push", "shared" ] )
+
+        os.chdir( bob_local )
+        test_utils.corncob_cmd( [ "clone", "shared", server.url ] )
+        reads = []
+        for i in range( 2 ):
+            server.gets.clear()
+            test_utils.corncob_cmd( [ "fetch", "shared" ] )
+            print( f"GETs by unchanged fetch {i + 1}: {server.gets}" )
+            reads.append( [ os.path.basename( path ) for [ path, _ ] in server.gets ] )
+        if any( "latest-link" in name for names in reads for name in names ):
+            print( "ERROR. A fetch with nothing new read latest-link" )
+            return 1
+        # Only the check for a newer claim (C-<seq>) is left
+        if 1 != len( reads[ 1 ] ) or not reads[ 1 ][ 0 ].startswith( "C-" ):
+            print( "ERROR. The second fetch with nothing new read more than the claim after its latest link" )
+            return 1
+
+        cmd = [ "python3", f"{corncob_dir}{os.path.sep}git-remote-workalike-corncob.py", "watch", "shared" ]
+        watch = subprocess.Popen( cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True )
+        lines = queue.Queue()
+        reader = threading.Thread( target=lambda: [ lines.put( line ) for line in watch.stdout ], daemon=True )
+        reader.start()
+        try:
+            os.chdir( alice_local )
+            with open( "news.txt", "a" ) as file:
+                file.write( "Big news!\n" )
+            gitCmd( [ "commit", "-am", "big news" ] )
+            pushed = test_utils.corncob_cmd( [ "push", "shared" ] ).stdout
+            [ link_uid ] = [ line.split()[ 2 ] for line in pushed.splitlines() if line.startswith( "Pushing link" ) ]
+
+            expected = f"shared: fetched up to link {link_uid}"
+            reported = False
+            while not reported:
+                try:
+                    line = lines.get( timeout=30 )
+                except queue.Empty:
+                    break
+                print( f"watch: {line.rstrip()}" )
+                reported = expected == line.strip()
+            if not reported:
+                print( f"ERROR. watch didn't report '{expected}'" )
+                return 1
+        finally:
+            watch.send_signal( signal.SIGINT )
+            try:
+                watch.wait( timeout=30 )
+            except subprocess.TimeoutExpired:
+                watch.kill()
+                watch.wait()
+
+        os.chdir( bob_local )
+        if gitCmd( [ "-C", alice_local, "rev-parse", "main" ] ).stdout != gitCmd( [ "rev-parse", "shared-corncob-bundle-tmp/main" ] ).stdout:
+            print( "ERROR. watch didn't fetch Alice's push" )
+            return 1
+        if 0 != watch.returncode:
+            print( f"ERROR. watch didn't stop cleanly => {watch.returncode}" )
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit( main() )